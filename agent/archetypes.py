@@ -0,0 +1,267 @@
+"""
+Precomputed discovery plans for common UI archetypes.
+
+Much of the generate traffic is the same dozen archetypes: login form, pricing
+table, settings page, data table and so on. Each of them used to cost a
+discovery LLM call. The archetypes are listed in design_system/archetypes.json,
+and scripts/build_archetype_plans.py runs discovery once per archetype and
+library (untitledui, metafore). A plan is only kept if it is validated:
+
+  - it names at least one component of the library's catalog
+  - it names every component the archetype "expects" that the catalog has
+
+Plans are stored in the design-system cache
+(design_system/.archetype_cache/<library>.json) with the fingerprint of the
+catalog and archetype list they were built from. At request time match()
+maps a request to an archetype locally (phrase containment over normalized
+words, no model call). The plan is then served instead of calling discovery.
+
+Only plain requests match. Every word of an archetype phrase must be present,
+and at most ARCHETYPE_MAX_EXTRA other content words may be added ("a login
+form with social login" still matches; a login form with a map, a wizard and
+OAuth does not). Requests that modify existing code never match.
+
+When the catalog or archetypes.json changes, the stored plans stop being
+served and are rebuilt on a background thread (scheduler background lane).
+Set ARCHETYPE_AUTO_REBUILD=false to leave rebuilding to the script.
+
+Metrics: archetypes.match_rate (ratio of matches to lookups),
+archetypes.served, archetypes.rebuilds, archetypes.rejected.
+Set ARCHETYPE_PLANS=false to disable.
+
+Usage:
+    plan = archetypes.plan_for(user_request, library)  # None -> run discovery
+    python scripts/build_archetype_plans.py [--library metafore] [--force]
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+from agent import metrics, scheduler
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+DESIGN_SYSTEM_DIR = ROOT / "design_system"
+ARCHETYPES_PATH = DESIGN_SYSTEM_DIR / "archetypes.json"
+CACHE_DIR = DESIGN_SYSTEM_DIR / ".archetype_cache"
+
+LIBRARIES = {"untitledui": "catalog.json", "metafore": "metafore_catalog.json"}
+MAX_EXTRA = int(os.environ.get("ARCHETYPE_MAX_EXTRA", "2"))
+_FINGERPRINT_CHECK_S = 5.0
+
+# Words that don't change which archetype is meant
+_GENERIC = {
+    "a", "an", "the", "me", "my", "our", "i", "we", "you", "us", "please", "can", "could", "would",
+    "create", "build", "make", "generate", "design", "show", "give", "need", "want", "add", "write",
+    "for", "with", "and", "of", "to", "in", "on", "using", "use", "that", "this", "some",
+    "ui", "component", "components", "react", "tailwind", "jsx", "simple", "basic", "clean", "modern",
+    "nice", "new", "responsive", "beautiful", "minimal", "app", "website", "web", "site", "just",
+}
+_RE_WORD = re.compile(r"[a-z0-9]+")
+
+_lock = threading.Lock()
+_archetypes: tuple[float, list[dict]] | None = None  # (mtime_ns, archetypes)
+_plans: dict[str, tuple[float, str, dict | None]] = {}  # {library: (checked_at, fingerprint, plans)}
+_rebuilding: set[str] = set()
+_failed_at: dict[str, float] = {}
+_RETRY_FAILED_S = 600.0
+
+metrics.register_ratio("archetypes.match_rate", "archetypes.matches", "archetypes.lookups")
+
+
+def enabled() -> bool:
+    return os.environ.get("ARCHETYPE_PLANS", "true").lower() != "false"
+
+
+def _words(text: str) -> list[str]:
+    """Content words, lightly stemmed ("settings" == "setting")."""
+    out = []
+    for word in _RE_WORD.findall((text or "").lower()):
+        if word in _GENERIC:
+            continue
+        out.append(word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word)
+    return out
+
+
+def load_archetypes() -> list[dict]:
+    """design_system/archetypes.json (reloaded when the file changes)."""
+    global _archetypes
+    try:
+        mtime = ARCHETYPES_PATH.stat().st_mtime_ns
+    except OSError:
+        return []
+    with _lock:
+        if _archetypes is None or _archetypes[0] != mtime:
+            data = json.loads(ARCHETYPES_PATH.read_text(encoding="utf-8"))
+            _archetypes = (mtime, data.get("archetypes", []))
+        return _archetypes[1]
+
+
+def match(request: str) -> dict | None:
+    """The archetype `request` asks for, or None. The longest matching phrase wins."""
+    words = _words(request)
+    present = set(words)
+    best, best_len = None, 0
+    for archetype in load_archetypes():
+        for phrase in archetype.get("phrases", []):
+            needed = set(_words(phrase))
+            if not needed or not needed <= present:
+                continue
+            extra = sum(1 for w in words if w not in needed)
+            if extra <= MAX_EXTRA and len(needed) > best_len:
+                best, best_len = archetype, len(needed)
+    return best
+
+
+# ────────────── Stored plans ──────────────
+
+def fingerprint(library: str) -> str:
+    """Hash of the library's catalog and the archetype list the plans are built from."""
+    digest = hashlib.sha256()
+    for path in (DESIGN_SYSTEM_DIR / LIBRARIES[library], ARCHETYPES_PATH):
+        try:
+            digest.update(path.read_bytes())
+        except OSError:
+            digest.update(b"missing")
+    return digest.hexdigest()[:16]
+
+
+def _cache_path(library: str) -> Path:
+    return CACHE_DIR / f"{library}.json"
+
+
+def _current_plans(library: str) -> dict | None:
+    """{archetype id: plan} if the stored plans match the current catalog, else None
+    (and a rebuild is started). The fingerprint is re-checked every few seconds."""
+    now = time.time()
+    cached = _plans.get(library)
+    if cached and now - cached[0] < _FINGERPRINT_CHECK_S:
+        return cached[2]
+    fp = fingerprint(library)
+    if cached and cached[1] == fp and cached[2] is not None:
+        _plans[library] = (now, fp, cached[2])
+        return cached[2]
+    plans = None
+    try:
+        stored = json.loads(_cache_path(library).read_text(encoding="utf-8"))
+        if stored.get("fingerprint") == fp:
+            plans = stored.get("plans", {})
+    except (OSError, ValueError):
+        pass
+    _plans[library] = (now, fp, plans)
+    if plans is None and os.environ.get("ARCHETYPE_AUTO_REBUILD", "true").lower() != "false":
+        rebuild_in_background(library)
+    return plans
+
+
+def plan_for(request: str, library: str = "untitledui", has_previous_code: bool = False) -> str | None:
+    """Stored discovery plan for the archetype `request` matches, or None."""
+    if not enabled() or library not in LIBRARIES or has_previous_code:
+        return None
+    metrics.incr("archetypes.lookups")
+    archetype = match(request)
+    if archetype is None:
+        return None
+    metrics.incr("archetypes.matches")
+    plan = (_current_plans(library) or {}).get(archetype["id"])
+    if plan:
+        metrics.incr("archetypes.served")
+        logger.info("[archetypes] %s plan served for %s", archetype["id"], library)
+    return plan
+
+
+# ────────────── Building ──────────────
+
+def validate(plan: str, archetype: dict, components: set[str]) -> str | None:
+    """Why `plan` is rejected, or None if it is valid."""
+    if not plan or plan.startswith("Discovery failed"):
+        return "discovery failed"
+    mentioned = {name for name in components if re.search(rf"\b{re.escape(name)}\b", plan)}
+    if not mentioned:
+        return "no catalog component"
+    missing = [name for name in archetype.get("expects", []) if name in components and name not in mentioned]
+    if missing:
+        return f"missing {', '.join(missing)}"
+    return None
+
+
+async def _discover_all(library: str, archetypes: list[dict]) -> dict:
+    from agent.discovery import run_discovery
+
+    plans = await asyncio.gather(*(run_discovery(a["request"], library=library) for a in archetypes))
+    return dict(zip((a["id"] for a in archetypes), plans))
+
+
+def build(library: str, force: bool = False) -> dict:
+    """Run discovery for every archetype of `library`, validate and store the plans.
+    Skipped when the stored plans are current (unless `force`). Returns a summary."""
+    from agent import discovery
+
+    fp = fingerprint(library)
+    path = _cache_path(library)
+    if not force:
+        try:
+            if json.loads(path.read_text(encoding="utf-8")).get("fingerprint") == fp:
+                return {"library": library, "status": "current"}
+        except (OSError, ValueError):
+            pass
+
+    discovery.reload(library)
+    components = set(discovery.component_names(library))
+    archetypes = load_archetypes()
+    raw = asyncio.run(_discover_all(library, archetypes))
+
+    plans, rejected = {}, {}
+    for archetype in archetypes:
+        reason = validate(raw[archetype["id"]], archetype, components)
+        if reason:
+            rejected[archetype["id"]] = reason
+            metrics.incr("archetypes.rejected")
+            logger.warning("[archetypes] %s plan for %s rejected: %s", archetype["id"], library, reason)
+        else:
+            plans[archetype["id"]] = raw[archetype["id"]]
+    if archetypes and not plans and all(r == "discovery failed" for r in rejected.values()):
+        # Provider down / no key: keep whatever is stored and try again later
+        return {"library": library, "status": "failed", "rejected": rejected}
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"fingerprint": fp, "built": time.time(), "plans": plans, "rejected": rejected},
+                              indent=2), encoding="utf-8")
+    tmp.replace(path)
+    _plans.pop(library, None)
+    metrics.incr("archetypes.rebuilds")
+    logger.info("[archetypes] %s: %d plans stored, %d rejected", library, len(plans), len(rejected))
+    return {"library": library, "status": "built", "plans": len(plans), "rejected": rejected}
+
+
+def rebuild_in_background(library: str) -> None:
+    """build() on a daemon thread in the scheduler's background lane (once at a time per library)."""
+    with _lock:
+        if library in _rebuilding or time.time() - _failed_at.get(library, 0.0) < _RETRY_FAILED_S:
+            return
+        _rebuilding.add(library)
+
+    def run():
+        try:
+            with scheduler.background():
+                if build(library)["status"] == "failed":
+                    _failed_at[library] = time.time()
+        except Exception as e:
+            _failed_at[library] = time.time()
+            logger.error("[archetypes] rebuild for %s failed: %s", library, e)
+        finally:
+            with _lock:
+                _rebuilding.discard(library)
+            _plans.pop(library, None)
+
+    logger.info("[archetypes] plans for %s are out of date — rebuilding", library)
+    threading.Thread(target=run, name="archetypes", daemon=True).start()
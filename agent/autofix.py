@@ -0,0 +1,265 @@
+"""
+Deterministic QA auto-fixer.
+
+Most FAIL verdicts from verify_quality / check_accessibility are mechanical
+(missing root.render, stray imports, wrong border-radius, missing focus
+rings, images without alt, icon buttons without aria-label, off-palette
+colors). Each fixer below is paired with the QA issue it resolves, so the
+orchestrator can patch the code in place and re-run QA before paying for
+an LLM retry (~10-15s each).
+
+Fix rate (FAIL -> PASS without an LLM retry) is tracked in agent.metrics.
+"""
+
+import logging
+import re
+
+from agent import metrics
+from agent.jsx_slicer import tag_end
+
+logger = logging.getLogger(__name__)
+
+# ── Pre-compiled regex patterns ──
+_RE_IMPORT_STMT = re.compile(
+    r"^import\s+(?:[\s\S]*?\sfrom\s+)?['\"][^'\"\n]+['\"]\s*;?[ \t]*\r?\n?", re.MULTILINE
+)
+_RE_EXPORT_DEFAULT_NAME = re.compile(
+    r"^export\s+default\s+(?!(?:async|function|class|const)\b)[A-Za-z_]\w*\s*;?[ \t]*\r?\n?", re.MULTILINE
+)
+_RE_EXPORT_PREFIX = re.compile(r"^export\s+(?:default\s+)?(?=(?:async\s+)?(?:function|const|let|class)\b)", re.MULTILINE)
+_RE_TOP_LEVEL_COMPONENT = re.compile(
+    r"^(?:function\s+([A-Z]\w*)\s*\(|const\s+([A-Z]\w*)\s*=\s*(?:\([^)]*\)|[A-Za-z_]\w*)\s*=>)",
+    re.MULTILINE,
+)
+_RE_ANY_COMPONENT = re.compile(r"function\s+([A-Z]\w*)\s*\(")
+_RE_REACT_IMPORT = re.compile(r"^import\s+(?:[\w$]+\s*,\s*)?\{([^}]*)\}\s*from\s+['\"]react['\"]", re.MULTILINE)
+_RE_REACT_DESTRUCTURE = re.compile(r"\{([^}]*)\}\s*=\s*React\b")
+_RE_CLASSNAME = re.compile(r'(className=")([^"]*)(")')
+_RE_IMG_TAG = re.compile(r"<img[^>]*>", re.IGNORECASE)
+_RE_ICON_CHILD = re.compile(r"\s*<(?:svg|img|Icon)", re.IGNORECASE)
+_RE_RADIUS = re.compile(r"^rounded(?:-(?:none|sm|md|lg|xl|2xl|3xl|full))?$")
+_RE_TAG_NAME = re.compile(r"<([A-Za-z][\w.]*)")
+_RE_HANDLER = re.compile(r"on[A-Z]\w*=\{(?:\([^)]*\)\s*=>\s*)?([A-Za-z_]\w*)")
+_RE_SVG_BLOCK = re.compile(r"<svg[\s\S]*?</svg>", re.IGNORECASE)
+_RE_JSX_EXPR = re.compile(r"\{[^{}]*\}")
+_RE_ANY_TAG = re.compile(r"<[^>]+>")
+
+_PALETTE_MAP = {
+    "teal": "emerald", "lime": "emerald", "cyan": "blue", "sky": "blue",
+    "fuchsia": "purple", "violet": "purple", "pink": "rose", "orange": "amber",
+    "slate": "gray", "zinc": "gray", "stone": "gray", "neutral": "gray",
+}
+_RE_PALETTE = re.compile(
+    r"(?:(?<=-)(" + "|".join(_PALETTE_MAP) + r")(?=-))"
+    r"|(?:(?:(?<=\bbg-)|(?<=\btext-))(" + "|".join(_PALETTE_MAP) + r")\b)"
+)
+
+_FORM_TAGS = {"button", "input", "select", "textarea", "img", "a"}
+
+metrics.register_ratio("autofix.fix_rate", "autofix.resolved", "autofix.attempts")
+
+
+# ────────────── Helpers ──────────────
+
+def _swap_radius(classes: str, target: str, keep: tuple[str, ...]) -> str:
+    """Replace non-directional border-radius classes with `target`, keeping variant prefixes."""
+    out = []
+    for token in classes.split():
+        prefix, _, base = token.rpartition(":")
+        if _RE_RADIUS.match(base) and base not in keep:
+            token = f"{prefix}:{target}" if prefix else target
+        out.append(token)
+    return " ".join(out)
+
+
+def _brand(library: str) -> str:
+    return "purple" if library == "metafore" else "blue"
+
+
+def _label_from_handler(name: str) -> str:
+    """handleDeleteRow -> 'Delete row'."""
+    name = re.sub(r"^(?:handle|on|set|toggle)(?=[A-Z])", "", name)
+    words = re.findall(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])", name)
+    return " ".join(words).capitalize() if words else ""
+
+
+def _open_tags(code: str, tags: tuple[str, ...]):
+    """(start, attrs_start, end) of each opening tag in `tags`. Attributes are scanned
+    brace-aware, so the ">" of an `onClick={() => ...}` doesn't end the tag."""
+    for m in re.finditer(rf"<({'|'.join(tags)})\b", code):
+        yield m.start(), m.end(), tag_end(code, m.end())
+
+
+def _sub_classes(code: str, tags: tuple[str, ...], fix) -> str:
+    """Rewrite the className="..." of each opening tag in `tags` with fix(classes)."""
+    out, last = [], 0
+    for _, attrs_start, end in _open_tags(code, tags):
+        cls = _RE_CLASSNAME.search(code, attrs_start, end)
+        if not cls:
+            continue
+        out.append(code[last:cls.start(2)])
+        out.append(fix(cls.group(2)))
+        last = cls.end(2)
+    out.append(code[last:])
+    return "".join(out)
+
+
+def _react_names(specifiers: str) -> list[str]:
+    """`useState, useEffect as useEff` -> ["useState", "useEffect: useEff"] (destructuring syntax)."""
+    names = []
+    for spec in specifiers.split(","):
+        parts = spec.split()
+        if len(parts) == 3 and parts[1] == "as":
+            names.append(f"{parts[0]}: {parts[2]}")
+        elif len(parts) == 1:
+            names.append(parts[0])
+    return names
+
+
+# ────────────── Fixers (one per QA rule) ──────────────
+
+def _fix_imports(code: str, library: str) -> str:
+    # Hooks imported from 'react' are read off the global React instead
+    declared = {n.strip() for m in _RE_REACT_DESTRUCTURE.finditer(code) for n in m.group(1).split(",")}
+    hooks = [n for m in _RE_REACT_IMPORT.finditer(code) for n in _react_names(m.group(1)) if n not in declared]
+    code = _RE_IMPORT_STMT.sub("", code)
+    code = _RE_EXPORT_DEFAULT_NAME.sub("", code)
+    code = _RE_EXPORT_PREFIX.sub("", code).lstrip("\n")
+    if hooks:
+        code = f"const {{ {', '.join(dict.fromkeys(hooks))} }} = React;\n\n" + code
+    return code
+
+
+def _fix_root_render(code: str, library: str) -> str:
+    matches = [m.group(1) or m.group(2) for m in _RE_TOP_LEVEL_COMPONENT.finditer(code)]
+    if not matches:
+        m = _RE_ANY_COMPONENT.search(code)
+        matches = [m.group(1)] if m else []
+    if not matches:
+        return code
+    # The page-level component is conventionally defined last
+    return code.rstrip() + f"\n\nroot.render(React.createElement({matches[-1]}));"
+
+
+def _fix_button_radius(code: str, library: str) -> str:
+    return _sub_classes(code, ("button",), lambda cls: _swap_radius(cls, "rounded-lg", ("rounded-lg", "rounded-full")))
+
+
+def _fix_input_radius(code: str, library: str) -> str:
+    return _sub_classes(code, ("input",), lambda cls: _swap_radius(cls, "rounded-lg", ("rounded-lg",)))
+
+
+def _fix_card_radius(code: str, library: str) -> str:
+    def repl(m: re.Match) -> str:
+        cls = m.group(2)
+        lowered = cls.lower()
+        if not ("bg-white" in lowered or "card" in lowered) or "border" not in cls or "rounded-xl" in cls:
+            return m.group(0)
+        tag_start = code.rfind("<", 0, m.start())
+        tag = _RE_TAG_NAME.match(code, tag_start) if tag_start >= 0 else None
+        if tag and tag.group(1).lower() in _FORM_TAGS:
+            return m.group(0)
+        return m.group(1) + _swap_radius(cls, "rounded-xl", ("rounded-xl", "rounded-full")) + m.group(3)
+
+    return _RE_CLASSNAME.sub(repl, code)
+
+
+def _fix_palette(code: str, library: str) -> str:
+    return _RE_PALETTE.sub(lambda m: _PALETTE_MAP[m.group(1) or m.group(2)], code)
+
+
+def _fix_focus(code: str, library: str) -> str:
+    ring = f"focus:outline-none focus:ring-2 focus:ring-{_brand(library)}-500"
+    return _sub_classes(code, ("button", "input", "select", "textarea", "a"),
+                        lambda cls: cls if "focus:" in cls else f"{cls} {ring}")
+
+
+def _fix_img_alt(code: str, library: str) -> str:
+    return _RE_IMG_TAG.sub(
+        lambda m: m.group(0) if "alt=" in m.group(0) else m.group(0).replace("<img", '<img alt=""', 1),
+        code,
+    )
+
+
+def _fix_icon_buttons(code: str, library: str) -> str:
+    out, last = [], 0
+    for start, attrs_start, end in _open_tags(code, ("button",)):
+        attrs = code[attrs_start:end]
+        if "aria-label" in attrs or not _RE_ICON_CHILD.match(code, end):
+            continue
+        # Prefer visible text (icon + text buttons), then the click handler name
+        close = code.find("</button>", end)
+        inner = code[end:close] if close != -1 else ""
+        text = _RE_ANY_TAG.sub(" ", _RE_JSX_EXPR.sub(" ", _RE_SVG_BLOCK.sub(" ", inner)))
+        label = " ".join(text.split())
+        if not label:
+            handler = _RE_HANDLER.search(attrs)
+            label = _label_from_handler(handler.group(1)) if handler else ""
+        label = (label or "Icon button").replace('"', "'")[:60]
+        insert_at = attrs_start
+        out.append(code[last:insert_at])
+        out.append(f' aria-label="{label}"')
+        last = insert_at
+    out.append(code[last:])
+    return "".join(out)
+
+
+# (issue rule, message fragment, fixer name, fixer) — order matters: imports/exports
+# are stripped before root.render detection looks for the top-level component.
+_FIXERS = [
+    ("quality", "Import statements", "imports", _fix_imports),
+    ("structure", "root.render", "root_render", _fix_root_render),
+    ("untitled_ui_compliance", "Button uses", "button_radius", _fix_button_radius),
+    ("untitled_ui_compliance", "Input uses", "input_radius", _fix_input_radius),
+    ("untitled_ui_compliance", "Card-like", "card_radius", _fix_card_radius),
+    ("untitled_ui_compliance", "Non-Untitled UI color", "palette", _fix_palette),
+    ("focus", "", "focus_ring", _fix_focus),
+    ("images", "", "img_alt", _fix_img_alt),
+    ("aria", "icon-only", "icon_button_label", _fix_icon_buttons),
+]
+
+
+def is_fixable(issue: dict) -> bool:
+    """True if a deterministic fixer exists for this QA issue."""
+    rule, message = issue.get("rule", ""), issue.get("message", "").lower()
+    return any(rule == r and frag.lower() in message for r, frag, _, _ in _FIXERS)
+
+
+def autofix(code: str, issues: list[dict], library: str = "untitledui") -> tuple[str, list[str]]:
+    """Apply every fixer paired with an issue in `issues`.
+
+    Returns (patched_code, names_of_fixers_that_changed_the_code).
+    """
+    applied = []
+    for rule, fragment, name, fixer in _FIXERS:
+        if not any(i.get("rule") == rule and fragment.lower() in i.get("message", "").lower() for i in issues):
+            continue
+        try:
+            patched = fixer(code, library)
+        except Exception as e:
+            logger.warning("[autofix] %s failed: %s", name, e)
+            continue
+        if patched != code:
+            code = patched
+            applied.append(name)
+    return code, applied
+
+
+def record(resolved: bool, applied: list[str]) -> None:
+    """Record one auto-fix attempt (resolved = FAIL turned into PASS, no LLM retry needed)."""
+    metrics.incr("autofix.attempts")
+    if resolved:
+        metrics.incr("autofix.resolved")
+    for name in applied:
+        metrics.incr(f"autofix.fixes.{name}")
+
+
+def get_stats() -> dict:
+    """Attempts, resolved count and fix rate since process start."""
+    attempts = metrics.get("autofix.attempts")
+    resolved = metrics.get("autofix.resolved")
+    return {
+        "attempts": int(attempts),
+        "resolved": int(resolved),
+        "fix_rate": round(resolved / attempts, 4) if attempts else None,
+    }
@@ -0,0 +1,212 @@
+"""
+Token budgets for prompt builders.
+
+Prompts used to be bounded by character slicing (json.dumps(...)[:2000]).
+That cut JSON mid-object and said nothing about how many tokens a request
+actually sent. Prompt builders now describe a prompt as prioritized Sections
+made of structural units: catalog entries, token groups, markdown sections,
+RAG contexts, history turns, whole components. pack() fits them to the
+model's budget in two steps:
+
+  1. every section is held to its own cap (max_tokens)
+  2. while the total is over budget, the lowest-priority section shrinks
+     next, then the one above it
+
+A section that has to shrink first switches to its compact rendering (e.g.
+minified JSON). Then it keeps the units that fit, in order: the first catalog
+entries, the top-ranked RAG hits, the newest history turns. A unit is never
+cut, and required sections always keep at least one.
+
+estimate() approximates BPE token counts locally, with no tokenizer
+download. Every pack() logs its section-level token breakdown and records
+budget.<site>.tokens samples.
+
+Usage:
+    packed = budget.pack([
+        budget.Section("rules", [RULES], required=True),
+        budget.json_section("catalog", components, priority=2, max_tokens=900),
+    ], budget.budget_for("gpt-4o"), site="chat")
+    prompt = RULES + packed["catalog"]
+"""
+
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+
+from agent import metrics
+
+logger = logging.getLogger(__name__)
+
+# Input-token budgets per model for one prompt (well under the context windows;
+# larger prompts mostly cost latency). PROMPT_BUDGET_TOKENS overrides all of them.
+MODEL_BUDGETS = {
+    "claude-sonnet-4-20250514": 16000,
+    "gpt-4o": 16000,
+    "gpt-4o-mini": 8000,
+    "claude-3-5-haiku-20241022": 8000,
+}
+DEFAULT_BUDGET = 8000
+
+# Letter runs, digit runs, newline(+indent) runs, wide space runs, punctuation pairs
+_RE_PIECES = re.compile(r"[^\W\d_]+|\d+|\n\s*|[ \t]{2,}|[^\w\s]{1,2}")
+_RE_MD_SECTION = re.compile(r"(?=^## )", re.MULTILINE)
+
+
+def estimate(text: str) -> int:
+    """Approximate BPE token count: ~1 token per 8 letters of a word, per 3 digits,
+    per pair of punctuation marks and per line break (single spaces merge into the next word)."""
+    tokens = 0
+    for match in _RE_PIECES.finditer(text or ""):
+        piece = match.group()
+        if piece[0].isalpha():
+            tokens += (len(piece) + 7) // 8
+        elif piece[0].isdigit():
+            tokens += (len(piece) + 2) // 3
+        else:
+            tokens += 1
+    return tokens
+
+
+def budget_for(model: str) -> int:
+    override = os.environ.get("PROMPT_BUDGET_TOKENS", "").strip()
+    return int(override) if override else MODEL_BUDGETS.get(model, DEFAULT_BUDGET)
+
+
+@dataclass
+class Section:
+    """One part of a prompt, as units that are kept or dropped whole."""
+
+    name: str
+    units: list[str]
+    priority: int = 0  # 0 = most important; the highest number is shrunk first
+    sep: str = "\n"
+    keep: str = "head"  # "head": the first units win; "tail": the last ones (history)
+    max_tokens: int = 0  # the section's own cap (0 = only the overall budget)
+    required: bool = False
+    compact: list[str] | None = None  # cheaper rendering of the same units, tried before dropping
+    wrap: tuple[str, str] = ("", "")  # text around the kept units, e.g. JSON brackets
+
+
+def json_section(name: str, value, priority: int = 0, max_tokens: int = 0, required: bool = False) -> Section:
+    """JSON list (one unit per item) or object (one unit per top-level key), valid
+    JSON whatever is dropped; the compact rendering is minified."""
+    if isinstance(value, dict):
+        units = [f"{json.dumps(k)}: {json.dumps(v, indent=2)}" for k, v in value.items()]
+        compact = [f"{json.dumps(k)}:{json.dumps(v, separators=(',', ':'))}" for k, v in value.items()]
+        wrap = ("{\n", "\n}")
+    else:
+        units = [json.dumps(item, indent=2) for item in value or []]
+        compact = [json.dumps(item, separators=(",", ":")) for item in value or []]
+        wrap = ("[\n", "\n]")
+    return Section(name, units, priority, sep=",\n", max_tokens=max_tokens, required=required,
+                   compact=compact, wrap=wrap)
+
+
+def markdown_units(text: str) -> list[str]:
+    """Markdown split at its ## headings."""
+    return [part.strip() for part in _RE_MD_SECTION.split(text or "") if part.strip()]
+
+
+class _State:
+    def __init__(self, section: Section):
+        self.section = section
+        self.indexes = list(range(len(section.units)))
+        self.units = section.units
+        self.costs = [estimate(u) for u in section.units]
+        self.compacted = False
+        self._overhead = estimate(section.sep), estimate(section.wrap[0] + section.wrap[1])
+
+    @property
+    def tokens(self) -> int:
+        if not self.indexes:
+            return 0
+        sep, wrap = self._overhead
+        return wrap + sum(self.costs[i] for i in self.indexes) + sep * (len(self.indexes) - 1)
+
+    def use_compact(self) -> None:
+        if self.section.compact and not self.compacted:
+            self.units = self.section.compact
+            self.costs = [estimate(u) for u in self.units]
+            self.compacted = True
+
+    def shrink(self, limit: int) -> None:
+        """Keep the units that fit in `limit`, in keep order. "head" sections skip a unit
+        that doesn't fit and try the next; "tail" sections (history) stay contiguous."""
+        if self.tokens <= limit:
+            return
+        sep, wrap = self._overhead
+        tail = self.section.keep == "tail"
+        kept, used = [], wrap
+        for i in (reversed(self.indexes) if tail else self.indexes):
+            cost = self.costs[i] + (sep if kept else 0)
+            if used + cost <= limit:
+                kept.append(i)
+                used += cost
+            elif tail:
+                break
+        if not kept and self.section.required and self.indexes:
+            kept = [self.indexes[-1] if tail else self.indexes[0]]
+        self.indexes = sorted(kept)
+
+    def render(self) -> str:
+        if not self.indexes:
+            return ""
+        body = self.section.sep.join(self.units[i] for i in self.indexes)
+        return self.section.wrap[0] + body + self.section.wrap[1]
+
+
+class Packed:
+    """Result of pack(): packed[name] is the section's text ("" if dropped)."""
+
+    def __init__(self, states: list[_State], budget: int, base_tokens: int = 0):
+        self._states = {s.section.name: s for s in states}
+        self.budget = budget
+        self.base_tokens = base_tokens
+        self.tokens = base_tokens + sum(s.tokens for s in states)
+
+    def __getitem__(self, name: str) -> str:
+        return self._states[name].render()
+
+    def kept(self, name: str) -> list[int]:
+        """Indexes of the section's units that were kept, in order."""
+        return list(self._states[name].indexes)
+
+    def breakdown(self) -> str:
+        parts = [f"base {self.base_tokens}"] if self.base_tokens else []
+        for name, s in self._states.items():
+            total = len(s.section.units)
+            detail = f"{len(s.indexes)}/{total} units" if len(s.indexes) != total else ""
+            if s.compacted:
+                detail = f"{detail}, compact" if detail else "compact"
+            parts.append(f"{name} {s.tokens}" + (f" ({detail})" if detail else ""))
+        return ", ".join(parts)
+
+
+def pack(sections: list[Section], budget: int, site: str = "prompt", base: str = "") -> Packed:
+    """Fit `sections` into `budget` tokens (see module docstring) and log the breakdown.
+    `base` is fixed text sent with them (template, instructions); it counts against the budget."""
+    base_tokens = estimate(base)
+    states = [_State(section) for section in sections]
+    for s in states:
+        if s.section.max_tokens and s.tokens > s.section.max_tokens:
+            s.use_compact()
+            s.shrink(s.section.max_tokens)
+
+    for s in sorted(states, key=lambda s: s.section.priority, reverse=True):
+        over = base_tokens + sum(x.tokens for x in states) - budget
+        if over <= 0:
+            break
+        s.use_compact()
+        over = base_tokens + sum(x.tokens for x in states) - budget
+        if over > 0:
+            s.shrink(s.tokens - over)
+
+    packed = Packed(states, budget, base_tokens)
+    dropped = sum(len(s.section.units) - len(s.indexes) for s in states)
+    metrics.observe(f"budget.{site}.tokens", packed.tokens)
+    if dropped:
+        metrics.incr(f"budget.{site}.dropped_units", dropped)
+    logger.info("[budget] %s: %d/%d tokens — %s", site, packed.tokens, budget, packed.breakdown())
+    return packed
@@ -0,0 +1,203 @@
+"""
+Content-addressed response cache for the pipeline stages.
+
+Identical requests (demos, retries after a browser refresh, shared templates)
+used to re-run the whole pipeline. Stage results are now cached under
+
+    sha256(stage | normalized request | library | PROMPT_VERSION | previous-code hash)
+
+with two tiers: an in-memory LRU in front of a SQLite file on disk
+(RESPONSE_CACHE_PATH, default .cache/responses.sqlite), so entries survive a
+restart. Entries expire per stage (TTLS, override with CACHE_TTL_<STAGE>_S).
+Every entry records the design-system fingerprint it was built against. When
+the fingerprint changes (catalog/tokens/guidelines edited), that library's
+entries are purged from both tiers.
+
+Stages: "classify" (LLM escalations only), "discovery" (component plan) and
+"generation" (final code + QA report, stored only on a QA PASS). Paraphrased
+requests are handled by agent.semantic_cache.
+Set RESPONSE_CACHE=false to disable.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from agent import metrics
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Bump when prompts or output formats change in a way that makes old entries wrong
+PROMPT_VERSION = "1"
+
+TTLS = {
+    stage: float(os.environ.get(f"CACHE_TTL_{stage.upper()}_S", default))
+    for stage, default in (("classify", 7 * 86400), ("discovery", 86400), ("generation", 86400))
+}
+_MEMORY_SIZE = 512
+_FINGERPRINT_CHECK_S = 5.0
+
+_RE_SPACE = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_memory: OrderedDict[str, dict] = OrderedDict()
+_conn: sqlite3.Connection | None = None
+_fingerprints: dict[str, tuple[float, str]] = {}  # {library: (checked_at, fingerprint)}
+_puts = 0
+
+for _stage in TTLS:
+    metrics.register_ratio(f"cache.{_stage}.hit_rate", f"cache.{_stage}.hits", f"cache.{_stage}.lookups")
+
+
+def enabled() -> bool:
+    return os.environ.get("RESPONSE_CACHE", "true").lower() != "false"
+
+
+# ────────────── Keys & fingerprints ──────────────
+
+def normalize(text: str) -> str:
+    """Case/whitespace-insensitive form of a request ("Create a login form!" == "create a  login form")."""
+    return _RE_SPACE.sub(" ", (text or "").strip().lower()).rstrip(" .!?")
+
+
+def code_hash(code: str) -> str:
+    return hashlib.sha1(code.encode("utf-8")).hexdigest()[:16] if code else ""
+
+
+def make_key(stage: str, request: str, library: str = "untitledui", previous_code: str = "") -> str:
+    raw = "|".join((stage, normalize(request), library, PROMPT_VERSION, code_hash(previous_code)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _fingerprint(library: str) -> str:
+    """Design-system fingerprint (same source files as the RAG index), re-checked every few seconds."""
+    now = time.time()
+    cached = _fingerprints.get(library)
+    if cached and now - cached[0] < _FINGERPRINT_CHECK_S:
+        return cached[1]
+    try:
+        from agent.rag import _fingerprint as rag_fingerprint
+        fp = rag_fingerprint(library)
+    except Exception:
+        fp = "unknown"
+    if cached and cached[1] != fp:
+        logger.info("[cache] design system changed for %s — invalidating", library)
+        invalidate(library)
+    _fingerprints[library] = (now, fp)
+    return fp
+
+
+# ────────────── Disk tier ──────────────
+
+def db_path() -> str:
+    return os.environ.get("RESPONSE_CACHE_PATH", "").strip() or str(ROOT / ".cache" / "responses.sqlite")
+
+
+def _get_conn() -> sqlite3.Connection:
+    """SQLite connection shared across threads (access serialized by _lock)."""
+    global _conn
+    if _conn is None:
+        path = db_path()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, stage TEXT, library TEXT, fingerprint TEXT,"
+            " value TEXT, created REAL, expires REAL)"
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS cache_library ON cache(library)")
+    return _conn
+
+
+# ────────────── Public API ──────────────
+
+def get(stage: str, request: str, library: str = "untitledui", previous_code: str = "") -> dict | None:
+    """Cached value for this stage/request, or None on a miss."""
+    if not enabled() or not request:
+        return None
+    metrics.incr(f"cache.{stage}.lookups")
+    key = make_key(stage, request, library, previous_code)
+    fp = _fingerprint(library)
+    now = time.time()
+
+    with _lock:
+        entry = _memory.get(key)
+        if entry is None:
+            try:
+                row = _get_conn().execute(
+                    "SELECT library, fingerprint, value, expires FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("[cache] read failed: %s", e)
+                row = None
+            if row:
+                entry = {"library": row[0], "fingerprint": row[1], "value": json.loads(row[2]), "expires": row[3]}
+                _memory[key] = entry
+        if entry is None:
+            return None
+        if entry["expires"] < now or entry["fingerprint"] != fp:
+            _memory.pop(key, None)
+            return None
+        _memory.move_to_end(key)
+
+    metrics.incr(f"cache.{stage}.hits")
+    logger.info("[cache] %s hit (%s)", stage, key[:12])
+    return entry["value"]
+
+
+def put(stage: str, request: str, library: str, value: dict, previous_code: str = "") -> None:
+    """Store a stage result in both tiers."""
+    global _puts
+    if not enabled() or not request:
+        return
+    key = make_key(stage, request, library, previous_code)
+    now = time.time()
+    entry = {"library": library, "fingerprint": _fingerprint(library), "value": value,
+             "expires": now + TTLS.get(stage, 86400)}
+
+    with _lock:
+        _memory[key] = entry
+        _memory.move_to_end(key)
+        while len(_memory) > _MEMORY_SIZE:
+            _memory.popitem(last=False)
+        try:
+            conn = _get_conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, stage, library, entry["fingerprint"], json.dumps(value), now, entry["expires"]),
+            )
+            _puts += 1
+            if _puts % 200 == 0:
+                conn.execute("DELETE FROM cache WHERE expires < ?", (now,))
+        except sqlite3.Error as e:
+            logger.warning("[cache] write failed: %s", e)
+
+
+def invalidate(library: str | None = None) -> None:
+    """Drop all entries (or one library's) from both tiers."""
+    with _lock:
+        for key in [k for k, e in _memory.items() if library is None or e["library"] == library]:
+            del _memory[key]
+        try:
+            if library is None:
+                _get_conn().execute("DELETE FROM cache")
+            else:
+                _get_conn().execute("DELETE FROM cache WHERE library = ?", (library,))
+        except sqlite3.Error as e:
+            logger.warning("[cache] invalidate failed: %s", e)
+    metrics.incr("cache.invalidations")
+
+    # Semantic drafts were built against the same design system
+    from agent import semantic_cache
+    semantic_cache.invalidate(library)
@@ -0,0 +1,263 @@
+"""
+Rolling history compaction for LLM prompts.
+
+A ten-turn edit session used to re-send near-identical 150-line components
+with every call. History is now compacted before it reaches a model:
+
+  1. Code dedup: only the latest version of each component (by name) stays
+     verbatim. Earlier versions become a one-line reference.
+  2. Rolling summaries: turns older than the recent window are grouped into
+     fixed, start-aligned blocks of BLOCK_SIZE messages. Each block is
+     summarized once by GPT-4o-mini on a background thread and cached by
+     content hash. Because blocks are start-aligned, the same block gets a
+     cache hit on every later turn. Until its summary is ready, a short
+     extractive digest stands in, so requests never wait on it.
+  3. Bounds: at most MAX_SUMMARY_BLOCKS summaries and MAX_CARRIED_COMPONENTS
+     carried-forward components are kept. Prompt size stays flat however
+     long the session runs.
+
+Every call logs its savings and records them in agent.metrics.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from agent import metrics, scheduler
+
+logger = logging.getLogger(__name__)
+
+KEEP_RECENT = 6
+BLOCK_SIZE = 6
+MAX_SUMMARY_BLOCKS = 4
+MAX_CARRIED_COMPONENTS = 2
+_SUMMARY_MAX_CHARS = 600
+_CACHE_SIZE = 256
+
+_RE_FENCED = re.compile(r"```(?:jsx|javascript|tsx|js)?[^\n]*\n(.*?)```", re.DOTALL)
+_RE_RENDER_NAME = re.compile(r"root\.render\(\s*(?:React\.createElement\(\s*([A-Z]\w*)|<\s*([A-Z]\w*))")
+_RE_COMPONENT_NAME = re.compile(r"(?:function\s+([A-Z]\w*)\s*\(|const\s+([A-Z]\w*)\s*=)")
+
+_lock = threading.Lock()
+_summaries: OrderedDict[str, str] = OrderedDict()
+_pending: set[str] = set()
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="compaction")
+_summary_model = None
+
+metrics.register_ratio("compaction.summary_hit_rate", "compaction.summary_hits", "compaction.summary_lookups")
+
+
+# ────────────── Helpers ──────────────
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def _component_name(code: str) -> str:
+    """Name of the rendered (page-level) component, else the last one defined."""
+    m = _RE_RENDER_NAME.search(code)
+    if m:
+        return m.group(1) or m.group(2)
+    names = [a or b for a, b in _RE_COMPONENT_NAME.findall(code)]
+    return names[-1] if names else "Component"
+
+
+def _block_key(block: list[tuple[str, str]]) -> str:
+    h = hashlib.sha1()
+    for role, content in block:
+        h.update(role.encode("utf-8"))
+        h.update(b"\x00")
+        h.update(content.encode("utf-8"))
+        h.update(b"\x01")
+    return h.hexdigest()
+
+
+def _strip_code(text: str) -> str:
+    """Replace fenced code with a [code: Name] marker (summaries never need the code)."""
+    return _RE_FENCED.sub(lambda m: f"[code: {_component_name(m.group(1))}]", text)
+
+
+def _digest(block: list[tuple[str, str]]) -> str:
+    """Cheap extractive stand-in used until the LLM summary is cached."""
+    lines = []
+    for role, content in block:
+        text = " ".join(_strip_code(content).split())
+        if not text:
+            continue
+        lines.append(f"{'User' if role == 'user' else 'Assistant'}: {text[:140]}")
+    return "\n".join(lines)[:_SUMMARY_MAX_CHARS]
+
+
+def _get_summary_model():
+    """GPT-4o-mini for block summaries (cached singleton)."""
+    global _summary_model
+    if _summary_model is None:
+        from langchain_openai import ChatOpenAI
+        _summary_model = ChatOpenAI(model="gpt-4o-mini", temperature=0, max_tokens=200)
+    return _summary_model
+
+
+def _summarize_block(key: str, block: list[tuple[str, str]]) -> None:
+    """Background job: summarize one block and cache the result."""
+    transcript = "\n\n".join(
+        f"{'User' if role == 'user' else 'Assistant'}: {_strip_code(content)[:1500]}" for role, content in block
+    )
+    try:
+        from langchain_core.messages import HumanMessage, SystemMessage
+        messages = [
+            SystemMessage(content=(
+                "Summarize this excerpt of a UI-building conversation in at most 4 short bullet points: "
+                "what the user asked for, what was built or changed (component names), and any decisions "
+                "or preferences to remember. No code."
+            )),
+            HumanMessage(content=transcript),
+        ]
+        with scheduler.slot_sync("openai", scheduler.BACKGROUND, "gpt-4o-mini", messages=messages, output_tokens=200):
+            result = _get_summary_model().invoke(messages)
+        summary = (result.content or "").strip()[:_SUMMARY_MAX_CHARS] or _digest(block)
+    except Exception as e:
+        logger.warning("[compaction] summary failed, caching digest: %s", e)
+        summary = _digest(block)
+
+    with _lock:
+        _summaries[key] = summary
+        _summaries.move_to_end(key)
+        while len(_summaries) > _CACHE_SIZE:
+            _summaries.popitem(last=False)
+        _pending.discard(key)
+
+
+def _summary_for(block: list[tuple[str, str]]) -> str:
+    """Cached summary for a block, or its digest while the summary is computed in the background."""
+    key = _block_key(block)
+    metrics.incr("compaction.summary_lookups")
+    with _lock:
+        cached = _summaries.get(key)
+        if cached is not None:
+            _summaries.move_to_end(key)
+            metrics.incr("compaction.summary_hits")
+            return cached
+        schedule = key not in _pending
+        if schedule:
+            _pending.add(key)
+    if schedule:
+        _executor.submit(_summarize_block, key, block)
+    return _digest(block)
+
+
+# ────────────── Compaction ──────────────
+
+def dedupe_code(turns: list[tuple[str, str]]) -> tuple[list[tuple[str, str]], int]:
+    """Keep only the latest version of each component verbatim.
+
+    Returns (turns, number_of_blocks_replaced_by_a_reference).
+    """
+    latest: dict[str, tuple[int, int]] = {}
+    for i, (_, content) in enumerate(turns):
+        for m in _RE_FENCED.finditer(content):
+            latest[_component_name(m.group(1))] = (i, m.start())
+
+    replaced = 0
+    out = []
+    for i, (role, content) in enumerate(turns):
+        def repl(m: re.Match) -> str:
+            nonlocal replaced
+            name = _component_name(m.group(1))
+            if latest.get(name) == (i, m.start()):
+                return m.group(0)
+            replaced += 1
+            lines = m.group(1).count("\n") + 1
+            return f"[earlier version of {name} ({lines} lines) omitted; the latest version is shown later]"
+
+        out.append((role, _RE_FENCED.sub(repl, content) if "```" in content else content))
+    return out, replaced
+
+
+def compact(turns: list[tuple[str, str]], keep_recent: int = KEEP_RECENT) -> tuple[list[tuple[str, str]], dict]:
+    """Compact (role, content) turns for a prompt.
+
+    Returns (compacted_turns, stats). The first compacted turn may be a
+    ("system", ...) summary of the older turns.
+    """
+    before = sum(_estimate_tokens(c) for _, c in turns)
+    n_summarized = (max(0, len(turns) - keep_recent) // BLOCK_SIZE) * BLOCK_SIZE
+    old, live = turns[:n_summarized], turns[n_summarized:]
+
+    live, deduped = dedupe_code(live)
+
+    out: list[tuple[str, str]] = []
+    blocks = [old[i:i + BLOCK_SIZE] for i in range(0, len(old), BLOCK_SIZE)]
+    if blocks:
+        dropped = blocks[:-MAX_SUMMARY_BLOCKS]
+        kept = blocks[-MAX_SUMMARY_BLOCKS:]
+        parts = ["Summary of the earlier conversation:"]
+        if dropped:
+            parts.append(f"({len(dropped) * BLOCK_SIZE} older messages omitted)")
+        parts.extend(_summary_for(b) for b in kept)
+
+        # Components whose latest version only exists in summarized turns are carried forward
+        live_names = {_component_name(m.group(1)) for _, c in live for m in _RE_FENCED.finditer(c)}
+        carried: dict[str, str] = {}
+        for _, content in reversed(old):
+            for m in reversed(list(_RE_FENCED.finditer(content))):
+                name = _component_name(m.group(1))
+                if name not in live_names and name not in carried and len(carried) < MAX_CARRIED_COMPONENTS:
+                    carried[name] = m.group(1).strip()
+            deduped += sum(1 for _ in _RE_FENCED.finditer(content))
+        deduped -= len(carried)
+        for name, code in carried.items():
+            parts.append(f"Latest version of {name} (from an earlier turn):\n```jsx\n{code}\n```")
+        out.append(("system", "\n\n".join(parts)))
+
+    out.extend(live)
+    after = sum(_estimate_tokens(c) for _, c in out)
+    stats = {
+        "messages": len(turns),
+        "before_tokens": before,
+        "after_tokens": after,
+        "saved_tokens": max(0, before - after),
+        "summary_blocks": min(len(blocks), MAX_SUMMARY_BLOCKS),
+        "deduped_code_blocks": deduped,
+    }
+    _record(stats)
+    return out, stats
+
+
+def _record(stats: dict) -> None:
+    metrics.incr("compaction.runs")
+    metrics.incr("compaction.tokens_before", stats["before_tokens"])
+    metrics.incr("compaction.tokens_saved", stats["saved_tokens"])
+    metrics.observe("compaction.prompt_tokens", stats["after_tokens"])
+    if stats["saved_tokens"]:
+        logger.info("[compaction] %d msgs: ~%d -> ~%d tokens (saved %d%%), %d summary block(s), %d code block(s) deduped",
+                    stats["messages"], stats["before_tokens"], stats["after_tokens"],
+                    round(100 * stats["saved_tokens"] / max(1, stats["before_tokens"])),
+                    stats["summary_blocks"], stats["deduped_code_blocks"])
+
+
+# ────────────── Adapters ──────────────
+
+def compact_history(history: list[dict], keep_recent: int = KEEP_RECENT) -> list[dict]:
+    """Compact raw {"role", "content"} history dicts (HTTP payloads)."""
+    turns = [(h.get("role", "user"), h.get("content", "")) for h in history or []
+             if h.get("role") in ("user", "assistant") and h.get("content")]
+    compacted, _ = compact(turns, keep_recent)
+    return [{"role": role, "content": content} for role, content in compacted]
+
+
+def compact_messages(messages: list, keep_recent: int = KEEP_RECENT) -> list:
+    """Compact LangChain Human/AI messages (orchestrator state)."""
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    turns = []
+    for msg in messages:
+        if isinstance(msg, HumanMessage) and isinstance(msg.content, str) and msg.content:
+            turns.append(("user", msg.content))
+        elif isinstance(msg, AIMessage) and isinstance(msg.content, str) and msg.content:
+            turns.append(("assistant", msg.content))
+    compacted, _ = compact(turns, keep_recent)
+    cls = {"system": SystemMessage, "user": HumanMessage, "assistant": AIMessage}
+    return [cls[role](content=content) for role, content in compacted]
@@ -0,0 +1,133 @@
+"""
+Continuation of generations cut off at max_tokens.
+
+A component that runs into max_tokens ends mid-code. Its ```jsx block has no
+closing fence, so _extract_code finds nothing: either the raw text goes to
+QA and fails, or the retry regenerates the whole component (~15s). The
+generator now checks every result with needs_continuation():
+
+  - the provider's stop reason ("max_tokens" from Anthropic, "length" from
+    OpenAI) says the output limit was hit, or no stop reason was reported
+  - and a code block is left open (odd number of ``` fences)
+
+If both hold, resume() asks the same model for the rest. Claude gets the
+partial output as a prefilled assistant turn and simply carries on writing.
+GPT-4o gets it as its previous turn plus an instruction to resume at the
+exact character. stitch() joins the pieces and drops what a model tends to
+add at the seam: a reopened ```jsx fence, or the partial's last line(s)
+written out again. The stitched output is accepted once its code block is
+closed. At most GENERATION_MAX_CONTINUATIONS (default 2) extra calls are
+made per generation; a large dashboard usually needs one short one.
+
+Metrics: continuation.truncated, continuation.calls, continuation.completed,
+continuation.failed (counters) and continuation.seconds (samples).
+
+Usage:
+    content = await continuation.resume(content, stop_reason(result), model, provider, messages)
+"""
+
+import logging
+import os
+import re
+import time
+
+from agent import metrics, prompt_cache, scheduler
+
+logger = logging.getLogger(__name__)
+
+MAX_CONTINUATIONS = int(os.environ.get("GENERATION_MAX_CONTINUATIONS", "2"))
+TRUNCATED_STOPS = {"max_tokens", "length"}
+# Expected size of the missing tail, for the scheduler's tokens-per-minute budget
+_CONTINUATION_OUTPUT_TOKENS = 800
+# How far back a repeated seam is looked for, and the shortest accepted as a real repeat
+_MAX_OVERLAP = 400
+_MIN_OVERLAP = 8
+
+CONTINUE_PROMPT = (
+    "Your previous reply was cut off by the output limit. Continue it from the exact character "
+    "where it stopped. Output ONLY the remaining text: do not repeat anything already written, "
+    "do not reopen the code block, no explanations. Close the code block when the component is done."
+)
+
+_RE_REOPENED_FENCE = re.compile(r"^\s*```(?:jsx|javascript|tsx|js)?[ \t]*\n")
+
+
+def stop_reason(message) -> str:
+    """The stop reason a LangChain response (or final stream chunk) reports, or ""."""
+    meta = getattr(message, "response_metadata", None) or {}
+    return meta.get("stop_reason") or meta.get("finish_reason") or ""
+
+
+def unterminated(text: str) -> bool:
+    """True if a ``` code block is opened but never closed."""
+    return (text or "").count("```") % 2 == 1
+
+
+def needs_continuation(text: str, stop: str = "") -> bool:
+    return unterminated(text) and (not stop or stop in TRUNCATED_STOPS)
+
+
+def _resume_point(partial: str, provider: str) -> str:
+    # Anthropic rejects a prefilled assistant turn that ends in whitespace
+    return partial.rstrip() if provider == "anthropic" else partial
+
+
+def continuation_messages(messages: list, partial: str, provider: str) -> list:
+    """The original messages followed by the partial output, as the model is asked to resume it."""
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    resumed = [*messages, AIMessage(content=_resume_point(partial, provider))]
+    if provider != "anthropic":
+        resumed.append(HumanMessage(content=CONTINUE_PROMPT))
+    return resumed
+
+
+def stitch(partial: str, more: str, provider: str = "anthropic") -> str:
+    """`partial` + `more`, without a reopened fence or text repeated across the seam."""
+    head = _resume_point(partial, provider)
+    if unterminated(head):
+        more = _RE_REOPENED_FENCE.sub("", more, count=1)
+    # A repeat starts at the beginning of one of the partial's last lines (typically the cut one)
+    window = head[-_MAX_OVERLAP:]
+    starts = [m.end() for m in re.finditer("\n", window)]
+    if len(head) <= _MAX_OVERLAP:
+        starts.insert(0, 0)
+    for i in starts:  # longest repeat first
+        tail = window[i:]
+        if len(tail.strip()) >= _MIN_OVERLAP and more.startswith(tail):
+            more = more[len(tail):]
+            break
+    return head + more
+
+
+async def resume(content: str, stop: str, model, provider: str, messages: list, site: str = "generation") -> str:
+    """Complete `content` if it was cut off (see module docstring); returns it unchanged otherwise."""
+    if not needs_continuation(content, stop) or MAX_CONTINUATIONS <= 0:
+        return content
+    metrics.incr("continuation.truncated")
+    logger.info("[continuation] output cut off (stop reason: %s, %d chars) — continuing",
+                stop or "unreported", len(content))
+    t0 = time.perf_counter()
+    for _ in range(MAX_CONTINUATIONS):
+        resumed = continuation_messages(messages, content, provider)
+        metrics.incr("continuation.calls")
+        try:
+            async with scheduler.slot(provider, scheduler.GENERATION, model,
+                                      messages=resumed, output_tokens=_CONTINUATION_OUTPUT_TOKENS):
+                result = await model.ainvoke(prompt_cache.prepare(resumed, provider))
+        except Exception as e:
+            logger.warning("[continuation] call failed: %s", e)
+            break
+        prompt_cache.record(result.usage_metadata, provider, site)
+        content = stitch(content, result.content if isinstance(result.content, str) else "", provider)
+        stop = stop_reason(result)
+        if not needs_continuation(content, stop):
+            break
+    metrics.observe("continuation.seconds", time.perf_counter() - t0)
+    if unterminated(content):
+        metrics.incr("continuation.failed")
+        logger.warning("[continuation] code block still open after continuing (%d chars)", len(content))
+    else:
+        metrics.incr("continuation.completed")
+        logger.info("[continuation] completed in %.1fs (%d chars)", time.perf_counter() - t0, len(content))
+    return content
@@ -15,6 +15,8 @@ from pathlib import Path
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 
+from agent import prompt_cache, providers, scheduler
+
 logger = logging.getLogger(__name__)
 
 ROOT = Path(__file__).resolve().parent.parent
@@ -106,6 +108,18 @@ def _get_formatted_prompt(library: str = "untitledui") -> str:
     return prompt
 
 
+def component_names(library: str = "untitledui") -> list[str]:
+    """Names of the library's catalog components, in catalog order."""
+    return [c["name"] for c in _load_catalog(library).get("components", []) if c.get("name")]
+
+
+def reload(library: str) -> None:
+    """Forget the cached catalog and prompt for `library` (after the catalog file changed)."""
+    _catalog_cache.pop(library, None)
+    _formatted_prompt_cache.pop(library, None)
+    _formatted_prompt_cache.pop("both", None)
+
+
 def _get_discovery_model():
     """Get GPT-4o-mini for fast discovery (cached singleton)."""
     global _discovery_model
@@ -120,7 +134,9 @@ async def run_discovery(user_request: str, has_previous_code: bool = False, libr
 
     Returns the composition plan string.
     """
-    model = _get_discovery_model()
+    # GPT-4o-mini, or Claude Haiku while OpenAI's circuit is open
+    provider = providers.pick("openai", "anthropic")
+    model = _get_discovery_model() if provider == "openai" else providers.fast_fallback_model()
     system_prompt = _get_formatted_prompt(library)
     lib_label = {"untitledui": "Untitled UI", "metafore": "Metafore", "vernam": "Vernam", "both": "Untitled UI + Metafore"}.get(library, library)
 
@@ -129,11 +145,11 @@ async def run_discovery(user_request: str, has_previous_code: bool = False, libr
         context += ("\n\nNote: The user is modifying an existing component. "
                     "Include the same components plus any new ones needed.")
 
+    messages = [SystemMessage(content=system_prompt), HumanMessage(content=context)]
     try:
-        result = await model.ainvoke([
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=context),
-        ])
+        async with scheduler.slot(provider, scheduler.GENERATION, model, messages=messages, output_tokens=600):
+            result = await model.ainvoke(prompt_cache.prepare(messages, provider))
+        prompt_cache.record(result.usage_metadata, provider, "discovery")
         return result.content
     except Exception as e:
         logger.error("[discovery] LLM call failed: %s", e)
@@ -5,16 +5,49 @@ Writes production React/JSX code using discovered components,
 design tokens, and coding guidelines.
 
 Uses Claude (Anthropic) for fast, high-quality code generation.
-Falls back to OpenAI GPT-4o if ANTHROPIC_API_KEY is not set.
+Falls back to OpenAI GPT-4o if ANTHROPIC_API_KEY is not set. The model
+tier (Haiku / Sonnet, GPT-4o-mini / GPT-4o) and max_tokens come from the
+request's agent.routing.Route.
+
+Hedged requests: when Claude hasn't produced a first token within the
+hedge delay (recent p90 time-to-first-token, clamped to HEDGE_MIN_S..
+HEDGE_MAX_S; HEDGE_DELAY_S until enough samples exist), the same request
+is also sent to GPT-4o (the fast tier is not hedged). The first complete
+result wins and the other stream is cancelled. The cost is visible as
+generation.hedge.trigger_rate and generation.hedge.backup_win_rate.
+
+Output cut off at max_tokens is completed by the model that wrote it
+(agent.continuation) instead of going to QA half-written.
+
+While Anthropic's circuit is open (agent.providers), requests go straight to
+GPT-4o instead of waiting for Claude to time out. Every call runs in the
+generation lane of agent.scheduler. The static generation prompt is marked
+for Anthropic prompt caching (agent.prompt_cache).
 """
 
+import asyncio
 import json
 import logging
 import os
+import time
 from pathlib import Path
 
+from agent import budget, continuation, metrics, prompt_cache, providers, scheduler
+
 logger = logging.getLogger(__name__)
 
+HEDGE_ENABLED = os.environ.get("HEDGE_GENERATION", "true").lower() != "false"
+HEDGE_DELAY_S = float(os.environ.get("HEDGE_DELAY_S", "6"))
+HEDGE_MIN_S = float(os.environ.get("HEDGE_MIN_S", "2"))
+HEDGE_MAX_S = float(os.environ.get("HEDGE_MAX_S", "15"))
+_HEDGE_MIN_SAMPLES = 20
+# Expected output size, for the scheduler's tokens-per-minute budget
+_GENERATION_OUTPUT_TOKENS = 2000
+_PATCH_OUTPUT_TOKENS = 600
+
+metrics.register_ratio("generation.hedge.trigger_rate", "generation.hedge.triggered", "generation.hedge.requests")
+metrics.register_ratio("generation.hedge.backup_win_rate", "generation.hedge.backup_wins", "generation.hedge.triggered")
+
 ROOT = Path(__file__).resolve().parent.parent
 DESIGN_SYSTEM_DIR = ROOT / "design_system"
 
@@ -206,67 +239,94 @@ The code must be complete and immediately renderable in a browser with React 18
     return prompt
 
 
-_claude_model = None
-_openai_model = None
+_claude_models: dict[str, object] = {}
+_openai_models: dict[str, object] = {}
 
 
-def _get_claude_model():
-    """Get a cached Claude model via LangChain if ANTHROPIC_API_KEY is available."""
-    global _claude_model
-    if _claude_model is not None:
-        return _claude_model
+def _get_claude_model(name: str = "claude-sonnet-4-20250514"):
+    """Get a cached Claude model via LangChain if ANTHROPIC_API_KEY is available (one per model id)."""
+    if name in _claude_models:
+        return _claude_models[name]
     api_key = os.environ.get("ANTHROPIC_API_KEY", "").strip()
     if not api_key:
         print("[generator] No ANTHROPIC_API_KEY found — will use GPT-4o")
         return None
     try:
         from langchain_anthropic import ChatAnthropic
-        _claude_model = ChatAnthropic(
-            model="claude-sonnet-4-20250514",
+        _claude_models[name] = ChatAnthropic(
+            model=name,
             anthropic_api_key=api_key,
             max_tokens=8192,
             temperature=0.2,
         )
-        print("[generator] Claude Sonnet model initialized OK")
-        return _claude_model
+        print(f"[generator] Claude model {name} initialized OK")
+        return _claude_models[name]
     except Exception as e:
         print(f"[generator] Claude init FAILED: {e} — will use GPT-4o")
         return None
 
 
-def _get_openai_model():
-    """Fallback to OpenAI GPT-4o (cached singleton)."""
-    global _openai_model
-    if _openai_model is not None:
-        return _openai_model
-    from langchain_openai import ChatOpenAI
-    _openai_model = ChatOpenAI(model="gpt-4o", temperature=0.2, max_tokens=4096)
-    return _openai_model
+def _get_openai_model(name: str = "gpt-4o"):
+    """Fallback to OpenAI GPT-4o (cached per model id)."""
+    if name not in _openai_models:
+        from langchain_openai import ChatOpenAI
+        _openai_models[name] = ChatOpenAI(model=name, temperature=0.2, max_tokens=4096)
+    return _openai_models[name]
 
 
 async def run_generation(user_request: str, discovery_output: str,
                           previous_code: str = "", qa_feedback: str = "",
-                          library: str = "untitledui") -> str:
+                          library: str = "untitledui", variant_style: str = "",
+                          variant_suffix: str = "", temperature: float | None = None,
+                          use_fallback_model: bool = False, streaming_qa: bool = False,
+                          hedge: bool = False, route=None) -> str:
     """Run code generation using Claude (primary) or GPT-4o (fallback).
 
+    With variant_style set, builds ONE variant in that style (variants are
+    fanned out as independent calls by the orchestrator).
+    temperature / use_fallback_model diversify candidates in race mode.
+    streaming_qa runs agent.streaming_qa.StreamingQA over each token stream;
+    an EarlyAbort propagates to the caller. hedge backs a slow Claude call
+    with a concurrent GPT-4o request (see module docstring).
+    route (agent.routing.Route) picks the model tier and max_tokens; without
+    one the complex tier is used.
+
     Returns the generated code as a string.
     """
     from langchain_core.messages import HumanMessage, SystemMessage
 
-    claude = _get_claude_model()
-    model = claude or _get_openai_model()
-    model_name = "Claude Sonnet" if claude else "GPT-4o (fallback)"
+    from agent import routing
+
+    route = route or routing.default()
+    use_claude = not use_fallback_model and providers.pick("anthropic", "openai") == "anthropic"
+    claude = _get_claude_model(route.model("anthropic")) if use_claude else None
+    if claude:
+        claude = claude.bind(max_tokens=route.max_tokens)
+    backup = _get_openai_model(route.model("openai")).bind(max_tokens=route.max_tokens)
+    model = claude or backup
+    model_name = route.model("anthropic" if claude else "openai") + ("" if claude else " (fallback)")
+    if temperature is not None:
+        model = model.bind(temperature=temperature)
     lib_label = {"untitledui": "Untitled UI", "metafore": "Metafore", "vernam": "Vernam", "both": "Untitled UI + Metafore"}.get(library, library)
     print(f"[generator] >>> Using {model_name} for code generation (library: {lib_label})")
 
     gen_prompt = _build_generation_prompt(library)
     prompt_parts = [f"BUILD THIS UI: {user_request}"]
 
-    is_variant = "variant" in user_request.lower() or (
+    is_variant = not variant_style and ("variant" in user_request.lower() or (
         "different" in user_request.lower() and ("style" in user_request.lower() or "version" in user_request.lower())
-    )
+    ))
 
-    if previous_code and is_variant:
+    if variant_style:
+        base = (f"\n## BASE COMPONENT (create the variant FROM this code):\n```jsx\n{previous_code}\n```\n"
+                "Keep the SAME data and functionality but change the visual style/layout."
+                if previous_code else "")
+        prompt_parts.append(
+            f"{base}\nGenerate exactly ONE variant with this style: {variant_style}. "
+            f"Output a SINGLE ```jsx code block. The component name must end with '{variant_suffix or 'Variant'}' "
+            f"and the code must end with root.render(React.createElement(ThatName))."
+        )
+    elif previous_code and is_variant:
         prompt_parts.append(
             f"\n## BASE COMPONENT (create variants FROM this code):\n```jsx\n{previous_code}\n```\n"
             "Generate 2-3 DIFFERENT style variants of the component above. "
@@ -281,34 +341,289 @@ async def run_generation(user_request: str, discovery_output: str,
             "Keep the same structure/data but apply the requested changes."
         )
 
-    if discovery_output:
-        prompt_parts.append(
-            f"\n## {lib_label} Components to Use:\n{discovery_output}\n"
-            "Use these exact Tailwind patterns."
-        )
-
-    if qa_feedback:
-        prompt_parts.append(f"\n## QA FEEDBACK (fix these issues):\n{qa_feedback}")
+    # The request and the code being modified are never cut; discovery gives way first
+    packed = budget.pack([
+        budget.Section("request", ["\n".join(prompt_parts)], required=True),
+        budget.Section("discovery", budget.markdown_units(discovery_output), priority=2, sep="\n\n",
+                       wrap=(f"\n## {lib_label} Components to Use:\n", "\nUse these exact Tailwind patterns.")),
+        budget.Section("qa_feedback", [f"\n## QA FEEDBACK (fix these issues):\n{qa_feedback}"] if qa_feedback else [],
+                       priority=1),
+    ], budget.budget_for(route.model("anthropic" if claude else "openai")), site="generation", base=gen_prompt)
 
     messages = [
         SystemMessage(content=gen_prompt),
-        HumanMessage(content="\n".join(prompt_parts)),
+        HumanMessage(content="\n".join(filter(None, (packed["request"], packed["discovery"], packed["qa_feedback"])))),
     ]
 
+    from agent.streaming_qa import EarlyAbort, StreamingQA
+
+    def monitor():
+        return StreamingQA() if streaming_qa else None
+
+    # Hedge delays come from Sonnet's TTFT; fast-tier models keep their own samples
+    model_key = ("claude" if route.tier != "fast" else "claude_fast") if claude else "gpt4o"
+    hedged = (hedge and HEDGE_ENABLED and claude is not None and route.tier != "fast" and temperature is None
+              and providers.healthy("openai"))
     try:
-        result = await model.ainvoke(messages)
-        print(f"[generator] >>> {model_name} response OK ({len(result.content)} chars)")
-        return result.content
+        info = {}  # stop reason, model and provider of the output that is returned
+        if hedged:
+            content = await _hedged(claude, backup, messages, monitor, info)
+        elif streaming_qa:
+            content = await _stream(model, messages, monitor(), model_key, info=info)
+        else:
+            provider = "anthropic" if claude else "openai"
+            async with scheduler.slot(provider, scheduler.GENERATION, model,
+                                      messages=messages, output_tokens=_GENERATION_OUTPUT_TOKENS):
+                result = await model.ainvoke(prompt_cache.prepare(messages, provider))
+            prompt_cache.record(result.usage_metadata, provider, "generation")
+            content = result.content
+            info = {"stop_reason": continuation.stop_reason(result), "model": model, "provider": provider}
+        content = await continuation.resume(content, info.get("stop_reason", ""), info["model"], info["provider"],
+                                            messages)
+        print(f"[generator] >>> {model_name} response OK ({len(content)} chars)")
+        return content
+    except EarlyAbort:
+        raise
     except Exception as e:
         print(f"[generator] >>> {model_name} FAILED: {e}")
-        if claude:
+        if claude and not hedged:  # a hedged call has already tried GPT-4o
             print("[generator] >>> Falling back to GPT-4o...")
             try:
-                fallback = _get_openai_model()
-                result = await fallback.ainvoke(messages)
-                print(f"[generator] >>> GPT-4o fallback OK ({len(result.content)} chars)")
-                return result.content
+                async with scheduler.slot("openai", scheduler.GENERATION, backup,
+                                          messages=messages, output_tokens=_GENERATION_OUTPUT_TOKENS):
+                    result = await backup.ainvoke(messages)
+                prompt_cache.record(result.usage_metadata, "openai", "generation")
+                content = await continuation.resume(result.content, continuation.stop_reason(result), backup,
+                                                    "openai", messages)
+                print(f"[generator] >>> GPT-4o fallback OK ({len(content)} chars)")
+                return content
             except Exception as e2:
                 print(f"[generator] >>> GPT-4o fallback also FAILED: {e2}")
                 return f"Error generating code: {e2}"
         return f"Error generating code: {e}"
+
+
+async def complete(messages: list, route=None, site: str = "generation") -> str:
+    """One generation call for prebuilt `messages` on `route`'s tier: Claude, or GPT-4o when
+    Anthropic is unavailable or the call fails. Cut-off output is continued. Raises if both fail."""
+    from agent import routing
+
+    route = route or routing.default()
+    use_claude = providers.pick("anthropic", "openai") == "anthropic"
+    claude = _get_claude_model(route.model("anthropic")) if use_claude else None
+    backup = _get_openai_model(route.model("openai")).bind(max_tokens=route.max_tokens)
+    attempts = [(claude.bind(max_tokens=route.max_tokens), "anthropic")] if claude else []
+    for i, (model, provider) in enumerate(attempts + [(backup, "openai")]):
+        try:
+            async with scheduler.slot(provider, scheduler.GENERATION, model,
+                                      messages=messages, output_tokens=_GENERATION_OUTPUT_TOKENS):
+                result = await model.ainvoke(prompt_cache.prepare(messages, provider))
+            prompt_cache.record(result.usage_metadata, provider, site)
+            return await continuation.resume(result.content, continuation.stop_reason(result), model, provider,
+                                             messages, site)
+        except Exception as e:
+            if i == len(attempts):
+                raise
+            print(f"[generator] >>> {route.model(provider)} FAILED ({site}): {e} — falling back to GPT-4o")
+
+
+async def _stream(model, messages: list, monitor=None, model_key: str = "claude",
+                  first_token: asyncio.Event | None = None, info: dict | None = None) -> str:
+    """Stream a completion, recording time-to-first-token and feeding `monitor`.
+    Leaving the loop early (EarlyAbort, cancellation) cancels the request.
+    `info` receives the stop reason, model and provider (for agent.continuation)."""
+    from agent.streaming_qa import EarlyAbort
+
+    parts = []
+    stop = ""
+    provider = "anthropic" if model_key.startswith("claude") else "openai"
+    async with scheduler.slot(provider, scheduler.GENERATION, model,
+                              messages=messages, output_tokens=_GENERATION_OUTPUT_TOKENS, neutral=(EarlyAbort,)):
+        t0 = time.perf_counter()  # TTFT excludes the scheduler queue wait
+        async for chunk in model.astream(prompt_cache.prepare(messages, provider)):
+            prompt_cache.record(chunk.usage_metadata, provider, "generation")
+            stop = continuation.stop_reason(chunk) or stop
+            if isinstance(chunk.content, str) and chunk.content:
+                if not parts:
+                    metrics.observe(f"generation.ttft.{model_key}", time.perf_counter() - t0)
+                    metrics.incr(f"generation.ttft_samples.{model_key}")
+                    if first_token:
+                        first_token.set()
+                parts.append(chunk.content)
+                if monitor:
+                    monitor.feed(chunk.content)
+    if monitor:
+        monitor.finish()
+    if info is not None:
+        info.update(stop_reason=stop, model=model, provider=provider)
+    return "".join(parts)
+
+
+def hedge_delay() -> float:
+    """Seconds to wait for Claude's first token before hedging: recent p90 TTFT, clamped."""
+    p90 = metrics.percentile("generation.ttft.claude", 90)
+    if p90 is None or metrics.get("generation.ttft_samples.claude") < _HEDGE_MIN_SAMPLES:
+        return HEDGE_DELAY_S
+    return min(HEDGE_MAX_S, max(HEDGE_MIN_S, p90))
+
+
+async def _hedged(primary, backup, messages: list, monitor, info: dict | None = None) -> str:
+    """Claude first; GPT-4o too if Claude is slow to start or fails at any point. First complete
+    result wins (its stop reason, model and provider go into `info`)."""
+    from agent.streaming_qa import EarlyAbort
+
+    metrics.incr("generation.hedge.requests")
+    first_token = asyncio.Event()
+    infos = {}
+    primary_task = asyncio.create_task(_stream(primary, messages, monitor(), "claude", first_token,
+                                               info=infos.setdefault("claude", {})))
+    tasks = {primary_task: "claude"}
+    pending = {primary_task}
+    try:
+        waiter = asyncio.create_task(first_token.wait())
+        delay = hedge_delay()
+        await asyncio.wait({waiter, primary_task}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+
+        if primary_task.done() and (primary_task.exception() is None
+                                    or isinstance(primary_task.exception(), EarlyAbort)):
+            if info is not None:
+                info.update(infos["claude"])
+            return primary_task.result()  # finished, or certain to fail QA (retry with feedback instead)
+
+        def start_backup(reason: str) -> None:
+            print(f"[generator] >>> Hedging: Claude {reason}, starting GPT-4o")
+            metrics.incr("generation.hedge.triggered")
+            backup_task = asyncio.create_task(_stream(backup, messages, monitor(), "gpt4o",
+                                                      info=infos.setdefault("gpt4o", {})))
+            tasks[backup_task] = "gpt4o"
+            pending.add(backup_task)
+
+        if primary_task.done() or not first_token.is_set():
+            start_backup("failed" if primary_task.done() else f"no first token after {delay:.1f}s")
+
+        errors = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if tasks[task] == "gpt4o":
+                        metrics.incr("generation.hedge.backup_wins")
+                    if len(tasks) > 1:
+                        print(f"[generator] >>> Hedge won by {tasks[task]}")
+                    if info is not None:
+                        info.update(infos[tasks[task]])
+                    return task.result()
+                errors.append(task.exception())
+                # Claude failing mid-stream (not a QA abort) still gets GPT-4o if it hasn't run yet
+                if (task is primary_task and len(tasks) == 1
+                        and not isinstance(task.exception(), EarlyAbort)):
+                    start_backup("failed mid-stream")
+        # Every candidate failed; a QA abort is the most useful error to surface
+        raise next((e for e in errors if isinstance(e, EarlyAbort)), errors[0])
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def run_patch(code: str, qa_feedback: str, user_request: str = "",
+                    library: str = "untitledui") -> str | None:
+    """Ask the model for a line-anchored patch that fixes QA issues in `code`.
+
+    Output size scales with the fix instead of the component, so a retry for
+    a two-line issue costs a few seconds instead of a full regeneration.
+    Returns the patched code, or None if the patch is missing or doesn't
+    apply cleanly (caller falls back to full regeneration).
+    """
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    from agent.patching import PATCH_INSTRUCTIONS, PatchError, apply_patch, number_lines, parse_patch
+
+    claude = _get_claude_model() if providers.pick("anthropic", "openai") == "anthropic" else None
+    model = claude or _get_openai_model()
+    prompt = (
+        f"The component below was generated for: {user_request}\n"
+        f"QA found issues. Fix ONLY these issues with a minimal patch.\n\n"
+        f"## Current code (numbered)\n{number_lines(code)}\n\n"
+        f"## QA FEEDBACK (fix these issues):\n{qa_feedback}\n\n"
+        f"{PATCH_INSTRUCTIONS}"
+    )
+    messages = [
+        SystemMessage(content=_build_generation_prompt(library)),
+        HumanMessage(content=prompt),
+    ]
+
+    metrics.incr("patch.attempts")
+    t0 = time.time()
+    try:
+        provider = "anthropic" if claude else "openai"
+        async with scheduler.slot(provider, scheduler.GENERATION, model,
+                                  messages=messages, output_tokens=_PATCH_OUTPUT_TOKENS):
+            result = await model.ainvoke(prompt_cache.prepare(messages, provider))
+        prompt_cache.record(result.usage_metadata, provider, "patch")
+        patched = apply_patch(code, parse_patch(result.content))
+    except PatchError as e:
+        print(f"[generator] >>> Patch rejected: {e} — falling back to full regeneration")
+        metrics.incr("patch.rejected")
+        return None
+    except Exception as e:
+        print(f"[generator] >>> Patch request FAILED: {e} — falling back to full regeneration")
+        metrics.incr("patch.failed")
+        return None
+
+    elapsed = time.time() - t0
+    metrics.incr("patch.applied")
+    metrics.observe("patch.seconds", elapsed)
+    print(f"[generator] >>> Patch applied in {elapsed:.1f}s ({len(result.content)} chars of patch)")
+    return patched
+
+
+async def run_slice_edit(code: str, user_request: str, library: str = "untitledui") -> str | None:
+    """Apply a modification request by rewriting only the slices of `code` it is about
+    (agent.jsx_slicer), so the output scales with the edit instead of the component.
+    Returns the edited code, or None when the edit isn't local or the reply doesn't
+    splice cleanly (caller regenerates the whole component)."""
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    from agent import jsx_slicer, routing
+    from agent.patching import PatchError
+
+    slices = jsx_slicer.find_slices(code, user_request)
+    if not slices:
+        metrics.incr("slice_edit.not_local")
+        return None
+    sliced = jsx_slicer.render_slices(code, slices)
+    prompt = (
+        f"MODIFY the existing component: {user_request}\n\n"
+        f"Only the parts of the code this change is about are shown below.\n\n"
+        f"{sliced}{jsx_slicer.SLICE_INSTRUCTIONS}"
+    )
+    messages = [
+        SystemMessage(content=_build_generation_prompt(library)),
+        HumanMessage(content=prompt),
+    ]
+    lines = code.split("\n")
+    sent_code = "\n".join("\n".join(lines[s.start - 1:s.end]) for s in slices)
+    sent = sent_code.count("\n") + 1
+    metrics.incr("slice_edit.attempts")
+    metrics.observe("slice_edit.sent_fraction", sent / len(lines))
+    t0 = time.time()
+    try:
+        # Sized by the slices it rewrites, not the whole component
+        route = routing.route(user_request, previous_code=sent_code, library=library)
+        reply = await complete(messages, route, site="slice_edit")
+        edited = jsx_slicer.splice(code, slices, jsx_slicer.parse_replacements(reply))
+    except PatchError as e:
+        print(f"[generator] >>> Slice edit rejected: {e} — regenerating the whole component")
+        metrics.incr("slice_edit.rejected")
+        return None
+    except Exception as e:
+        print(f"[generator] >>> Slice edit FAILED: {e} — regenerating the whole component")
+        metrics.incr("slice_edit.failed")
+        return None
+
+    elapsed = time.time() - t0
+    metrics.incr("slice_edit.applied")
+    metrics.observe("slice_edit.seconds", elapsed)
+    print(f"[generator] >>> Slice edit applied in {elapsed:.1f}s ({len(slices)} slices, {sent} lines sent)")
+    return edited
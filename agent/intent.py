@@ -0,0 +1,195 @@
+"""
+Local intent classifier: generate / discover / review / chat.
+
+Replaces a GPT-4o-mini round trip (~0.5-1.5s) on every request with:
+
+  1. Compiled rules for unambiguous phrasings (variant requests, greetings,
+     code pasted for review, "list/show components|tokens").
+  2. A multinomial logistic regression over hashed word uni/bigrams and
+     character trigrams. Its weights ship in intent_data/model.json and are
+     trained by scripts/train_intent_classifier.py on intent_data/train.jsonl.
+
+classify() returns (label, confidence, source) in microseconds. Callers
+escalate to the LLM only when confidence < CONFIDENCE_THRESHOLD
+(INTENT_CONFIDENCE_THRESHOLD env, default 0.75). llm_classify() is that
+fallback for synchronous callers. scripts/eval_intent_classifier.py reports
+accuracy against the LLM on intent_data/eval.jsonl.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import time
+import zlib
+from pathlib import Path
+
+from agent import metrics, scheduler
+
+logger = logging.getLogger(__name__)
+
+LABELS = ("generate", "discover", "review", "chat")
+DATA_DIR = Path(__file__).resolve().parent / "intent_data"
+MODEL_PATH = DATA_DIR / "model.json"
+CONFIDENCE_THRESHOLD = float(os.environ.get("INTENT_CONFIDENCE_THRESHOLD", "0.75"))
+N_BUCKETS = 1 << 15
+
+LLM_SYSTEM_PROMPT = (
+    "Classify the user message into exactly one word:\n"
+    "- \"generate\" if the user wants to CREATE, BUILD, GENERATE, MAKE, DESIGN, "
+    "or MODIFY a UI component, page, dashboard, form, table, card, or any visual element. "
+    "Also \"generate\" for: redesign, add dark mode, make responsive, simplify, add animation.\n"
+    "- \"discover\" if the user wants to EXPLORE, LIST, or BROWSE available components or design tokens.\n"
+    "- \"review\" if the user wants to REVIEW, CHECK, or AUDIT existing code.\n"
+    "- \"chat\" if it's a general question, greeting, explanation request, "
+    "or anything NOT about building/modifying UI.\n\n"
+    "Examples:\n"
+    "\"Create a login form\" -> generate\n"
+    "\"Build me a dashboard\" -> generate\n"
+    "\"Make it more minimal\" -> generate\n"
+    "\"What components are available?\" -> discover\n"
+    "\"Review this code\" -> review\n"
+    "\"Hello\" -> chat\n"
+    "\"How does the pipeline work?\" -> chat\n"
+    "\"Thanks!\" -> chat\n"
+    "Respond with ONLY one word."
+)
+
+# ── Rules: (label, confidence, pattern) — first match wins ──
+_RULES = [
+    ("generate", 0.99, re.compile(
+        r"\b(?:generate|create|make|build|show)\b.*\bvariants?\b|\bvariants\b|\bgenerate\s+\d+\s+(?:different|style|version)",
+        re.IGNORECASE | re.DOTALL)),
+    ("chat", 0.98, re.compile(
+        r"^\s*(?:hi|hello|hey|yo|thanks|thank you|thx|ok(?:ay)?|cool|bye|good (?:morning|night|evening))\b[\s!.,]*"
+        r"(?:there|so much|a lot)?[\s!.]*$", re.IGNORECASE)),
+    ("review", 0.96, re.compile(
+        r"\b(?:review|audit|check|qa|lint|critique)\b[^`]*```", re.IGNORECASE | re.DOTALL)),
+    ("discover", 0.95, re.compile(
+        r"^\s*(?:list|show(?: me)?|browse|what|which)\b[^.?!]{0,40}\b(?:components?|tokens?|palette|catalog)\b"
+        r"(?:[^.?!]{0,30}\b(?:available|exist|are there|do you (?:have|support|offer)|"
+        r"in the (?:library|catalog|design system)))?\s*\??\s*$",
+        re.IGNORECASE)),
+]
+
+_RE_WORD = re.compile(r"[a-z0-9']+")
+_RE_CODE_HINT = re.compile(r"```|<[A-Za-z][^>]*>|\bfunction\s+[A-Z]|className=")
+
+_model: dict | None = None
+_openai_client = None
+
+metrics.register_ratio("intent.escalation_rate", "intent.escalated", "intent.requests")
+
+
+# ────────────── Features ──────────────
+
+def features(text: str) -> set[str]:
+    """Sparse binary features: word uni/bigrams, in-word char trigrams, code hint."""
+    words = _RE_WORD.findall(text.lower())[:60]
+    feats = {f"w:{w}" for w in words}
+    feats.update(f"b:{a}_{b}" for a, b in zip(words, words[1:]))
+    for w in words:
+        padded = f"^{w}$"
+        feats.update(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    if words:
+        feats.add(f"first:{words[0]}")
+    if _RE_CODE_HINT.search(text):
+        feats.add("has_code")
+    feats.add("bias")
+    return feats
+
+
+def bucket(feature: str) -> int:
+    """Stable hash bucket (crc32, unlike hash(), doesn't change between processes)."""
+    return zlib.crc32(feature.encode("utf-8")) % N_BUCKETS
+
+
+# ────────────── Model ──────────────
+
+def _load_model() -> dict | None:
+    """Load shipped weights once: {"labels": [...], "weights": {label: {bucket: w}}}."""
+    global _model
+    if _model is None:
+        try:
+            raw = json.loads(MODEL_PATH.read_text(encoding="utf-8"))
+            _model = {
+                "labels": raw["labels"],
+                "weights": {lbl: {int(k): v for k, v in w.items()} for lbl, w in raw["weights"].items()},
+            }
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("[intent] model unavailable (%s) — rules only", e)
+            _model = {"labels": [], "weights": {}}
+    return _model
+
+
+def predict_proba(text: str, model: dict | None = None) -> dict[str, float]:
+    """Softmax probabilities per label from the hashed-feature model."""
+    model = model or _load_model()
+    if not model["labels"]:
+        return {}
+    buckets = [bucket(f) for f in features(text)]
+    scores = {lbl: sum(model["weights"][lbl].get(b, 0.0) for b in buckets) for lbl in model["labels"]}
+    top = max(scores.values())
+    exp = {lbl: math.exp(s - top) for lbl, s in scores.items()}
+    total = sum(exp.values())
+    return {lbl: e / total for lbl, e in exp.items()}
+
+
+def classify(text: str) -> tuple[str, float, str]:
+    """Classify locally. Returns (label, confidence, source) with source "rule" or "model"."""
+    t0 = time.perf_counter()
+    result = ("chat", 0.0, "model")
+    for label, confidence, pattern in _RULES:
+        if pattern.search(text):
+            result = (label, confidence, "rule")
+            break
+    else:
+        probs = predict_proba(text)
+        if probs:
+            label = max(probs, key=probs.get)
+            result = (label, probs[label], "model")
+    metrics.incr("intent.requests")
+    metrics.observe("intent.micros", (time.perf_counter() - t0) * 1e6)
+    return result
+
+
+def needs_llm(confidence: float) -> bool:
+    """True if a local prediction is too uncertain and should be escalated."""
+    if confidence < CONFIDENCE_THRESHOLD:
+        metrics.incr("intent.escalated")
+        return True
+    return False
+
+
+def parse_label(raw: str) -> str:
+    """Map a free-form LLM answer onto one of LABELS (chat if none matches)."""
+    raw = (raw or "").strip().lower()
+    return next((lbl for lbl in LABELS if lbl in raw), "chat")
+
+
+# ────────────── LLM fallback (sync) ──────────────
+
+def _get_openai_client():
+    """OpenAI client for escalations (cached singleton)."""
+    global _openai_client
+    if _openai_client is None:
+        import openai
+        _openai_client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY", "").strip())
+    return _openai_client
+
+
+def llm_classify(text: str) -> str:
+    """GPT-4o-mini classification (the pre-local-classifier behaviour)."""
+    messages = [
+        {"role": "system", "content": LLM_SYSTEM_PROMPT},
+        {"role": "user", "content": text},
+    ]
+    with scheduler.slot_sync("openai", scheduler.INTERACTIVE, "gpt-4o-mini", messages=messages, output_tokens=10):
+        response = _get_openai_client().chat.completions.create(
+            model="gpt-4o-mini",
+            max_tokens=10,
+            temperature=0,
+            messages=messages,
+        )
+    return parse_label(response.choices[0].message.content or "")
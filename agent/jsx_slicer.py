@@ -0,0 +1,351 @@
+"""
+Structural slicing of JSX for modification requests.
+
+A modify turn ("change the header button to red") used to embed the whole
+previous component in the prompt and ask for all of it back, so a one-line
+edit cost as much as the original generation. This module finds the parts
+of the code an edit is about and splices the model's replacements back in:
+
+  1. parse(): a lightweight JSX scanner (no JS parser) that finds every
+     element with its line span, parent, attribute text (className, ...)
+     and own text. It also finds the top-level declarations and their line
+     spans.
+  2. find_slices(): scores elements against the request's words. A word
+     counts when it matches an element's tag ("button", or the synonyms in
+     _SYNONYMS), its attributes, its own text, or the name of its
+     component or of an ancestor. The highest-scoring elements (the
+     innermost ones on a tie) become slices. So does the setup block
+     (hooks, handlers) of each component they are in, so state can be
+     added. Returns None when nothing matches or the slices would cover
+     more than SLICE_MAX_FRACTION of the code; the caller then regenerates
+     the whole component.
+  3. The prompt shows only the slices, each under a stable "@@ slice N"
+     anchor. The model returns only the slices it changed, whole, in the
+     same format. splice() puts them back in place and rejects a
+     replacement that changes the slice's bracket balance (PatchError).
+
+Usage:
+    slices = jsx_slicer.find_slices(code, "make the header button red")
+    prompt = jsx_slicer.render_slices(code, slices) + jsx_slicer.SLICE_INSTRUCTIONS
+    code = jsx_slicer.splice(code, slices, jsx_slicer.parse_replacements(reply))
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+
+from agent.patching import PatchError
+
+MAX_FRACTION = float(os.environ.get("SLICE_MAX_FRACTION", "0.5"))
+MAX_SLICES = 12
+# Setup blocks (hooks, handlers, sample data) longer than this aren't sent
+_MAX_SETUP_LINES = 40
+
+_RE_TAG_START = re.compile(r"<(/?)([A-Za-z][\w.]*)")
+_RE_TOP_LEVEL = re.compile(r"^(?:export\s+)?(?:function|const|let|var)\s+([A-Za-z_$][\w$]*)", re.MULTILINE)
+_RE_RETURN_JSX = re.compile(r"^\s*return\s*\(?\s*$|^\s*return\s*\(?\s*<", re.MULTILINE)
+_RE_WORD = re.compile(r"[A-Za-z]+")
+_RE_CAMEL_PART = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])")
+_RE_SLICE_HEADER = re.compile(r"^@@\s*slice\s+(\d+)\b.*$", re.IGNORECASE)
+_RE_FENCE = re.compile(r"^```\w*\s*$")
+
+# A "<" after one of these (or at the start of a line, or after "return") opens a JSX tag;
+# anything else ("i < n", "a<b") is a comparison
+_TAG_PRECEDERS = set("(>?:&|{},=[")
+
+_STOP = {
+    "a", "an", "the", "to", "of", "in", "on", "at", "and", "or", "it", "its", "this", "that", "with", "for",
+    "make", "change", "set", "update", "modify", "use", "add", "remove", "put", "give", "turn", "please",
+    "should", "be", "is", "are", "into", "from", "by", "so", "more", "less", "bit", "little", "some", "all",
+    "can", "you", "me", "my", "instead", "also", "just", "only", "new", "color", "colour", "want", "like",
+    "look", "style", "component", "ui",
+}
+# Words that usually describe the change rather than locate it
+_TARGET_WORDS = {
+    "red", "blue", "green", "yellow", "orange", "purple", "pink", "gray", "grey", "black", "white", "indigo",
+    "emerald", "amber", "dark", "light", "bold", "bigger", "smaller", "larger", "big", "small", "large",
+    "rounded", "round", "square", "wider", "narrower", "taller", "shorter", "padding", "margin", "spacing",
+    "shadow", "border", "font", "size", "text", "background", "bg", "center", "centered", "left", "right",
+}
+# Request word -> tags it means
+_SYNONYMS = {
+    "button": {"button"}, "btn": {"button"}, "cta": {"button"},
+    "link": {"a"}, "image": {"img"}, "photo": {"img"}, "picture": {"img"}, "logo": {"img", "svg"},
+    "icon": {"svg"}, "heading": {"h1", "h2", "h3", "h4"}, "title": {"h1", "h2", "h3", "h4"},
+    "headline": {"h1", "h2"}, "subtitle": {"h2", "h3", "h4", "p"}, "paragraph": {"p"},
+    "navbar": {"nav"}, "navigation": {"nav"}, "menu": {"nav", "ul"}, "sidebar": {"aside"},
+    "list": {"ul", "ol"}, "item": {"li"}, "row": {"tr"}, "column": {"th", "td"}, "cell": {"td"},
+    "field": {"input", "textarea", "select"}, "textbox": {"input"}, "dropdown": {"select"},
+    "header": {"header", "thead"}, "footer": {"footer"},
+}
+
+SLICE_INSTRUCTIONS = """Return ONLY the slices you change, each one complete, in this exact format (no code fences, no explanations):
+
+@@ slice N
+<the full new text of slice N>
+@@ end
+
+Rules:
+- N is the slice number shown above; leave out slices that don't change
+- A returned slice replaces that slice entirely: keep its structure and indentation
+- Keep the rest of the component working (names, props, state); only these slices are changed"""
+
+
+@dataclass
+class Element:
+    tag: str
+    start: int  # first line (1-based)
+    end: int  # last line
+    parent: int | None
+    offset: int  # position of the opening "<"
+    attrs: str = ""
+    text: str = ""
+    component: str = ""
+
+
+@dataclass
+class Slice:
+    start: int
+    end: int
+    label: str
+    kind: str = "element"  # "element" or "setup"
+
+
+@dataclass
+class Outline:
+    elements: list[Element] = field(default_factory=list)
+    # (name, first line, last line, line of its JSX return or 0)
+    components: list[tuple[str, int, int, int]] = field(default_factory=list)
+
+
+def _words(text: str) -> set[str]:
+    """Lowercased words, camelCase / kebab-case split, lightly stemmed."""
+    out = set()
+    for word in _RE_WORD.findall(text or ""):
+        for part in _RE_CAMEL_PART.findall(word) or [word]:
+            part = part.lower()
+            out.add(part[:-1] if len(part) > 3 and part.endswith("s") and not part.endswith("ss") else part)
+    return out
+
+
+def _line_of(offsets: list[int], pos: int) -> int:
+    """1-based line of character `pos` (offsets[i] is where line i + 1 starts)."""
+    lo, hi = 0, len(offsets) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if offsets[mid] <= pos:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo + 1
+
+
+def _opens_tag(code: str, pos: int) -> bool:
+    i = pos - 1
+    while i >= 0 and code[i] in " \t":
+        i -= 1
+    if i < 0 or code[i] == "\n" or code[i] in _TAG_PRECEDERS:
+        return True
+    return code[max(0, i - 5):i + 1] == "return"
+
+
+def tag_end(code: str, pos: int) -> int:
+    """Index just past the ">" that closes the tag scanned from `pos` (braces and quotes skipped)."""
+    depth, quote = 0, ""
+    for i in range(pos, len(code)):
+        ch = code[i]
+        if quote:
+            if ch == quote:
+                quote = ""
+        elif ch in "\"'`":
+            quote = ch
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+        elif ch == ">" and depth <= 0:
+            return i + 1
+    return len(code)
+
+
+# ────────────── Parsing ──────────────
+
+def parse(code: str) -> Outline:
+    """Elements and top-level declarations of `code` (see module docstring)."""
+    offsets = [0] + [m.end() for m in re.finditer("\n", code)]
+    outline = Outline()
+
+    decls = [(m.group(1), _line_of(offsets, m.start())) for m in _RE_TOP_LEVEL.finditer(code)]
+    for i, (name, first) in enumerate(decls):
+        last = decls[i + 1][1] - 1 if i + 1 < len(decls) else len(offsets)
+        end_pos = offsets[last] if last < len(offsets) else len(code)
+        ret = _RE_RETURN_JSX.search(code, offsets[first - 1], end_pos)
+        outline.components.append((name, first, last, _line_of(offsets, ret.start()) if ret else 0))
+
+    def component_at(line: int) -> str:
+        return next((name for name, first, last, _ in outline.components if first <= line <= last), "")
+
+    elements = outline.elements
+    stack: list[tuple[int, int]] = []  # (element index, offset just past its opening tag)
+    child_spans: dict[int, list[tuple[int, int]]] = {}
+
+    def close(index: int, inner_start: int, inner_end: int, end: int) -> None:
+        element = elements[index]
+        element.end = _line_of(offsets, end - 1)
+        own, pos = [], inner_start
+        for lo, hi in sorted(child_spans.pop(index, [])):
+            own.append(code[pos:lo])
+            pos = hi
+        own.append(code[pos:inner_end])
+        element.text = " ".join(" ".join(own).split())[:200]
+        if element.parent is not None:
+            child_spans.setdefault(element.parent, []).append((element.offset, end))
+
+    for m in _RE_TAG_START.finditer(code):
+        closing, tag = m.group(1), m.group(2)
+        if not closing and not _opens_tag(code, m.start()):
+            continue
+        end = tag_end(code, m.end())
+        if closing:
+            # Pop to the matching open tag (tolerates unclosed tags in between)
+            for depth in range(len(stack) - 1, -1, -1):
+                if elements[stack[depth][0]].tag == tag:
+                    for index, inner_start in reversed(stack[depth:]):
+                        close(index, inner_start, m.start(), end)
+                    del stack[depth:]
+                    break
+            continue
+        line = _line_of(offsets, m.start())
+        elements.append(Element(tag=tag, start=line, end=line, parent=stack[-1][0] if stack else None,
+                                offset=m.start(), attrs=code[m.end():end - 1], component=component_at(line)))
+        index = len(elements) - 1
+        if code[end - 2:end] == "/>":
+            close(index, end, end, end)
+        else:
+            stack.append((index, end))
+    return outline
+
+
+# ────────────── Slicing ──────────────
+
+def _terms(request: str) -> set[str]:
+    return {w for w in _words(request) if w not in _STOP and w not in _TARGET_WORDS and len(w) > 1}
+
+
+def _own_matches(element: Element, terms: set[str]) -> set[str]:
+    tag = element.tag.lower()
+    found = _words(element.tag) | _words(element.attrs) | _words(element.text)
+    return {t for t in terms if t == tag or tag in _SYNONYMS.get(t, ()) or t in found}
+
+
+def _merge(slices: list[Slice]) -> list[Slice]:
+    merged: list[Slice] = []
+    for s in sorted(slices, key=lambda s: (s.start, s.end)):
+        if merged and s.start <= merged[-1].end + 1 and s.kind == merged[-1].kind == "element":
+            last = merged[-1]
+            merged[-1] = Slice(last.start, max(last.end, s.end), f"{last.label}, {s.label}")
+        elif merged and s.start <= merged[-1].end:
+            return []  # a setup block overlapping JSX: no clean cut
+        else:
+            merged.append(s)
+    return merged
+
+
+def find_slices(code: str, request: str) -> list[Slice] | None:
+    """The regions of `code` the edit `request` is about, or None to send the whole component."""
+    terms = _terms(request)
+    if not terms or not code.strip():
+        return None
+    outline = parse(code)
+    elements = outline.elements
+    own = [_own_matches(e, terms) for e in elements]
+
+    scores = []
+    for i, element in enumerate(elements):
+        context = terms & _words(element.component)
+        parent = element.parent
+        while parent is not None:
+            context |= own[parent]
+            parent = elements[parent].parent
+        scores.append(len(own[i] | context) if own[i] else 0)
+    best = max(scores, default=0)
+    if best == 0:
+        return None
+
+    chosen = {i for i, score in enumerate(scores) if score == best}
+    # Innermost on a tie: drop a chosen element when one of its descendants is chosen too
+    for i in list(chosen):
+        parent = elements[i].parent
+        while parent is not None:
+            chosen.discard(parent)
+            parent = elements[parent].parent
+    if len(chosen) > MAX_SLICES:
+        return None
+
+    slices = [Slice(elements[i].start, elements[i].end,
+                    f"<{elements[i].tag}>" + (f" in {elements[i].component}" if elements[i].component else ""))
+              for i in sorted(chosen)]
+    for name, first, _, ret in outline.components:
+        if ret and any(elements[i].component == name for i in chosen) and 0 < ret - first - 1 <= _MAX_SETUP_LINES:
+            slices.append(Slice(first + 1, ret - 1, f"setup of {name} (hooks, data, handlers)", kind="setup"))
+
+    slices = _merge(slices)
+    total = code.count("\n") + 1
+    if not slices or sum(s.end - s.start + 1 for s in slices) > MAX_FRACTION * total:
+        return None
+    return slices
+
+
+def render_slices(code: str, slices: list[Slice]) -> str:
+    """Prompt text: an outline of the component and the slices under their anchors."""
+    lines = code.split("\n")
+    outline = parse(code)
+    parts = ["## Component outline (top-level declarations)"]
+    parts += [f"- {name} (lines {first}-{last})" for name, first, last, _ in outline.components]
+    parts.append("\n## Slices of the current code (everything else stays exactly as it is)")
+    for n, s in enumerate(slices, 1):
+        parts.append(f"@@ slice {n} (lines {s.start}-{s.end}: {s.label})")
+        parts.append("\n".join(lines[s.start - 1:s.end]))
+    return "\n".join(parts) + "\n\n"
+
+
+# ────────────── Splicing ──────────────
+
+def parse_replacements(text: str) -> dict[int, str]:
+    """{slice number: new text} from a reply in the SLICE_INSTRUCTIONS format."""
+    out: dict[int, list[str]] = {}
+    current = None
+    for raw in (text or "").strip().split("\n"):
+        if _RE_FENCE.match(raw.strip()):
+            continue
+        header = _RE_SLICE_HEADER.match(raw.strip())
+        if header:
+            current = int(header.group(1))
+            out[current] = []
+        elif raw.strip().lower() == "@@ end":
+            current = None
+        elif current is not None:
+            out[current].append(raw)
+        elif raw.strip():
+            raise PatchError(f"Unexpected text outside a slice: {raw[:60]!r}")
+    if not out:
+        raise PatchError("No slices returned")
+    return {n: "\n".join(lines).rstrip() for n, lines in out.items()}
+
+
+def _bracket_delta(text: str) -> tuple[int, int, int]:
+    return text.count("{") - text.count("}"), text.count("(") - text.count(")"), text.count("[") - text.count("]")
+
+
+def splice(code: str, slices: list[Slice], replacements: dict[int, str]) -> str:
+    """`code` with the replaced slices put back in place (bottom-up). Raises PatchError."""
+    lines = code.split("\n")
+    for n in sorted(replacements, reverse=True):
+        if not 1 <= n <= len(slices):
+            raise PatchError(f"Unknown slice {n}")
+        s = slices[n - 1]
+        new = replacements[n]
+        if _bracket_delta(new) != _bracket_delta("\n".join(lines[s.start - 1:s.end])):
+            raise PatchError(f"Slice {n} unbalances brackets")
+        lines[s.start - 1:s.end] = new.split("\n") if new else []
+    return "\n".join(lines)
@@ -0,0 +1,95 @@
+"""
+In-process metrics for the agent pipeline.
+
+Thread-safe counters and rolling sample windows shared by the agents and
+the HTTP servers (which run requests on separate threads). No external
+backend — the chatbot server exposes a snapshot at GET /api/metrics.
+
+Usage:
+    from agent import metrics
+    metrics.incr("autofix.attempts")
+    metrics.observe("generation.seconds", 12.4)
+    metrics.register_ratio("autofix.fix_rate", "autofix.resolved", "autofix.attempts")
+"""
+
+import threading
+from collections import defaultdict, deque
+
+_MAX_SAMPLES = 500
+
+_lock = threading.Lock()
+_counters: dict[str, float] = defaultdict(float)
+_samples: dict[str, deque] = {}
+_ratios: dict[str, tuple[str, str]] = {}
+
+
+def incr(name: str, value: float = 1) -> None:
+    """Increment a counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float) -> None:
+    """Record one sample in a rolling window (last 500 values)."""
+    with _lock:
+        window = _samples.get(name)
+        if window is None:
+            window = _samples[name] = deque(maxlen=_MAX_SAMPLES)
+        window.append(float(value))
+
+
+def get(name: str) -> float:
+    """Current value of a counter (0 if never incremented)."""
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def percentile(name: str, pct: float) -> float | None:
+    """Percentile (0-100) of a sample window, or None if it has no samples."""
+    with _lock:
+        values = sorted(_samples.get(name, ()))
+    if not values:
+        return None
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def register_ratio(name: str, numerator: str, denominator: str) -> None:
+    """Declare a derived ratio (numerator / denominator counters) for snapshots."""
+    with _lock:
+        _ratios[name] = (numerator, denominator)
+
+
+def snapshot() -> dict:
+    """All counters, sample summaries and derived ratios as a JSON-safe dict."""
+    with _lock:
+        counters = dict(_counters)
+        samples = {k: sorted(v) for k, v in _samples.items()}
+        ratios = dict(_ratios)
+
+    summaries = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        n = len(values)
+        summaries[name] = {
+            "count": n,
+            "mean": round(sum(values) / n, 4),
+            "p50": values[int(0.5 * (n - 1))],
+            "p90": values[int(0.9 * (n - 1))],
+            "p99": values[int(0.99 * (n - 1))],
+        }
+
+    derived = {}
+    for name, (num, den) in ratios.items():
+        d = counters.get(den, 0)
+        derived[name] = round(counters.get(num, 0) / d, 4) if d else None
+
+    return {"counters": counters, "samples": summaries, "ratios": derived}
+
+
+def reset() -> None:
+    """Clear all counters and samples (ratio declarations are kept)."""
+    with _lock:
+        _counters.clear()
+        _samples.clear()
@@ -7,43 +7,131 @@ Custom LangGraph StateGraph that:
 3. Handles QA feedback loop (retry generation if QA fails)
 
 Workflows:
-  "generate"  -> Discovery -> Generation -> QA (-> retry if FAIL)
+  "generate"  -> Discovery -> Generation -> QA (-> auto-fix -> retry if still FAIL)
+                 Large new pages are generated as parallel sections and assembled
+                 (agent.sections), falling back to a single generation
+                 Modify turns rewrite only the slices the edit is about (agent.jsx_slicer)
+                 Variant requests fan out instead: one Generation+QA per variant in
+                 parallel (Send -> variant_generation), merged by variant_merge
+                 Race mode (state["race"] = N): N concurrent candidates, first QA PASS wins
   "discover"  -> Discovery only
   "review"    -> QA only
   "chat"      -> Direct LLM response
+
+Every run has a deadline (state["deadline"], epoch seconds): per call, or per
+workflow from DEADLINES. LLM nodes run within the remaining budget, retries are
+skipped when it's nearly spent, and respond returns the best QA'd code so far.
+
+Generations run on the model tier agent.routing picks from the discovery plan
+(one tier up per QA retry), and every QA verdict is recorded against its tier.
 """
 
+import asyncio
 import logging
+import os
 import re
+import time
 from typing import Annotated, TypedDict
 
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langgraph.graph import END, StateGraph
 from langgraph.graph.message import add_messages
+from langgraph.types import Send
 
+from agent import (archetypes, budget, cache, intent, metrics, prefetch, prompt_cache, providers, routing,
+                   scheduler, sections, semantic_cache)
+from agent.autofix import autofix, is_fixable, record as record_autofix
+from agent.compaction import compact_messages
 from agent.discovery import run_discovery
-from agent.generator import run_generation
-from agent.tools import verify_quality, check_accessibility, set_active_library
+from agent.generator import run_generation, run_patch, run_slice_edit
+from agent.reviewer import evaluate
+from agent.streaming_qa import EarlyAbort
+from agent.tools import set_active_library
+from agent.variants import name_suffix, plan_variants, qa_and_fix
 
 logger = logging.getLogger(__name__)
 
 MAX_QA_RETRIES = 2
 
+# QA retries ask for a line-anchored patch first; full regeneration only if it fails to apply
+PATCH_RETRIES = os.environ.get("QA_PATCH_RETRIES", "true").lower() != "false"
+
+# Modify turns rewrite only the slices of the previous code the edit is about (agent.jsx_slicer)
+SLICE_EDITS = os.environ.get("SLICE_EDITS", "true").lower() != "false"
+
+# Check the generation stream as it arrives and stop certain QA failures early
+STREAMING_QA = os.environ.get("STREAMING_QA", "true").lower() != "false"
+
+# Race mode candidates, in launch order; also the most a race can run
+RACE_CANDIDATES = [
+    {"temperature": 0.2},
+    {"temperature": 0.7},
+    {"use_fallback_model": True},
+    {"temperature": 1.0},
+]
+
+metrics.register_ratio("race.pass_rate", "race.pass_wins", "race.runs")
+
+# Request deadlines per workflow, in seconds — the pipeline's latency SLO.
+# Override with DEADLINE_<WORKFLOW>_S (e.g. DEADLINE_GENERATE_S=30) or per call.
+DEADLINES = {
+    wf: float(os.environ.get(f"DEADLINE_{wf.upper()}_S", default))
+    for wf, default in (("generate", 60), ("discover", 20), ("review", 10), ("chat", 20))
+}
+CLASSIFY_TIMEOUT_S = 8.0
+# Budget kept back for respond_node, and the minimum worth starting a QA retry with
+RESPOND_RESERVE_S = 1.5
+MIN_RETRY_S = 10.0
+
 # Pre-compiled regex for code extraction (avoids recompilation per call)
 _RE_CODE_BLOCK = re.compile(r"```(?:jsx|javascript|tsx|js)?\s*\n(.*?)```", re.DOTALL)
+_RE_HEADING = re.compile(r"^##\s+(.+)$", re.MULTILINE)
 
 
 # ────────────── State ──────────────
 
+def _merge_variants(left: list | None, right: list | None) -> list:
+    """Reducer for variant fan-out results: None resets (new turn), lists accumulate."""
+    if right is None:
+        return []
+    return (left or []) + right
+
+
 class OrchestratorState(TypedDict):
     messages: Annotated[list, add_messages]
     workflow: str
     user_request: str
+    # The user's own words (user_request may carry instructions the client appends)
+    intent: str
     discovery_output: str
     generated_code: str
     qa_result: str
     retry_count: int
     library: str
+    autofix_done: bool
+    variants: Annotated[list, _merge_variants]
+    race: int
+    # Parsed once when generated_code is set (see _code_update) — nodes read these
+    # instead of re-running the code-block regex over the same text
+    code_blocks: list[str]
+    headings: list[str]
+    # Latest component from history, resolved once per turn in classify_node
+    previous_code: str
+    # Deadline (epoch seconds, 0 = none) and the best QA'd code seen this turn
+    deadline: float
+    timed_out: bool
+    best_code: str
+    best_qa: str
+    best_score: int
+    # Served from agent.cache / agent.semantic_cache (classify -> respond, no LLM calls)
+    cache_hit: bool
+    semantic_match: dict | None
+    # Generation stream stopped by StreamingQA (qa_result holds the FAIL report)
+    aborted: bool
+    # Results computed from the user's draft while typing (agent.prefetch.handoff), this turn only
+    prefetched: dict
+    # Model tier (agent.routing) of the code QA checks next; "" when a patch or autofix produced it
+    tier: str
 
 
 # ────────────── Helpers ──────────────
@@ -75,7 +163,8 @@ def _is_variant_request(text: str) -> bool:
 
 def _get_previous_code(state: OrchestratorState) -> str:
     """Extract the most recent generated code from conversation history.
-    Looks through AI messages for the last jsx code block."""
+    Looks through AI messages for the last jsx code block. Called once per
+    turn by classify_node; nodes read state["previous_code"] afterwards."""
     for msg in reversed(state.get("messages", [])):
         if isinstance(msg, AIMessage) and msg.content:
             code = _extract_code(msg.content)
@@ -84,12 +173,61 @@ def _get_previous_code(state: OrchestratorState) -> str:
     return ""
 
 
+def _code_update(text: str) -> dict:
+    """State update for new generated output, with its parsed artifacts.
+
+    A bare component (no fences) is a single block; headings are only kept
+    for multi-block variant responses.
+    """
+    blocks = _extract_all_codes(text)
+    if not blocks and text.strip():
+        blocks = [text.strip()]
+    return {
+        "generated_code": text,
+        "code_blocks": blocks,
+        "headings": _RE_HEADING.findall(text) if len(blocks) > 1 else [],
+    }
+
+
+def _remaining(state: dict) -> float | None:
+    """Seconds left before the deadline (None if the run has no deadline)."""
+    deadline = state.get("deadline") or 0
+    return deadline - time.time() if deadline else None
+
+
+async def _within_budget(coro, state: dict, reserve: float = RESPOND_RESERVE_S):
+    """Await `coro`, raising asyncio.TimeoutError if it would overrun the deadline
+    (minus `reserve` seconds kept back for the nodes that still have to run)."""
+    remaining = _remaining(state)
+    if remaining is None:
+        return await coro
+    if remaining - reserve <= 0:
+        coro.close()
+        raise asyncio.TimeoutError
+    return await asyncio.wait_for(coro, remaining - reserve)
+
+
+def _timed_out(node: str) -> dict:
+    metrics.incr(f"deadline.timeouts.{node}")
+    logger.warning("[deadline] %s cut short by the request deadline", node)
+    return {"timed_out": True}
+
+
+def _track_best(state: dict, code: str, result: dict) -> dict:
+    """Remember this QA'd code if it beats the best seen so far this turn."""
+    if not code or result["score"] <= state.get("best_score", -1):
+        return {}
+    return {"best_code": code, "best_qa": result["report"], "best_score": result["score"]}
+
+
 def _get_conversation_summary(state: OrchestratorState, max_turns: int = 6) -> list:
-    """Get the last N conversation turns as LangChain messages (for context)."""
+    """Get the conversation history as compacted LangChain messages (for context).
+    The last `max_turns` messages are kept (code deduplicated); older ones are
+    folded into a cached summary, so the prompt stays bounded in long sessions."""
     all_msgs = state.get("messages", [])
     # Skip the last message (current user request — already handled separately)
     history = all_msgs[:-1] if len(all_msgs) > 1 else []
-    return history[-max_turns:] if history else []
+    return compact_messages(history, keep_recent=max_turns) if history else []
 
 
 def _summarize(text: str, max_len: int = 1500) -> str:
@@ -114,44 +252,92 @@ def _get_fast_model():
     return _fast_model
 
 
+def _pick_fast_model() -> tuple[str, object]:
+    """(provider, model): GPT-4o-mini, or Claude Haiku while OpenAI's circuit is open."""
+    provider = providers.pick("openai", "anthropic")
+    return provider, _get_fast_model() if provider == "openai" else providers.fast_fallback_model()
+
+
 # ────────────── Node: Classify ──────────────
 
 async def classify_node(state: OrchestratorState) -> dict:
     """Analyze the user's request and decide the workflow.
-    Skips the LLM call if workflow is already pre-classified."""
+    Skips the LLM call if workflow is already pre-classified or the local
+    intent classifier is confident."""
     set_active_library(state.get("library", "untitledui"))
     user_msg = _get_last_user_message(state)
+    # Scan history for the last component once; later nodes read state["previous_code"]
+    previous_code = state.get("previous_code") or _get_previous_code(state)
+    started = time.time()
 
-    if state.get("workflow"):
-        logger.info("[classify] Pre-classified as: %s (skipped LLM call)", state["workflow"])
-        return {"user_request": user_msg}
+    library = state.get("library", "untitledui")
 
-    model = _get_fast_model()
+    async def _update(workflow: str) -> dict:
+        # A per-call deadline wins; otherwise the workflow's SLO applies from request start
+        deadline = state.get("deadline") or (started + DEADLINES.get(workflow, DEADLINES["chat"]))
+        update = {"workflow": workflow, "user_request": user_msg, "previous_code": previous_code, "deadline": deadline}
+        # Same request + library + previous component as an earlier QA PASS: answer from cache
+        if workflow == "generate" and state.get("race", 0) <= 1:
+            hit = cache.get("generation", user_msg, library, previous_code)
+            if not hit and semantic_cache.eligible(user_msg, previous_code) and not _is_variant_request(user_msg):
+                # Paraphrase of an earlier QA-passed request: serve it as a draft, refine off-path
+                hit = await asyncio.to_thread(semantic_cache.lookup, user_msg, library)
+                if hit:
+                    update["semantic_match"] = {"similarity": hit["similarity"], "request": hit["matched_request"]}
+                    semantic_cache.refine_in_background(user_msg, library)
+            if hit:
+                update.update(_code_update(hit["generated_code"]))
+                update.update({"qa_result": hit["qa_result"], "cache_hit": True})
+        return update
 
+    if state.get("workflow"):
+        logger.info("[classify] Pre-classified as: %s (skipped LLM call)", state["workflow"])
+        return await _update(state["workflow"])
+
+    # Local classifier first; the LLM only sees low-confidence messages
+    label, confidence, source = intent.classify(user_msg)
+    if not intent.needs_llm(confidence):
+        logger.info("[classify] Local: %s (%s, %.2f)", label, source, confidence)
+        return await _update(label)
+
+    # Classification doesn't depend on the library, so it's cached library-agnostic ("")
+    cached = cache.get("classify", user_msg, "")
+    if cached:
+        return await _update(cached["workflow"])
+
+    provider, model = _pick_fast_model()
+
+    classify_messages = [
+        SystemMessage(content=(
+            "Classify the user's request into exactly one category. "
+            "Respond with ONLY the category name.\n\n"
+            '"generate" — user wants to CREATE, BUILD, GENERATE, MAKE, or MODIFY a UI component, '
+            "page, dashboard, form, table, card, or any visual element. "
+            "Also includes: redesign, add dark mode, make responsive, simplify, add animation.\n"
+            "Examples: \"Create a login form\", \"Build a dashboard\", \"Make it more minimal\", "
+            "\"Add dark mode\", \"Generate 3 variants\"\n\n"
+            '"discover" — user wants to EXPLORE, LIST, or BROWSE available components or design tokens.\n'
+            "Examples: \"What components are available?\", \"Show me the design tokens\", "
+            "\"List all components\"\n\n"
+            '"review" — user wants to REVIEW, CHECK, or AUDIT existing code.\n'
+            "Examples: \"Review this code\", \"Check accessibility\"\n\n"
+            '"chat" — general question, greeting, or anything NOT about building UI.\n'
+            "Examples: \"Hello\", \"How does the pipeline work?\", \"Thanks\""
+        )),
+        HumanMessage(content=user_msg),
+    ]
     try:
-        response = await model.ainvoke([
-            SystemMessage(content=(
-                "Classify the user's request into exactly one category. "
-                "Respond with ONLY the category name.\n\n"
-                '"generate" — user wants to CREATE, BUILD, GENERATE, MAKE, or MODIFY a UI component, '
-                "page, dashboard, form, table, card, or any visual element. "
-                "Also includes: redesign, add dark mode, make responsive, simplify, add animation.\n"
-                "Examples: \"Create a login form\", \"Build a dashboard\", \"Make it more minimal\", "
-                "\"Add dark mode\", \"Generate 3 variants\"\n\n"
-                '"discover" — user wants to EXPLORE, LIST, or BROWSE available components or design tokens.\n'
-                "Examples: \"What components are available?\", \"Show me the design tokens\", "
-                "\"List all components\"\n\n"
-                '"review" — user wants to REVIEW, CHECK, or AUDIT existing code.\n'
-                "Examples: \"Review this code\", \"Check accessibility\"\n\n"
-                '"chat" — general question, greeting, or anything NOT about building UI.\n'
-                "Examples: \"Hello\", \"How does the pipeline work?\", \"Thanks\""
-            )),
-            HumanMessage(content=user_msg),
-        ])
+        # The timeout covers the scheduler queue too: a long wait falls back to the local guess
+        response = await asyncio.wait_for(
+            scheduler.call(provider, model.ainvoke(classify_messages), scheduler.INTERACTIVE, model,
+                           messages=classify_messages, output_tokens=10),
+            CLASSIFY_TIMEOUT_S)
         category = response.content.strip().lower().strip('"').strip("'")
+        from_llm = True
     except Exception as e:
-        logger.error("[classify] LLM call failed: %s — defaulting to chat", e)
-        category = "chat"
+        logger.error("[classify] LLM call failed: %s — using local guess (%s)", e, label)
+        category = label
+        from_llm = False
 
     if "generate" in category:
         workflow = "generate"
@@ -162,7 +348,10 @@ async def classify_node(state: OrchestratorState) -> dict:
     else:
         workflow = "chat"
 
-    return {"workflow": workflow, "user_request": user_msg}
+    if from_llm:
+        # Only real LLM answers are cached (not the local guess used when the call fails)
+        cache.put("classify", user_msg, "", {"workflow": workflow})
+    return await _update(workflow)
 
 
 # ────────────── Node: Discovery ──────────────
@@ -170,10 +359,33 @@ async def classify_node(state: OrchestratorState) -> dict:
 async def discovery_node(state: OrchestratorState) -> dict:
     """Run fast component discovery (single LLM call, no ReAct loops)."""
     user_msg = state.get("user_request") or _get_last_user_message(state)
-    previous_code = _get_previous_code(state)
     library = state.get("library", "untitledui")
 
-    result = await run_discovery(user_msg, has_previous_code=bool(previous_code), library=library)
+    has_previous_code = bool(state.get("previous_code"))
+    # The plan depends on whether a component is being modified, not on its exact code
+    cache_args = ("discovery", user_msg, library, "modify" if has_previous_code else "")
+    cached = cache.get(*cache_args)
+    if cached:
+        return {"discovery_output": cached["discovery_output"]}
+    pre = state.get("prefetched") or {}
+    if pre.get("discovery") and pre.get("modify") == has_previous_code:
+        prefetch.used("discovery", pre["seconds"]["discovery"])
+        return {"discovery_output": pre["discovery"]}
+    plan = archetypes.plan_for(state.get("intent") or user_msg, library, has_previous_code)
+    if plan:
+        return {"discovery_output": plan}
+
+    # Keep enough budget back for generation; without discovery it still works, just less targeted
+    reserve = RESPOND_RESERVE_S + (MIN_RETRY_S if state.get("workflow") == "generate" else 0)
+    try:
+        result = await _within_budget(
+            run_discovery(user_msg, has_previous_code=has_previous_code, library=library),
+            state, reserve=reserve,
+        )
+    except asyncio.TimeoutError:
+        return {"discovery_output": "", **_timed_out("discovery")}
+    if result and not result.startswith("Discovery failed"):
+        cache.put(*cache_args, {"discovery_output": result})
     return {"discovery_output": result}
 
 
@@ -185,25 +397,204 @@ async def generation_node(state: OrchestratorState) -> dict:
     user_msg = state.get("user_request") or _get_last_user_message(state)
     discovery = state.get("discovery_output", "")
     qa_feedback = state.get("qa_result", "") if state.get("retry_count", 0) > 0 else ""
-    previous_code = _get_previous_code(state)
-
+    previous_code = state.get("previous_code", "")
     library = state.get("library", "untitledui")
-    result = await run_generation(
-        user_request=user_msg,
-        discovery_output=discovery,
-        previous_code=previous_code,
-        qa_feedback=qa_feedback,
-        library=library,
-    )
+
+    # Retry: patch the current single-component code instead of regenerating it
+    current = state.get("generated_code", "")
+    blocks = state.get("code_blocks") or []
+    try:
+        if (qa_feedback and PATCH_RETRIES and len(blocks) == 1 and not current.startswith("Error generating code")):
+            patched = await _within_budget(
+                run_patch(blocks[0], qa_feedback, user_request=user_msg, library=library), state)
+            if patched:
+                return {**_code_update(patched), "autofix_done": False, "tier": ""}
+
+        # Modify turn: send only the regions the edit is about and splice the reply back in
+        if SLICE_EDITS and previous_code and not qa_feedback and not _is_variant_request(user_msg):
+            edited = await _within_budget(
+                run_slice_edit(previous_code, state.get("intent") or user_msg, library=library), state)
+            if edited:
+                return {**_code_update(edited), "autofix_done": False, "tier": ""}
+
+        # Simple requests run on a faster tier; each QA retry moves one tier up
+        route = routing.route(user_msg, discovery, previous_code, library=library,
+                              attempt=state.get("retry_count", 0))
+        # Large new pages: sections written in parallel and assembled (None -> single shot)
+        if not qa_feedback and sections.eligible(route, previous_code, _is_variant_request(user_msg)):
+            result = await _within_budget(sections.run(user_msg, discovery, library), state)
+            if result:  # QA is recorded against the page's route (sections don't count as requests)
+                return {**_code_update(_extract_code(result)), "autofix_done": False, "tier": route.tier}
+        # Variant responses hold several blocks; streaming QA only follows single components
+        result = await _within_budget(run_generation(
+            user_request=user_msg,
+            discovery_output=discovery,
+            previous_code=previous_code,
+            qa_feedback=qa_feedback,
+            library=library,
+            streaming_qa=STREAMING_QA and not _is_variant_request(user_msg),
+            hedge=True,
+            route=route,
+        ), state)
+    except asyncio.TimeoutError:
+        # Keep the current (already QA'd) code; respond falls back to the best version
+        return {"autofix_done": True, "tier": "", **_timed_out("generation")}
+    except EarlyAbort as e:
+        # Certain, non-autofixable QA failure: skip QA/autofix and go straight to the retry.
+        # The previous attempt's code is cleared: the report is about the aborted output, so the
+        # retry regenerates instead of patching older code (respond falls back to best_code)
+        logger.info("[generation] stopped early: %s", e)
+        routing.record_qa(route.tier, False)
+        return {**_code_update(""), "qa_result": e.report, "autofix_done": True, "aborted": True, "tier": ""}
 
     # For variant requests, preserve the full response with all code blocks + headings
-    if _is_variant_request(user_msg):
-        all_codes = _extract_all_codes(result)
-        if len(all_codes) > 1:
-            return {"generated_code": result}
+    update = _code_update(result)
+    if _is_variant_request(user_msg) and len(update["code_blocks"]) > 1:
+        return {**update, "autofix_done": False, "tier": route.tier}
 
     code = _extract_code(result)
-    return {"generated_code": code or result}
+    return {**(_code_update(code) if code else update), "autofix_done": False, "tier": route.tier}
+
+
+# ────────────── Node: Variant fan-out (map / reduce) ──────────────
+
+async def variant_generation_node(task: dict) -> dict:
+    """Map step: generate, QA, auto-fix and retry ONE variant independently.
+    Receives the Send payload built by route_after_discovery."""
+    idx, style = task["index"], task["style"]
+    library = task.get("library", "untitledui")
+    suffix = name_suffix(style, idx)
+    best = None
+    feedback = ""
+
+    for attempt in range(MAX_QA_RETRIES + 1):
+        remaining = _remaining(task)
+        if attempt and remaining is not None and remaining < MIN_RETRY_S:
+            metrics.incr("deadline.retries_skipped")
+            break
+        code, route = None, None
+        try:
+            if feedback and PATCH_RETRIES:
+                code = await _within_budget(
+                    run_patch(best["code"], feedback, user_request=task["user_request"], library=library), task)
+            if not code:
+                route = routing.route(task["user_request"], task.get("discovery_output", ""),
+                                      task.get("previous_code", ""), library=library, attempt=attempt)
+                result = await _within_budget(run_generation(
+                    user_request=task["user_request"],
+                    discovery_output=task.get("discovery_output", ""),
+                    previous_code=task.get("previous_code", ""),
+                    qa_feedback=feedback,
+                    library=library,
+                    variant_style=style,
+                    variant_suffix=suffix,
+                    route=route,
+                ), task)
+                code = _extract_code(result) or result
+        except asyncio.TimeoutError:
+            _timed_out("variant_generation")
+            break
+        checked = qa_and_fix(code, library)
+        if route:
+            routing.record_qa(route.tier, checked["verdict"] == "PASS")
+        if best is None or checked["verdict"] == "PASS" or checked["score"] > best["score"]:
+            best = checked
+        if checked["verdict"] == "PASS":
+            break
+        feedback = checked["report"]
+
+    if best is None:
+        return {"variants": [{"index": idx, "style": style, "code": "", "verdict": "FAIL", "score": 0,
+                              "report": "**Verdict: FAIL** (score: 0/100)\n1. [deadline] Not generated in time"}]}
+    logger.info("[variants] #%d (%s) -> %s (score %s)", idx + 1, style, best["verdict"], best["score"])
+    return {"variants": [{"index": idx, "style": style, **best}]}
+
+
+async def variant_merge_node(state: OrchestratorState) -> dict:
+    """Reduce step: assemble the per-variant results into one markdown response + QA summary."""
+    variants = sorted((v for v in state.get("variants") or [] if v["code"]), key=lambda v: v["index"])
+    if not variants:
+        return {**_code_update(""), "qa_result": "**Verdict: FAIL** (score: 0/100)\nNo code was generated."}
+
+    blocks = [f"## Variant {v['index'] + 1}: {v['style']}\n```jsx\n{v['code']}\n```" for v in variants]
+    verdict = "PASS" if all(v["verdict"] == "PASS" for v in variants) else "FAIL"
+    score = min(v["score"] for v in variants)
+
+    parts = [f"**Verdict: {verdict}** (score: {score}/100)"]
+    n = 1
+    for v in variants:
+        for line in v["report"].split("\n")[1:3]:
+            parts.append(f"{n}. [variant {v['index'] + 1}] {line.split('. ', 1)[-1]}")
+            n += 1
+
+    return {**_code_update("\n\n".join(blocks)), "qa_result": "\n".join(parts), "autofix_done": True}
+
+
+# ────────────── Node: Race (best-of-N) ──────────────
+
+async def race_generation_node(state: OrchestratorState) -> dict:
+    """Launch N generations concurrently (different temperatures / fallback model).
+    QA each as it completes; the first PASS wins and the rest are cancelled.
+    If nothing passes, the highest-scoring candidate is returned."""
+    user_msg = state.get("user_request") or _get_last_user_message(state)
+    library = state.get("library", "untitledui")
+    previous_code = state.get("previous_code", "")
+    n = max(2, min(len(RACE_CANDIDATES), int(state.get("race", 2))))
+    configs = RACE_CANDIDATES[:n]
+    route = routing.route(user_msg, state.get("discovery_output", ""), previous_code, library=library)
+
+    async def candidate(cfg: dict) -> dict:
+        result = await run_generation(
+            user_request=user_msg,
+            discovery_output=state.get("discovery_output", ""),
+            previous_code=previous_code,
+            library=library,
+            route=route,
+            **cfg,
+        )
+        return qa_and_fix(_extract_code(result) or result, library)
+
+    t0 = time.time()
+    tasks = [asyncio.create_task(candidate(cfg)) for cfg in configs]
+    best = None
+    finished = 0
+    remaining = _remaining(state)
+    timed_out = False
+    try:
+        for next_done in asyncio.as_completed(
+                tasks, timeout=None if remaining is None else max(0.0, remaining - RESPOND_RESERVE_S)):
+            try:
+                checked = await next_done
+            except asyncio.TimeoutError:
+                timed_out = True
+                break
+            except Exception as e:
+                logger.warning("[race] candidate failed: %s", e)
+                continue
+            finished += 1
+            if best is None or checked["score"] > best["score"] or checked["verdict"] == "PASS":
+                best = checked
+            if checked["verdict"] == "PASS":
+                break
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+    elapsed = time.time() - t0
+    metrics.incr("race.runs")
+    metrics.incr("race.cancelled", n - finished)
+    metrics.observe("race.seconds", elapsed)
+    if timed_out:
+        _timed_out("race_generation")
+    if best is None:
+        return {**_code_update(""), "qa_result": "**Verdict: FAIL** (score: 0/100)\nNo code was generated.",
+                "autofix_done": True, "timed_out": timed_out}
+    if best["verdict"] == "PASS":
+        metrics.incr("race.pass_wins")
+    logger.info("[race] %d/%d candidates finished in %.1fs -> %s (score %s)",
+                finished, n, elapsed, best["verdict"], best["score"])
+    return {**_code_update(best["code"]), "qa_result": best["report"], "autofix_done": True, "timed_out": timed_out}
 
 
 # ────────────── Node: QA ──────────────
@@ -211,36 +602,53 @@ async def generation_node(state: OrchestratorState) -> dict:
 async def qa_node(state: OrchestratorState) -> dict:
     """Run QA checks directly — no LLM needed, pure rule-based.
     For variant responses, QA checks the first code block."""
-    import json as _json
-    raw_code = state.get("generated_code", "")
+    blocks = state.get("code_blocks") or []
 
-    if not raw_code.strip():
+    if not blocks:
         return {"qa_result": "**Verdict: FAIL** (score: 0/100)\nNo code was generated."}
 
     # For multi-block variant responses, QA the first block
-    all_codes = _extract_all_codes(raw_code)
-    code = all_codes[0] if all_codes else _extract_code(raw_code) or raw_code
-
-    quality_raw = verify_quality.invoke({"code": code})
-    access_raw = check_accessibility.invoke({"code": code})
+    result = evaluate(blocks[0])
+    if state.get("tier"):
+        routing.record_qa(state["tier"], result["verdict"] == "PASS")
+    return {"qa_result": result["report"], **_track_best(state, state.get("generated_code", ""), result)}
 
-    quality = _json.loads(quality_raw) if isinstance(quality_raw, str) else quality_raw
-    access = _json.loads(access_raw) if isinstance(access_raw, str) else access_raw
 
-    q_score = quality.get("score", 0)
-    a_score = access.get("score", 0)
-    combined_score = min(q_score, a_score)
+# ────────────── Node: Auto-fix ──────────────
 
-    all_issues = quality.get("issues", []) + access.get("issues", [])
-    has_errors = any(i.get("severity") == "error" for i in all_issues)
-    verdict = "FAIL" if has_errors or combined_score < 70 else "PASS"
+async def autofix_node(state: OrchestratorState) -> dict:
+    """Patch mechanical QA failures in place and re-run QA.
+    Only escalates to an LLM retry if errors that can't be fixed remain."""
+    raw_code = state.get("generated_code", "")
+    library = state.get("library", "untitledui")
+    all_codes = state.get("code_blocks") or []
+    applied: list[str] = []
+
+    if len(all_codes) > 1:
+        # Variant response: fix each block inside the markdown, QA the first (as qa_node does)
+        fixed_text = raw_code
+        for block in all_codes:
+            fixed, names = autofix(block, evaluate(block)["issues"], library)
+            if names:
+                fixed_text = fixed_text.replace(block, fixed, 1)
+                applied.extend(n for n in names if n not in applied)
+        update = _code_update(fixed_text)
+        report = evaluate(update["code_blocks"][0])
+    else:
+        code = all_codes[0] if all_codes else raw_code
+        before = evaluate(code)
+        new_code, applied = autofix(code, before["issues"], library)
+        update = _code_update(new_code) if applied else {}
+        report = evaluate(new_code) if applied else before
 
-    parts = [f"**Verdict: {verdict}** (score: {combined_score}/100)"]
-    if all_issues:
-        for i, issue in enumerate(all_issues[:6], 1):
-            parts.append(f"{i}. [{issue.get('rule', '?')}] {issue.get('message', '')}")
+    resolved = report["verdict"] == "PASS"
+    record_autofix(resolved, applied)
+    unfixable = [i for i in report["issues"] if i.get("severity") == "error" and not is_fixable(i)]
+    logger.info("[autofix] applied=%s -> %s (score %s)%s", applied or "none", report["verdict"],
+                report["score"], f", {len(unfixable)} unfixable error(s)" if unfixable else "")
 
-    return {"qa_result": "\n".join(parts)}
+    best = _track_best(state, update.get("generated_code", raw_code), report)
+    return {**update, "qa_result": report["report"], "autofix_done": True, **best}
 
 
 # ────────────── Node: Respond ──────────────
@@ -250,27 +658,56 @@ async def respond_node(state: OrchestratorState) -> dict:
     workflow = state.get("workflow", "chat")
 
     if workflow == "generate":
-        raw_code = state.get("generated_code", "")
+        all_codes = state.get("code_blocks") or []
+        headings = state.get("headings") or []
         qa = state.get("qa_result", "")
         user_msg = state.get("user_request") or _get_last_user_message(state)
 
+        # A retry that scored worse (or was cut off by the deadline) shouldn't replace a better version
+        score_match = re.search(r"score[:\s]*(\d+)", qa)
+        current_score = int(score_match.group(1)) if score_match else -1
+        final_code = state.get("generated_code", "")
+        if state.get("best_code") and state.get("best_score", -1) > current_score:
+            best = _code_update(state["best_code"])
+            all_codes, headings, qa = best["code_blocks"], best["headings"], state.get("best_qa", qa)
+            final_code = state["best_code"]
+
+        if all_codes and "PASS" in qa.upper() and not state.get("cache_hit") and not state.get("timed_out"):
+            library = state.get("library", "untitledui")
+            previous_code = state.get("previous_code", "")
+            cache.put("generation", user_msg, library, {"generated_code": final_code, "qa_result": qa},
+                      previous_code=previous_code)
+            if len(all_codes) == 1 and semantic_cache.eligible(user_msg, previous_code):
+                semantic_cache.remember(user_msg, library, all_codes[0], qa)
+
+        if not all_codes:
+            if state.get("timed_out"):
+                return {"messages": [AIMessage(content=(
+                    "Sorry — the component couldn't be generated within the time limit. "
+                    "Please try again, or simplify the request."
+                ))]}
+            # Every attempt was stopped by streaming QA (its code is cleared) and none passed
+            issues = re.findall(r"\d+\.\s*\[.*?\]\s*(.*?)(?=\n\d+\.|\Z)", qa, re.DOTALL)
+            detail = "; ".join(i.strip().split("\n")[0][:80] for i in issues[:3]) or _summarize(qa, 200)
+            return {"messages": [AIMessage(content=(
+                "Sorry — I couldn't generate a component that passes QA"
+                + (f" ({detail})" if detail else "") + ". Please try again, or rephrase the request."
+            ))]}
+
         # Check if this is a variant response with multiple code blocks
-        all_codes = _extract_all_codes(raw_code)
         is_variant = _is_variant_request(user_msg) and len(all_codes) > 1
 
         parts = []
 
         if is_variant:
             parts.append(f"Here are {len(all_codes)} variants:\n")
-            # Extract headings from the raw response
-            headings = re.findall(r"^##\s+(.+)$", raw_code, re.MULTILINE)
             for idx, code_block in enumerate(all_codes):
                 heading = headings[idx] if idx < len(headings) else f"Variant {idx + 1}"
                 parts.append(f"## {heading}\n")
                 parts.append(f"```jsx\n{code_block}\n```\n")
         else:
             parts.append("Here's the generated component:\n")
-            code = all_codes[0] if all_codes else (_extract_code(raw_code) or raw_code)
+            code = all_codes[0] if all_codes else ""
             if code:
                 parts.append(f"```jsx\n{code}\n```")
 
@@ -287,8 +724,22 @@ async def respond_node(state: OrchestratorState) -> dict:
                 else:
                     parts.append(f"\n**QA Review:** {_summarize(qa, 200)}")
 
+        match = state.get("semantic_match")
+        if match:
+            note = f"\n_Draft from a similar earlier request ({match['similarity']:.0%} match)"
+            if semantic_cache.refine_enabled():
+                note += "; a version tailored to this exact request is being generated in the background"
+            parts.append(note + "._")
+
+        if state.get("timed_out"):
+            parts.append("\n_Stopped early to stay within the response time limit — this is the best version so far._")
+
         response = "\n".join(parts) if parts else "Could not generate the component."
-        return {"messages": [AIMessage(content=response)]}
+        update = {"messages": [AIMessage(content=response)]}
+        # Same rule as _get_previous_code: the first block of the latest response, if substantial
+        if all_codes and len(all_codes[0]) > 50:
+            update["previous_code"] = all_codes[0]
+        return update
 
     elif workflow == "discover":
         discovery = state.get("discovery_output", "")
@@ -303,44 +754,64 @@ async def respond_node(state: OrchestratorState) -> dict:
         return {"messages": [AIMessage(content=qa or "Could not review the code.")]}
 
     else:
-        model = _get_fast_model()
+        provider, model = _pick_fast_model()
         user_msg = _get_last_user_message(state)
         history_msgs = _get_conversation_summary(state, max_turns=10)
         library = state.get("library", "untitledui")
         lib_label = {"untitledui": "Untitled UI", "metafore": "Metafore", "vernam": "Vernam", "both": "Untitled UI + Metafore"}.get(library, library)
 
-        llm_messages = [
-            SystemMessage(content=(
-                f"You are a helpful assistant for the Milestone 1 Design System Agent project. "
-                f"The active design system library is: {lib_label}. "
-                f"Answer questions about the component library, design tokens, "
-                f"and the multi-agent architecture. Be concise and helpful."
-            )),
-        ]
+        system = (
+            f"You are a helpful assistant for the Milestone 1 Design System Agent project. "
+            f"The active design system library is: {lib_label}. "
+            f"Answer questions about the component library, design tokens, "
+            f"and the multi-agent architecture. Be concise and helpful."
+        )
 
-        # RAG: inject relevant design system context
+        # RAG: inject relevant design system context (retrieved for the draft already, if prefetched)
+        rag_context = ""
+        pre = state.get("prefetched") or {}
         try:
-            from agent.rag import query as rag_query
-            rag_context = rag_query(user_msg, k=3, library=library)
-            if rag_context:
-                llm_messages.append(
-                    SystemMessage(content=f"## Relevant Design System Context\n{rag_context}")
-                )
+            if "rag" in pre:
+                rag_context = pre["rag"]
+                prefetch.used("rag", pre["seconds"]["rag"])
+            else:
+                from agent.rag import query as rag_query
+                rag_context = rag_query(user_msg, k=3, library=library)
         except Exception as rag_err:
             logger.warning("[orchestrator] RAG inject skipped: %s", rag_err)
 
-        # Include conversation history for context
-        for msg in history_msgs:
-            llm_messages.append(msg)
+        # Fit to the model's budget: the lowest-ranked RAG hits go first, then the oldest turns
+        packed = budget.pack([
+            budget.Section("user", [user_msg], required=True),
+            budget.Section("history", [str(m.content) for m in history_msgs], priority=1, keep="tail"),
+            budget.Section("rag", [p for p in re.split(r"\n\n(?=--- Context \d+ ---)", rag_context) if p.strip()],
+                           priority=2, sep="\n\n", wrap=("## Relevant Design System Context\n", "")),
+        ], budget.budget_for(getattr(model, "model", None) or getattr(model, "model_name", "")),
+            site="chat", base=system)
+
+        llm_messages = [SystemMessage(content=system)]
+        if packed["rag"]:
+            llm_messages.append(SystemMessage(content=packed["rag"]))
+        llm_messages.extend(history_msgs[i] for i in packed.kept("history"))
         llm_messages.append(HumanMessage(content=user_msg))
 
-        result = await model.ainvoke(llm_messages)
+        try:
+            result = await _within_budget(
+                scheduler.call(provider, model.ainvoke(prompt_cache.prepare(llm_messages, provider)),
+                               scheduler.INTERACTIVE, model, messages=llm_messages, output_tokens=500),
+                state, reserve=0)
+            prompt_cache.record(result.usage_metadata, provider, "chat")
+        except asyncio.TimeoutError:
+            _timed_out("respond")
+            return {"messages": [AIMessage(content="Sorry — that took too long to answer. Please try again.")]}
         return {"messages": [AIMessage(content=result.content)]}
 
 
 # ────────────── Routing Functions ──────────────
 
 def route_after_classify(state: OrchestratorState) -> str:
+    if state.get("cache_hit"):
+        return "respond"
     workflow = state.get("workflow", "chat")
     if workflow in ("generate", "discover"):
         return "discovery"
@@ -349,8 +820,26 @@ def route_after_classify(state: OrchestratorState) -> str:
     return "respond"
 
 
-def route_after_discovery(state: OrchestratorState) -> str:
+def route_after_discovery(state: OrchestratorState) -> str | list[Send]:
     if state.get("workflow") == "generate":
+        user_msg = state.get("user_request") or _get_last_user_message(state)
+        if _is_variant_request(user_msg):
+            # Fan out: one independent generation per variant, run concurrently
+            previous_code = state.get("previous_code", "")
+            return [
+                Send("variant_generation", {
+                    "index": i,
+                    "style": style,
+                    "user_request": user_msg,
+                    "discovery_output": state.get("discovery_output", ""),
+                    "previous_code": previous_code,
+                    "library": state.get("library", "untitledui"),
+                    "deadline": state.get("deadline", 0),
+                })
+                for i, style in enumerate(plan_variants(user_msg))
+            ]
+        if state.get("race", 0) > 1:
+            return "race_generation"
         return "generation"
     return "respond"
 
@@ -358,20 +847,37 @@ def route_after_discovery(state: OrchestratorState) -> str:
 def route_after_qa(state: OrchestratorState) -> str:
     qa = state.get("qa_result", "")
     retry = state.get("retry_count", 0)
-    if "FAIL" in qa.upper() and retry < MAX_QA_RETRIES:
-        return "retry_generation"
+    if "FAIL" in qa.upper():
+        # Deterministic fixes first (generated code only) — an LLM retry costs ~10-15s
+        if state.get("workflow") == "generate" and not state.get("autofix_done") and state.get("generated_code"):
+            return "autofix"
+        if retry < MAX_QA_RETRIES and not state.get("timed_out"):
+            remaining = _remaining(state)
+            if remaining is None or remaining >= MIN_RETRY_S:
+                return "retry_generation"
+            metrics.incr("deadline.retries_skipped")
+            logger.info("[deadline] %.1fs left — skipping QA retry, responding with best so far", remaining)
     return "respond"
 
 
+def route_after_generation(state: OrchestratorState) -> str:
+    # A stream aborted by StreamingQA already carries its FAIL report
+    return route_after_qa(state) if state.get("aborted") else "qa"
+
+
 async def bump_retry(state: OrchestratorState) -> dict:
     """Increment retry count before re-running generation."""
-    return {"retry_count": state.get("retry_count", 0) + 1}
+    return {"retry_count": state.get("retry_count", 0) + 1, "aborted": False}
 
 
 # ────────────── Build Graph ──────────────
 
-def create_orchestrator():
-    """Create the multi-agent orchestrator graph."""
+def create_orchestrator(checkpointer=None):
+    """Create the multi-agent orchestrator graph.
+
+    Pass a LangGraph checkpointer (see agent.sessions) to persist state per
+    thread_id, so a conversation can be continued from its session_id alone.
+    """
 
     builder = StateGraph(OrchestratorState)
 
@@ -379,6 +885,10 @@ def create_orchestrator():
     builder.add_node("discovery", discovery_node)
     builder.add_node("generation", generation_node)
     builder.add_node("qa", qa_node)
+    builder.add_node("autofix", autofix_node)
+    builder.add_node("variant_generation", variant_generation_node)
+    builder.add_node("variant_merge", variant_merge_node)
+    builder.add_node("race_generation", race_generation_node)
     builder.add_node("retry_generation", bump_retry)
     builder.add_node("respond", respond_node)
 
@@ -392,12 +902,29 @@ def create_orchestrator():
 
     builder.add_conditional_edges("discovery", route_after_discovery, {
         "generation": "generation",
+        "variant_generation": "variant_generation",
+        "race_generation": "race_generation",
         "respond": "respond",
     })
 
-    builder.add_edge("generation", "qa")
+    builder.add_edge("race_generation", "respond")
+
+    builder.add_edge("variant_generation", "variant_merge")
+    builder.add_edge("variant_merge", "respond")
+
+    builder.add_conditional_edges("generation", route_after_generation, {
+        "qa": "qa",
+        "retry_generation": "retry_generation",
+        "respond": "respond",
+    })
 
     builder.add_conditional_edges("qa", route_after_qa, {
+        "autofix": "autofix",
+        "retry_generation": "retry_generation",
+        "respond": "respond",
+    })
+
+    builder.add_conditional_edges("autofix", route_after_qa, {
         "retry_generation": "retry_generation",
         "respond": "respond",
     })
@@ -405,4 +932,4 @@ def create_orchestrator():
     builder.add_edge("retry_generation", "generation")
     builder.add_edge("respond", END)
 
-    return builder.compile()
+    return builder.compile(checkpointer=checkpointer)
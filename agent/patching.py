@@ -0,0 +1,140 @@
+"""
+Line-anchored patches for QA retries.
+
+Instead of asking the generator to rewrite a whole component for a
+two-line fix, the retry prompt shows the current code with line numbers
+and asks for compact hunks:
+
+    @@ replace 12-14 :: <exact text of line 12>
+    <new lines>
+    @@ insert 20 :: <exact text of line 20>
+    <lines inserted after line 20>
+    @@ delete 30-31 :: <exact text of line 30>
+    @@ end
+
+The `:: text` anchor is checked against the original line so a miscounted
+patch is rejected (PatchError) and the caller falls back to full
+regeneration.
+"""
+
+import re
+from dataclasses import dataclass, field
+
+_RE_HUNK_HEADER = re.compile(
+    r"^@@\s*(replace|insert|delete)\s+(\d+)(?:\s*-\s*(\d+))?\s*(?:::\s?(.*))?$", re.IGNORECASE
+)
+_RE_FENCE = re.compile(r"^```\w*\s*$")
+_RE_NUMBERED = re.compile(r"^\s*\d+\| ?")
+
+PATCH_INSTRUCTIONS = """Return ONLY a patch in this exact format (no code fences, no explanations):
+
+@@ replace START-END :: <exact text of line START>
+<replacement lines>
+@@ insert AFTER_LINE :: <exact text of line AFTER_LINE>
+<new lines to insert after that line>
+@@ delete START-END :: <exact text of line START>
+@@ end
+
+Rules:
+- Line numbers refer to the numbered code above (use "insert 0 ::" to insert at the top)
+- Copy the anchor text after "::" exactly from that line (without the line number)
+- Hunks must not overlap; change only the lines needed to fix the issues
+- Replacement lines are plain code without line numbers"""
+
+
+class PatchError(ValueError):
+    """Raised when a patch can't be parsed or doesn't apply cleanly."""
+
+
+@dataclass
+class Hunk:
+    op: str
+    start: int
+    end: int
+    anchor: str | None = None
+    lines: list[str] = field(default_factory=list)
+
+
+def number_lines(code: str, start: int = 1, end: int | None = None) -> str:
+    """Render code (or the inclusive line range start..end) with right-aligned line numbers."""
+    lines = code.split("\n")
+    end = len(lines) if end is None else min(end, len(lines))
+    width = len(str(end))
+    return "\n".join(f"{n:>{width}}| {lines[n - 1]}" for n in range(start, end + 1))
+
+
+def parse_patch(text: str) -> list[Hunk]:
+    """Parse the hunk format described in PATCH_INSTRUCTIONS."""
+    hunks: list[Hunk] = []
+    current: Hunk | None = None
+    for raw in text.strip().split("\n"):
+        if _RE_FENCE.match(raw.strip()):
+            continue
+        header = _RE_HUNK_HEADER.match(raw.strip())
+        if header:
+            op, start, end, anchor = header.groups()
+            start = int(start)
+            current = Hunk(op=op.lower(), start=start, end=int(end) if end else start, anchor=anchor)
+            hunks.append(current)
+            continue
+        if raw.strip().lower() == "@@ end":
+            current = None
+            continue
+        if current is None:
+            if raw.strip():
+                raise PatchError(f"Unexpected text outside a hunk: {raw[:60]!r}")
+            continue
+        if current.op == "delete":
+            if raw.strip():
+                raise PatchError("delete hunks must not contain lines")
+            continue
+        current.lines.append(raw)
+
+    if not hunks:
+        raise PatchError("No hunks found")
+    for h in hunks:
+        # Tolerate models that echo the line-number gutter in replacement lines
+        if h.lines and all(_RE_NUMBERED.match(line) or not line.strip() for line in h.lines):
+            h.lines = [_RE_NUMBERED.sub("", line, count=1) for line in h.lines]
+    return hunks
+
+
+def _bracket_delta(code: str) -> tuple[int, int, int]:
+    return (code.count("{") - code.count("}"),
+            code.count("(") - code.count(")"),
+            code.count("[") - code.count("]"))
+
+
+def apply_patch(code: str, hunks: list[Hunk]) -> str:
+    """Apply hunks bottom-up and validate the result.
+
+    Raises PatchError on out-of-range/overlapping hunks, anchor mismatches,
+    or if the patch changes bracket balance.
+    """
+    lines = code.split("\n")
+    n = len(lines)
+
+    ordered = sorted(hunks, key=lambda h: (h.start, h.end))
+    prev_end = -1
+    for h in ordered:
+        lo = 0 if h.op == "insert" else 1
+        if h.start < lo or h.end < h.start or h.end > n:
+            raise PatchError(f"{h.op} {h.start}-{h.end} is out of range (1-{n})")
+        if h.start <= prev_end:
+            raise PatchError(f"Overlapping hunk at line {h.start}")
+        if h.anchor is not None and h.start >= 1 and h.anchor.strip() != lines[h.start - 1].strip():
+            raise PatchError(f"Anchor mismatch at line {h.start}")
+        prev_end = h.end
+
+    for h in reversed(ordered):
+        if h.op == "replace":
+            lines[h.start - 1:h.end] = h.lines
+        elif h.op == "delete":
+            del lines[h.start - 1:h.end]
+        else:
+            lines[h.start:h.start] = h.lines
+
+    patched = "\n".join(lines)
+    if _bracket_delta(patched) != _bracket_delta(code):
+        raise PatchError("Patch unbalances brackets")
+    return patched
@@ -0,0 +1,213 @@
+"""
+Speculative pipeline prefetch while the user is typing.
+
+Nothing used to start until the user pressed Enter. Then classification, RAG
+retrieval and discovery ran one after another before generation could begin.
+The chat UI now posts the debounced draft to /api/prefetch, which runs these
+stages on a background thread:
+
+  1. classification (the caller's classifier, e.g. the chatbot's _fast_classify)
+  2. RAG retrieval for the draft
+  3. discovery, only when the draft classifies as "generate"
+
+Results go into a short-lived slot per session (PREFETCH_TTL_S, default 30s).
+A newer draft replaces the slot, and a draft whose stages are still running
+stops after the current one. When the real request arrives, take() hands
+over the slot if the final text is close enough to the draft
+(PREFETCH_MIN_SIMILARITY, default 0.85, difflib ratio of the normalized
+texts). The pipeline then skips the stages it already has. A discovery still
+running is waited for up to PREFETCH_JOIN_S, since that is cheaper than
+starting it over. Slots are used at most once.
+
+LLM calls made by a prefetch run in the scheduler's background lane, so
+speculative work never delays real requests.
+
+Metrics:
+- prefetch.hit_rate (ratio of hits to lookups)
+- prefetch.started / stale / expired (counters)
+- prefetch.saved_s.<stage>, the stage time skipped by the real request
+
+Set PREFETCH=false to disable.
+
+Usage:
+    prefetch.start(session_key, draft, library, classify=_fast_classify)  # POST /api/prefetch
+    hit = prefetch.take(session_key, final_text, library)                 # the real request
+    workflow = hit.get("classify") if hit else None
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from difflib import SequenceMatcher
+
+from agent import archetypes, metrics, scheduler
+from agent.cache import normalize
+
+logger = logging.getLogger(__name__)
+
+TTL_S = float(os.environ.get("PREFETCH_TTL_S", "30"))
+MIN_SIMILARITY = float(os.environ.get("PREFETCH_MIN_SIMILARITY", "0.85"))
+JOIN_S = float(os.environ.get("PREFETCH_JOIN_S", "3"))
+MIN_CHARS = 8
+MAX_SLOTS = 256
+
+STAGES = ("classify", "rag", "discovery")
+
+_lock = threading.Lock()
+_slots: dict[str, "Prefetch"] = {}
+
+metrics.register_ratio("prefetch.hit_rate", "prefetch.hits", "prefetch.lookups")
+
+
+def enabled() -> bool:
+    return os.environ.get("PREFETCH", "true").lower() != "false"
+
+
+class Prefetch:
+    """One draft's speculative stage results. get() returns them as they complete."""
+
+    def __init__(self, text: str, library: str, has_previous_code: bool):
+        self.text = text
+        self.library = library
+        self.has_previous_code = has_previous_code
+        self.created = time.monotonic()
+        self.superseded = False
+        self.results: dict[str, object] = {}
+        self.seconds: dict[str, float] = {}
+        self._ready = {stage: threading.Event() for stage in STAGES}
+
+    def _set(self, stage: str, value, seconds: float = 0.0) -> None:
+        if value is not None:
+            self.results[stage] = value
+            self.seconds[stage] = seconds
+        self._ready[stage].set()
+
+    def _skip_rest(self) -> None:
+        for event in self._ready.values():
+            event.set()
+
+    def get(self, stage: str, timeout: float = 0.0):
+        """The stage's result, waiting up to `timeout` if it is still running; None if unavailable."""
+        if not self._ready[stage].wait(timeout):
+            return None
+        return self.results.get(stage)
+
+    def expired(self) -> bool:
+        return time.monotonic() - self.created > TTL_S
+
+
+def used(stage: str, seconds: float) -> None:
+    """Record that the real request skipped `stage` (`seconds` of prefetched work)."""
+    metrics.incr(f"prefetch.used.{stage}")
+    metrics.observe(f"prefetch.saved_s.{stage}", seconds)
+
+
+def similarity(a: str, b: str) -> float:
+    a, b = normalize(a), normalize(b)
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+# ────────────── Prefetch ──────────────
+
+def _run(slot: Prefetch, classify) -> None:
+    """Thread target: the speculative stages, in the background scheduler lane."""
+    with scheduler.background():
+        try:
+            t0 = time.perf_counter()
+            workflow = classify(slot.text)
+            slot._set("classify", workflow, time.perf_counter() - t0)
+            if slot.superseded:
+                return
+
+            t0 = time.perf_counter()
+            from agent.rag import query as rag_query
+            slot._set("rag", rag_query(slot.text, k=3, library=slot.library), time.perf_counter() - t0)
+            if slot.superseded or workflow != "generate":
+                return
+
+            from agent.discovery import run_discovery
+            t0 = time.perf_counter()
+            plan = archetypes.plan_for(slot.text, slot.library, slot.has_previous_code) or asyncio.run(
+                run_discovery(slot.text, has_previous_code=slot.has_previous_code, library=slot.library))
+            ok = plan and not plan.startswith("Discovery failed")
+            slot._set("discovery", plan if ok else None, time.perf_counter() - t0)
+        except Exception as e:
+            logger.warning("[prefetch] draft %r failed: %s", slot.text[:60], e)
+        finally:
+            slot._skip_rest()
+
+
+def start(key: str, text: str, library: str = "untitledui", classify=None,
+          has_previous_code: bool = False) -> str:
+    """Prefetch `text` into the slot for `key`. `classify(text)` returns the workflow.
+    Returns "started", "running" (same draft already prefetched) or "skipped"."""
+    text = (text or "").strip()
+    if not enabled() or classify is None or len(text) < MIN_CHARS:
+        return "skipped"
+    with _lock:
+        current = _slots.get(key)
+        if (current and not current.expired() and current.library == library
+                and current.has_previous_code == has_previous_code
+                and normalize(current.text) == normalize(text)):
+            return "running"
+        if current:
+            current.superseded = True
+        for stale_key in [k for k, s in _slots.items() if s.expired()]:
+            del _slots[stale_key]
+        while len(_slots) >= MAX_SLOTS:
+            del _slots[next(iter(_slots))]  # oldest first (insertion order)
+        slot = _slots[key] = Prefetch(text, library, has_previous_code)
+    metrics.incr("prefetch.started")
+    threading.Thread(target=_run, args=(slot, classify), name="prefetch", daemon=True).start()
+    return "started"
+
+
+def take(keys, text: str, library: str = "untitledui") -> Prefetch | None:
+    """Hand over the first slot found under `keys` (one key or several) if its draft is close
+    enough to `text`. The slot is removed either way."""
+    if not enabled():
+        return None
+    metrics.incr("prefetch.lookups")
+    with _lock:
+        slot = next((_slots.pop(k) for k in ([keys] if isinstance(keys, str) else keys) if k in _slots), None)
+    if slot is None:
+        return None
+    if slot.expired():
+        metrics.incr("prefetch.expired")
+        return None
+    score = similarity(slot.text, text)
+    if slot.library != library or score < MIN_SIMILARITY:
+        metrics.incr("prefetch.stale")
+        logger.info("[prefetch] draft too different from the request (similarity %.2f)", score)
+        return None
+    metrics.incr("prefetch.hits")
+    logger.info("[prefetch] hit (similarity %.2f, ready: %s)", score, ", ".join(slot.results) or "nothing yet")
+    return slot
+
+
+def handoff(hit: Prefetch | None, workflow: str) -> dict:
+    """The results the pipeline can use, as plain values for its state: "rag", and for a
+    generate request "discovery" (waited for up to JOIN_S) with the "modify" flag it was
+    planned for. "seconds" holds the time each one took."""
+    if hit is None:
+        return {}
+    out = {}
+    if workflow == "generate":
+        plan = hit.get("discovery", JOIN_S)
+        if plan:
+            out["discovery"], out["modify"] = plan, hit.has_previous_code
+    rag = hit.get("rag")  # runs before discovery, so after the wait above it is usually ready
+    if rag is not None:
+        out["rag"] = rag
+    if out:
+        out["seconds"] = {stage: hit.seconds[stage] for stage in ("rag", "discovery") if stage in out}
+    return out
+
+
+def status() -> dict:
+    with _lock:
+        return {"slots": len(_slots), "ttl_s": TTL_S, "min_similarity": MIN_SIMILARITY}
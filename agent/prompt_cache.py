@@ -0,0 +1,117 @@
+"""
+Provider-side prompt caching for the large static prompt prefixes.
+
+The generation prompt (tokens, patterns and all of coding_guidelines.md),
+the chatbot's SYSTEM_PROMPT (PROJECT_CONTEXT.md plus the catalog) and the
+dashboard prompts are identical from one call to the next, but Claude
+re-processed them on every request. Claude call sites now mark two cache
+breakpoints (Anthropic allows four):
+
+  1. the end of the system prompt, the static prefix
+  2. the end of the conversation history, i.e. the turn before the newest
+     message, so a multi-turn session only pays for the new turn
+
+Prefixes shorter than Anthropic's minimum (1024 tokens on Sonnet) are simply
+not cached. OpenAI caches long prefixes automatically, so its messages are
+left as they are.
+
+Cache reads/writes from every response are logged and counted per provider:
+prompt_cache.<provider>.read_tokens / write_tokens / input_tokens, with
+prompt_cache.<provider>.read_rate, the share of input tokens served from cache.
+Set PROMPT_CACHE=false to send unmarked prompts.
+"""
+
+import logging
+import os
+
+from agent import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+for _provider in ("anthropic", "openai"):
+    metrics.register_ratio(f"prompt_cache.{_provider}.read_rate",
+                           f"prompt_cache.{_provider}.read_tokens", f"prompt_cache.{_provider}.input_tokens")
+
+
+def enabled() -> bool:
+    return os.environ.get("PROMPT_CACHE", "true").lower() != "false"
+
+
+def _cacheable_blocks(content) -> list | None:
+    """Content as text blocks with a breakpoint on the last one (None if it can't carry one)."""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content, "cache_control": CACHE_CONTROL}] if content else None
+    if isinstance(content, list) and content and isinstance(content[-1], dict):
+        return content[:-1] + [{**content[-1], "cache_control": CACHE_CONTROL}]
+    return None
+
+
+def _breakpoints(count: int, first_is_system: bool) -> list[int]:
+    """Indexes to mark: the system prompt and the message before the newest one."""
+    marks = [0] if first_is_system else []
+    if count >= 2 and count - 2 not in marks:
+        marks.append(count - 2)
+    return marks
+
+
+# ────────────── Request shaping ──────────────
+
+def prepare(messages: list, provider: str) -> list:
+    """LangChain messages for `provider`, with cache breakpoints when it is Anthropic."""
+    if provider != "anthropic" or not enabled():
+        return messages
+    from langchain_core.messages import SystemMessage
+
+    marked = list(messages)
+    for i in _breakpoints(len(marked), bool(marked) and isinstance(marked[0], SystemMessage)):
+        blocks = _cacheable_blocks(marked[i].content)
+        if blocks:
+            marked[i] = type(marked[i])(content=blocks)
+    return marked
+
+
+def anthropic_request(system: str, turns: list[dict]) -> dict:
+    """Anthropic SDK kwargs (system + messages) with the same breakpoints as prepare()."""
+    if not enabled():
+        return {"messages": turns, **({"system": system} if system else {})}
+    turns = list(turns)
+    history_end = len(turns) - 2
+    if history_end >= 0:
+        blocks = _cacheable_blocks(turns[history_end]["content"])
+        if blocks:
+            turns[history_end] = {**turns[history_end], "content": blocks}
+    kwargs = {"messages": turns}
+    if system:
+        kwargs["system"] = _cacheable_blocks(system)
+    return kwargs
+
+
+# ────────────── Usage ──────────────
+
+def record(usage, provider: str, site: str) -> None:
+    """Log and count cache reads/writes for one response.
+
+    `usage` is a LangChain usage_metadata dict (input_tokens includes cached
+    tokens) or an Anthropic SDK usage object (input_tokens excludes them).
+    Streaming chunks without input tokens are ignored.
+    """
+    if not usage:
+        return
+    if isinstance(usage, dict):
+        details = usage.get("input_token_details") or {}
+        read = details.get("cache_read") or 0
+        write = details.get("cache_creation") or 0
+        total = usage.get("input_tokens") or 0
+    else:
+        read = getattr(usage, "cache_read_input_tokens", 0) or 0
+        write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        total = (getattr(usage, "input_tokens", 0) or 0) + read + write
+    if not total:
+        return
+    metrics.incr(f"prompt_cache.{provider}.input_tokens", total)
+    metrics.incr(f"prompt_cache.{provider}.read_tokens", read)
+    metrics.incr(f"prompt_cache.{provider}.write_tokens", write)
+    logger.info("[prompt_cache] %s (%s): %d input tokens, %d cache read, %d cache write",
+                site, provider, total, read, write)
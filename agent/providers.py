@@ -0,0 +1,215 @@
+"""
+Provider health: circuit breakers for Anthropic and OpenAI.
+
+During an incident every request used to try the failing provider first and
+wait for its error or timeout before falling back. Each provider now has a
+breaker fed by every LLM call (providers.track). The breaker keeps rolling
+error/latency windows and moves between three states:
+
+  closed     normal; opens after BREAKER_FAILURES consecutive failures, or an
+             error rate >= BREAKER_ERROR_RATE over at least 5 calls in the
+             last 60s (calls slower than BREAKER_SLOW_CALL_S count as failures)
+  open       calls are skipped; pick() returns the fallback provider straight
+             away. After BREAKER_COOLDOWN_S it becomes half-open
+  half-open  one real request goes through as a probe; success closes the
+             breaker, failure re-opens it. The probe is reserved by track()
+             when the call starts, so pick() and available() are read-only
+
+Usage:
+    provider = providers.pick("anthropic", "openai")
+    with providers.track(provider):
+        ...call the provider...
+
+State per provider is included in GET /api/metrics ("providers").
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from agent import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+WINDOW_S = 60.0
+MIN_CALLS = 5
+ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", "0.5"))
+CONSECUTIVE_FAILURES = int(os.environ.get("BREAKER_FAILURES", "3"))
+COOLDOWN_S = float(os.environ.get("BREAKER_COOLDOWN_S", "30"))
+SLOW_CALL_S = float(os.environ.get("BREAKER_SLOW_CALL_S", "60"))
+# A probe that never reports back (a call that hangs) is released after this
+_PROBE_TIMEOUT_S = 120.0
+
+_API_KEYS = {"anthropic": "ANTHROPIC_API_KEY", "openai": "OPENAI_API_KEY"}
+
+# Stand-in for GPT-4o-mini (discovery, classify, chat) while OpenAI's circuit is open
+ANTHROPIC_FAST_MODEL = os.environ.get("ANTHROPIC_FAST_MODEL", "claude-3-5-haiku-20241022")
+_fast_fallback = None
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a rolling window of call outcomes."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self._calls: deque[tuple[float, bool, float]] = deque()  # (timestamp, ok, seconds)
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if a call may go out now: closed, or past the cooldown with the probe free. Read-only."""
+        with self._lock:
+            return self._allow(time.time())
+
+    def begin(self) -> bool:
+        """A call is starting. Past the cooldown it becomes the half-open probe;
+        returns True if it holds the probe (see release())."""
+        with self._lock:
+            now = time.time()
+            if self.state == CLOSED or not self._allow(now):
+                return False
+            if self.state == OPEN:
+                self.state = HALF_OPEN
+                logger.info("[providers] %s half-open — probing", self.name)
+            self._probe_started = now
+            return True
+
+    def record(self, ok: bool, seconds: float) -> None:
+        """Report a finished call."""
+        ok = ok and seconds <= SLOW_CALL_S
+        with self._lock:
+            now = time.time()
+            self._calls.append((now, ok, seconds))
+            self._prune(now)
+            self._consecutive = 0 if ok else self._consecutive + 1
+            if self.state == HALF_OPEN:
+                self._probe_started = 0.0
+                if ok:
+                    self._close()
+                else:
+                    self._open(now)
+            elif self.state == CLOSED and not ok:
+                total = len(self._calls)
+                errors = sum(1 for _, good, _ in self._calls if not good)
+                if self._consecutive >= CONSECUTIVE_FAILURES or (total >= MIN_CALLS and errors / total >= ERROR_RATE):
+                    self._open(now)
+        metrics.incr(f"providers.{self.name}.{'ok' if ok else 'errors'}")
+        metrics.observe(f"providers.{self.name}.seconds", seconds)
+
+    def release(self, probe: bool) -> None:
+        """A call ended without an outcome (cancelled) — free the probe slot if it held it."""
+        with self._lock:
+            if probe and self.state == HALF_OPEN:
+                self._probe_started = 0.0
+
+    def status(self) -> dict:
+        with self._lock:
+            self._prune(time.time())
+            calls = list(self._calls)
+            state = self.state
+        latencies = sorted(s for _, _, s in calls)
+        return {
+            "state": state,
+            "calls": len(calls),
+            "error_rate": round(sum(1 for _, ok, _ in calls if not ok) / len(calls), 3) if calls else None,
+            "p50_s": round(latencies[len(latencies) // 2], 2) if latencies else None,
+            "p90_s": round(latencies[int(0.9 * (len(latencies) - 1))], 2) if latencies else None,
+        }
+
+    def _allow(self, now: float) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self._opened_at < COOLDOWN_S:
+            return False
+        return not (self._probe_started and now - self._probe_started < _PROBE_TIMEOUT_S)
+
+    def _prune(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > WINDOW_S:
+            self._calls.popleft()
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        metrics.incr(f"providers.{self.name}.opened")
+        logger.warning("[providers] %s circuit OPEN for %.0fs", self.name, COOLDOWN_S)
+
+    def _close(self) -> None:
+        self.state = CLOSED
+        self._calls.clear()
+        logger.info("[providers] %s circuit closed", self.name)
+
+
+_breakers = {name: CircuitBreaker(name) for name in _API_KEYS}
+
+
+# ────────────── Public API ──────────────
+
+def configured(name: str) -> bool:
+    """True if the provider has an API key."""
+    return bool(os.environ.get(_API_KEYS[name], "").strip())
+
+
+def available(name: str) -> bool:
+    """True if the provider is configured and its breaker lets a call through."""
+    return configured(name) and _breakers[name].allow()
+
+
+def healthy(name: str) -> bool:
+    """True if the provider is configured and its circuit is closed (no probe reserved)."""
+    return configured(name) and _breakers[name].state == CLOSED
+
+
+def pick(primary: str, fallback: str | None = None) -> str:
+    """Provider to call: the primary unless its circuit is open and the fallback is usable.
+    With both open, the primary is tried anyway."""
+    if available(primary):
+        return primary
+    if fallback and available(fallback):
+        metrics.incr(f"providers.{primary}.skipped")
+        logger.info("[providers] %s unavailable — using %s", primary, fallback)
+        return fallback
+    return primary
+
+
+@contextmanager
+def track(name: str, neutral: tuple = ()):
+    """Record the outcome and latency of the call made inside the block.
+    Exceptions in `neutral` (e.g. a QA early abort) and cancellations are not failures."""
+    probe = _breakers[name].begin()
+    t0 = time.perf_counter()
+    try:
+        yield
+    except neutral:
+        _breakers[name].release(probe)
+        raise
+    except Exception:
+        _breakers[name].record(False, time.perf_counter() - t0)
+        raise
+    except BaseException:
+        _breakers[name].release(probe)
+        raise
+    else:
+        _breakers[name].record(True, time.perf_counter() - t0)
+
+
+def fast_fallback_model():
+    """Claude Haiku via LangChain (cached singleton)."""
+    global _fast_fallback
+    if _fast_fallback is None:
+        from langchain_anthropic import ChatAnthropic
+        _fast_fallback = ChatAnthropic(model=ANTHROPIC_FAST_MODEL, temperature=0, max_tokens=4096,
+                                       anthropic_api_key=os.environ.get("ANTHROPIC_API_KEY", "").strip())
+    return _fast_fallback
+
+
+def status() -> dict:
+    """Breaker state and rolling error/latency stats per provider."""
+    return {name: breaker.status() for name, breaker in _breakers.items()}
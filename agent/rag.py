@@ -19,6 +19,8 @@ from pathlib import Path
 
 import numpy as np
 
+from agent import providers
+
 logger = logging.getLogger(__name__)
 
 ROOT = Path(__file__).resolve().parent.parent
@@ -205,12 +207,15 @@ def _get_openai_client():
 
 
 def _get_embeddings(texts: list[str]) -> np.ndarray:
-    """Get OpenAI embeddings for a list of texts."""
+    """Get OpenAI embeddings for a list of texts (fails fast while OpenAI's circuit is open)."""
+    if not providers.available("openai"):
+        raise RuntimeError("OpenAI unavailable (circuit open) — embeddings skipped")
     client = _get_openai_client()
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=texts,
-    )
+    with providers.track("openai"):
+        response = client.embeddings.create(
+            model="text-embedding-3-small",
+            input=texts,
+        )
     return np.array([item.embedding for item in response.data], dtype=np.float32)
 
 
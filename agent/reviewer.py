@@ -4,14 +4,19 @@ Agent 4: Quality Assurance
 Reviews generated code against team coding guidelines and accessibility
 standards. Returns PASS/FAIL verdict with specific issues.
 
-NOTE: QA is now fully rule-based (no LLM). The actual QA logic runs inline
-in orchestrator.py's qa_node() using verify_quality and check_accessibility
-tools from agent/tools.py. This file retains the QA_PROMPT for reference.
+NOTE: QA is now fully rule-based (no LLM). evaluate() runs verify_quality and
+check_accessibility from agent/tools.py and merges them into one verdict; it is
+shared by orchestrator.py's qa_node() and the auto-fixer. This file also
+retains the QA_PROMPT for reference.
 
 Tools: verify_quality, check_accessibility
 M2 mapping: Ctrlagent Maker agent with policies/guardrails
 """
 
+import json
+
+from agent.tools import check_accessibility, verify_quality
+
 QA_PROMPT = """You are a senior front-end code reviewer for the Untitled UI design system.
 
 Your job: Review generated React/JSX code against team standards, accessibility rules,
@@ -51,3 +56,44 @@ Issues to fix:
 2. [rule] specific issue description
 
 Be concise and actionable. The code will be sent back for fixes if FAIL."""
+
+
+
+def format_report(verdict: str, score: int, issues: list[dict]) -> str:
+    """Render a QA verdict in the markdown format the generator and respond node expect."""
+    parts = [f"**Verdict: {verdict}** (score: {score}/100)"]
+    for i, issue in enumerate(issues[:6], 1):
+        parts.append(f"{i}. [{issue.get('rule', '?')}] {issue.get('message', '')}")
+    return "\n".join(parts)
+
+
+def evaluate(code: str) -> dict:
+    """Run both QA tools on a single component and combine the results.
+
+    Returns {"verdict": "PASS"|"FAIL", "score": int, "issues": [...], "report": str}.
+    """
+    if not code.strip():
+        return {
+            "verdict": "FAIL",
+            "score": 0,
+            "issues": [],
+            "report": "**Verdict: FAIL** (score: 0/100)\nNo code was generated.",
+        }
+
+    quality_raw = verify_quality.invoke({"code": code})
+    access_raw = check_accessibility.invoke({"code": code})
+
+    quality = json.loads(quality_raw) if isinstance(quality_raw, str) else quality_raw
+    access = json.loads(access_raw) if isinstance(access_raw, str) else access_raw
+
+    score = min(quality.get("score", 0), access.get("score", 0))
+    issues = quality.get("issues", []) + access.get("issues", [])
+    has_errors = any(i.get("severity") == "error" for i in issues)
+    verdict = "FAIL" if has_errors or score < 70 else "PASS"
+
+    return {
+        "verdict": verdict,
+        "score": score,
+        "issues": issues,
+        "report": format_report(verdict, score, issues),
+    }
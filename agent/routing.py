@@ -0,0 +1,205 @@
+"""
+Complexity-based model routing.
+
+Every generation used to go to Claude Sonnet with max_tokens=8192, and every
+chat in direct mode to GPT-4o, even for "a single primary button" or a
+greeting. route() scores a request before generation from:
+
+  - the catalog components its discovery plan names (1 point each); without
+    a plan, the components and page regions (sidebar, chart, ...) the request
+    text itself names
+  - the request's length (1 point per ROUTING_WORDS_PER_POINT words)
+  - the size of the code being modified (1 point per 40 lines)
+  - extra variants in the same call (3 points each)
+
+It then picks a tier:
+
+  fast      score <= ROUTING_FAST_MAX_SCORE (3)      Haiku / GPT-4o-mini, 2048 tokens
+  standard  score <= ROUTING_STANDARD_MAX_SCORE (8)  Sonnet / GPT-4o, 4096 tokens
+  complex   anything larger                          Sonnet / GPT-4o, 8192 tokens
+
+A request scored without a plan is never put below the standard tier: the
+text alone says too little to trust a small model with it. max_tokens grows
+with the code being modified (it has to be written out again), up to the
+complex tier's limit. A QA retry moves one tier up per attempt, so a
+fast-tier miss is retried on a stronger model. route_chat() sends greetings
+and short questions to the fast tier, with the same output cap as any chat.
+
+Callers report each QA verdict with record_qa(). That gives a pass rate per
+tier (routing.<tier>.qa_pass_rate) next to routing.<tier>.requests, which is
+what the thresholds are tuned against. Set ROUTING=false to send everything
+to the complex tier (the previous behaviour).
+
+Usage:
+    route = routing.route(user_request, plan, previous_code, library=library)
+    code = await run_generation(..., route=route)
+    routing.record_qa(route.tier, verdict == "PASS")
+"""
+
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+
+from agent import budget, metrics, providers
+
+logger = logging.getLogger(__name__)
+
+TIERS = ("fast", "standard", "complex")
+_SONNET = "claude-sonnet-4-20250514"
+MODELS = {
+    "fast": {"anthropic": providers.ANTHROPIC_FAST_MODEL, "openai": "gpt-4o-mini"},
+    "standard": {"anthropic": _SONNET, "openai": "gpt-4o"},
+    "complex": {"anthropic": _SONNET, "openai": "gpt-4o"},
+}
+MAX_TOKENS = {
+    "fast": int(os.environ.get("ROUTING_FAST_MAX_TOKENS", "2048")),
+    "standard": int(os.environ.get("ROUTING_STANDARD_MAX_TOKENS", "4096")),
+    "complex": 8192,
+}
+# Chat replies keep the direct-chat output cap whatever the tier
+CHAT_MAX_TOKENS = 1500
+
+FAST_MAX_SCORE = float(os.environ.get("ROUTING_FAST_MAX_SCORE", "3"))
+STANDARD_MAX_SCORE = float(os.environ.get("ROUTING_STANDARD_MAX_SCORE", "8"))
+WORDS_PER_POINT = int(os.environ.get("ROUTING_WORDS_PER_POINT", "20"))
+_LINES_PER_POINT = 40
+_VARIANT_POINTS = 3
+_CHAT_FAST_WORDS = 40
+# Rewritten code comes out a bit longer than it went in; plus room for the new parts
+_REWRITE_FACTOR = 1.3
+_REWRITE_HEADROOM = 512
+
+_RE_WORD = re.compile(r"\w+")
+_RE_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z])(?=[A-Z])")
+# Page regions a request names that the catalog has no component for; each is its own chunk of JSX
+_PAGE_PARTS = ("sidebar", "navbar", "nav", "header", "footer", "hero", "chart", "graph", "form",
+               "list", "grid", "feed", "timeline", "calendar", "filter", "toolbar", "menu", "section")
+
+for _tier in TIERS:
+    metrics.register_ratio(f"routing.{_tier}.qa_pass_rate", f"routing.{_tier}.qa_passes", f"routing.{_tier}.qa_runs")
+
+
+def enabled() -> bool:
+    return os.environ.get("ROUTING", "true").lower() != "false"
+
+
+@dataclass(frozen=True)
+class Route:
+    """The tier a request runs on and its output cap."""
+
+    tier: str
+    max_tokens: int
+    score: float = 0.0
+    components: list[str] = field(default_factory=list)
+
+    def model(self, provider: str) -> str:
+        """Model id for `provider` ("anthropic" / "openai") in this tier."""
+        return MODELS[self.tier][provider]
+
+
+def default() -> Route:
+    """Route for callers that don't score their request: the complex tier."""
+    return Route("complex", MAX_TOKENS["complex"])
+
+
+def mentioned_components(plan: str, library: str = "untitledui") -> list[str]:
+    """Catalog components named in a discovery plan, in catalog order."""
+    if not plan:
+        return []
+    from agent.discovery import component_names
+    return [name for name in component_names(library) if re.search(rf"\b{re.escape(name)}\b", plan)]
+
+
+def requested_components(request: str, library: str = "untitledui") -> list[str]:
+    """Catalog components and page regions a request names in plain words ("KPI cards",
+    "a stats card", "sidebar"), for requests routed without a discovery plan."""
+    if not request:
+        return []
+    from agent.discovery import component_names
+
+    def named(word: str) -> bool:
+        return re.search(rf"\b{word}s?\b", request, re.IGNORECASE) is not None
+
+    components = [name for name in component_names(library)
+                  if named(r"\s*".join(re.escape(w) for w in _RE_CAMEL_BOUNDARY.split(name)))]
+    return components + [part for part in _PAGE_PARTS if named(part)]
+
+
+def complexity(request: str, plan: str = "", previous_code: str = "", variants: int = 1,
+               library: str = "untitledui") -> tuple[float, list[str]]:
+    """(score, components named in the plan, or in the request without one); see the module docstring."""
+    components = mentioned_components(plan, library) if plan else requested_components(request, library)
+    score = (len(components)
+             + len(_RE_WORD.findall(request or "")) / WORDS_PER_POINT
+             + (previous_code.count("\n") + 1 if previous_code else 0) / _LINES_PER_POINT
+             + _VARIANT_POINTS * (max(1, variants) - 1))
+    return round(score, 2), components
+
+
+def _tier_for(score: float) -> str:
+    if score <= FAST_MAX_SCORE:
+        return "fast"
+    return "standard" if score <= STANDARD_MAX_SCORE else "complex"
+
+
+def select(request: str, plan: str = "", previous_code: str = "", variants: int = 1,
+           library: str = "untitledui", attempt: int = 0) -> Route:
+    """route() without counting or logging it, for sub-requests whose QA verdict is recorded
+    against the request they are part of (e.g. the sections of one page)."""
+    if not enabled():
+        return default()
+    score, components = complexity(request, plan, previous_code, variants, library)
+    base = _tier_for(score) if plan else max(_tier_for(score), "standard", key=TIERS.index)
+    tier = TIERS[min(len(TIERS) - 1, TIERS.index(base) + attempt)]
+    max_tokens = MAX_TOKENS[tier]
+    if previous_code:
+        rewrite = int(budget.estimate(previous_code) * _REWRITE_FACTOR * max(1, variants)) + _REWRITE_HEADROOM
+        max_tokens = min(MAX_TOKENS["complex"], max(max_tokens, rewrite))
+    return Route(tier, max_tokens, score, components)
+
+
+def route(request: str, plan: str = "", previous_code: str = "", variants: int = 1,
+          library: str = "untitledui", attempt: int = 0) -> Route:
+    """Tier and max_tokens for a generation. `attempt` (QA retries so far) moves the tier up."""
+    selected = select(request, plan, previous_code, variants, library, attempt)
+    if not enabled():
+        return selected
+    metrics.incr(f"routing.{selected.tier}.requests")
+    metrics.observe("routing.score", selected.score)
+    logger.info("[routing] %s tier (score %s, %d components, max_tokens %d)%s", selected.tier, selected.score,
+                len(selected.components), selected.max_tokens, f", attempt {attempt + 1}" if attempt else "")
+    return selected
+
+
+def route_chat(message: str, previous_code: str = "") -> Route:
+    """Route for a direct-chat turn: greetings and short questions go to the fast tier;
+    requests to build something are scored like generations."""
+    if not enabled():
+        return Route("standard", CHAT_MAX_TOKENS)
+    from agent import intent
+
+    label, _, _ = intent.classify(message)
+    if label == "generate":
+        return route(message, previous_code=previous_code)
+    tier = "fast" if len(_RE_WORD.findall(message or "")) <= _CHAT_FAST_WORDS else "standard"
+    metrics.incr(f"routing.{tier}.requests")
+    return Route(tier, CHAT_MAX_TOKENS)
+
+
+def record_qa(tier: str, passed: bool) -> None:
+    """Count one QA verdict on code generated in `tier`."""
+    if tier not in MODELS:
+        return
+    metrics.incr(f"routing.{tier}.qa_runs")
+    if passed:
+        metrics.incr(f"routing.{tier}.qa_passes")
+
+
+def status() -> dict:
+    return {
+        "enabled": enabled(),
+        "thresholds": {"fast": FAST_MAX_SCORE, "standard": STANDARD_MAX_SCORE},
+        "max_tokens": MAX_TOKENS,
+        "models": MODELS,
+    }
@@ -0,0 +1,337 @@
+"""
+Central scheduler for LLM calls.
+
+Every request thread used to call the providers directly, with no global
+limit. A burst of generate requests tripped the provider rate limits, and a
+cheap chat turn could queue behind several 15-second Claude generations.
+Every LLM call now takes a slot from this module first. Per provider it
+enforces:
+
+  - concurrency (SCHEDULER_<PROVIDER>_CONCURRENCY), plus optional per-model
+    caps (SCHEDULER_MODEL_CONCURRENCY="gpt-4o=8,claude-sonnet-4-20250514=4")
+  - requests and estimated tokens per rolling minute
+    (SCHEDULER_<PROVIDER>_RPM / SCHEDULER_<PROVIDER>_TPM, 0 = unlimited)
+
+Calls that have to wait are queued in three priority lanes:
+
+  interactive  chat answers, LLM intent classification
+  generation   discovery, code generation, patches, variants
+  background   semantic-cache refinement, history summaries
+
+A free slot goes to the highest lane first, and within a lane to the oldest
+call. The lower lanes are also capped at a share of every limit
+(SCHEDULER_GENERATION_SHARE, SCHEDULER_BACKGROUND_SHARE), so there is always
+room for interactive calls, even while generations are running.
+
+Usage:
+    async with scheduler.slot("anthropic", scheduler.GENERATION, model, messages=msgs, output_tokens=2000):
+        ...call the provider...
+    with scheduler.slot_sync("openai", scheduler.INTERACTIVE, "gpt-4o-mini", messages=msgs):
+        ...
+
+A slot also records the call with agent.providers.track (queue wait is not
+counted as provider latency). Queue wait per lane goes to agent.metrics as
+scheduler.wait.<lane>. GET /api/metrics shows the live queues under
+"scheduler". Embedding calls (RAG, semantic cache) are not scheduled: they
+have their own rate limits and finish in milliseconds.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from agent import metrics, providers
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, GENERATION, BACKGROUND = "interactive", "generation", "background"
+LANES = (INTERACTIVE, GENERATION, BACKGROUND)  # priority order
+
+WINDOW_S = 60.0
+
+LIMITS = {
+    provider: {
+        "concurrency": int(os.environ.get(f"SCHEDULER_{provider.upper()}_CONCURRENCY", concurrency)),
+        "rpm": int(os.environ.get(f"SCHEDULER_{provider.upper()}_RPM", rpm)),
+        "tpm": int(os.environ.get(f"SCHEDULER_{provider.upper()}_TPM", tpm)),
+    }
+    for provider, concurrency, rpm, tpm in (("anthropic", 8, 50, 80000), ("openai", 16, 500, 200000))
+}
+MODEL_CONCURRENCY = {
+    name.strip(): int(limit)
+    for name, _, limit in (item.partition("=") for item in os.environ.get("SCHEDULER_MODEL_CONCURRENCY", "").split(","))
+    if name.strip() and limit.strip()
+}
+SHARES = {
+    INTERACTIVE: 1.0,
+    GENERATION: float(os.environ.get("SCHEDULER_GENERATION_SHARE", "0.75")),
+    BACKGROUND: float(os.environ.get("SCHEDULER_BACKGROUND_SHARE", "0.25")),
+}
+_LOG_WAIT_S = 1.0
+
+
+class _Ticket:
+    """One queued or running call."""
+
+    __slots__ = ("provider", "model", "lane", "tokens", "enqueued", "granted", "wake")
+
+    def __init__(self, provider: str, model: str, lane: str, tokens: int, wake):
+        self.provider = provider
+        self.model = model
+        self.lane = lane
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.wake = wake
+
+    @property
+    def keys(self) -> tuple:
+        """Counters in _running this call occupies while it runs."""
+        return self.provider, ("model", self.provider, self.model), ("lane", self.provider, self.lane)
+
+
+_lock = threading.Lock()
+_queue: list[_Ticket] = []
+_running: Counter = Counter()
+_windows: dict[str, deque] = {p: deque() for p in LIMITS}  # (started_at, tokens, lane) per provider
+_retry_at: float | None = None  # earliest time a rate-limited call may fit again
+_lane_override: ContextVar[str | None] = ContextVar("scheduler_lane", default=None)
+
+
+# ────────────── Admission ──────────────
+
+def _capped(limit: int, share: float) -> int:
+    return max(1, math.floor(limit * share)) if limit else 0
+
+
+def _blocker(t: _Ticket, now: float) -> tuple[object, float | None]:
+    """Why `t` can't start now: (scope it is blocked on, time the rate window frees up),
+    or (None, None) if it can start."""
+    limits = LIMITS[t.provider]
+    if _running[t.provider] >= limits["concurrency"]:
+        return t.provider, None
+    model_cap = MODEL_CONCURRENCY.get(t.model)
+    if model_cap and _running[t.keys[1]] >= model_cap:
+        return t.keys[1], None
+    if _running[t.keys[2]] >= _capped(limits["concurrency"], SHARES[t.lane]):
+        return t.keys[2], None
+
+    window = _windows[t.provider]
+    for scope, share in ((t.provider, 1.0), (t.keys[2], SHARES[t.lane])):
+        calls = [c for c in window if scope == t.provider or c[2] == t.lane]
+        rpm, tpm = _capped(limits["rpm"], share), _capped(limits["tpm"], share)
+        # A call bigger than the whole token budget still runs once the window is empty
+        if (rpm and len(calls) >= rpm) or (tpm and calls and sum(c[1] for c in calls) + t.tokens > tpm):
+            return scope, calls[0][0] + WINDOW_S
+    return None, None
+
+
+def _dispatch() -> None:
+    """Start every queued call that fits, highest lane first. Caller holds _lock."""
+    global _retry_at
+    now = time.monotonic()
+    for window in _windows.values():
+        while window and now - window[0][0] > WINDOW_S:
+            window.popleft()
+
+    _retry_at = None
+    blocked = set()  # scopes where an earlier/higher call is waiting: later ones don't overtake it
+    for t in sorted(_queue, key=lambda t: LANES.index(t.lane)):  # stable sort: FIFO within a lane
+        if blocked.intersection(t.keys):
+            continue
+        scope, retry_at = _blocker(t, now)
+        if scope is not None:
+            blocked.add(scope)
+            if retry_at is not None:
+                _retry_at = retry_at if _retry_at is None else min(_retry_at, retry_at)
+            continue
+        _queue.remove(t)
+        t.granted = True
+        for key in t.keys:
+            _running[key] += 1
+        _windows[t.provider].append((now, t.tokens, t.lane))
+        waited = now - t.enqueued
+        metrics.observe(f"scheduler.wait.{t.lane}", waited)
+        metrics.incr(f"scheduler.calls.{t.lane}")
+        if waited >= _LOG_WAIT_S:
+            logger.info("[scheduler] %s call to %s waited %.1fs", t.lane, t.model or t.provider, waited)
+        try:
+            t.wake()
+        except RuntimeError:  # the waiter's event loop is already closed
+            _finish(t)
+
+
+def _finish(t: _Ticket) -> None:
+    """Free a running call's slot. Caller holds _lock."""
+    if t.granted:
+        t.granted = False
+        for key in t.keys:
+            _running[key] -= 1
+
+
+def _retry_in() -> float | None:
+    """Seconds until a rate-limited call should re-check, or None to wait for a release."""
+    with _lock:
+        if _retry_at is None:
+            return None
+        return max(0.05, _retry_at - time.monotonic())
+
+
+def _enqueue(provider: str, lane: str, model, tokens: int, wake) -> _Ticket:
+    lane = _lane_override.get() or lane
+    t = _Ticket(provider, _model_id(model), lane, tokens, wake)
+    with _lock:
+        _queue.append(t)
+        _dispatch()
+    return t
+
+
+def _abandon(t: _Ticket) -> None:
+    """The caller stopped waiting (cancelled / timed out): drop or free its ticket."""
+    with _lock:
+        if t in _queue:
+            _queue.remove(t)
+        _finish(t)
+        _dispatch()
+
+
+def _model_id(model) -> str:
+    """Model name from a string or a LangChain chat model (also through .bind())."""
+    if model is None or isinstance(model, str):
+        return model or ""
+    model = getattr(model, "bound", model)
+    return getattr(model, "model", None) or getattr(model, "model_name", None) or ""
+
+
+# ────────────── Public API ──────────────
+
+def estimate(messages=(), output_tokens: int = 0) -> int:
+    """Rough token count of a prompt (~4 chars per token) plus its expected output."""
+    chars = 0
+    for m in messages:
+        content = m.get("content", "") if isinstance(m, dict) else getattr(m, "content", "")
+        chars += len(content if isinstance(content, str) else str(content))
+    return chars // 4 + output_tokens
+
+
+async def acquire(provider: str, lane: str = GENERATION, model=None, tokens: int = 0) -> _Ticket:
+    """Wait for a slot. Pair with release(); prefer slot() / call()."""
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+
+    def wake():
+        loop.call_soon_threadsafe(lambda: ready.done() or ready.set_result(None))
+
+    t = _enqueue(provider, lane, model, tokens, wake)
+    try:
+        while not t.granted:
+            try:
+                await asyncio.wait_for(asyncio.shield(ready), _retry_in())
+            except asyncio.TimeoutError:
+                with _lock:
+                    _dispatch()
+    except BaseException:
+        _abandon(t)
+        raise
+    return t
+
+
+def acquire_sync(provider: str, lane: str = GENERATION, model=None, tokens: int = 0) -> _Ticket:
+    """Blocking acquire() for the threaded HTTP handlers."""
+    ready = threading.Event()
+    t = _enqueue(provider, lane, model, tokens, ready.set)
+    try:
+        while not t.granted:
+            if not ready.wait(_retry_in()):
+                with _lock:
+                    _dispatch()
+    except BaseException:
+        _abandon(t)
+        raise
+    return t
+
+
+def release(t: _Ticket) -> None:
+    with _lock:
+        _finish(t)
+        _dispatch()
+
+
+@asynccontextmanager
+async def slot(provider: str, lane: str = GENERATION, model=None, messages=(), output_tokens: int = 0,
+               neutral: tuple = ()):
+    """Run the block in a scheduled slot, tracked by agent.providers (see providers.track for `neutral`)."""
+    t = await acquire(provider, lane, model, estimate(messages, output_tokens))
+    try:
+        with providers.track(provider, neutral):
+            yield
+    finally:
+        release(t)
+
+
+@contextmanager
+def slot_sync(provider: str, lane: str = GENERATION, model=None, messages=(), output_tokens: int = 0):
+    """Blocking slot() (also usable around a streaming generator's loop)."""
+    t = acquire_sync(provider, lane, model, estimate(messages, output_tokens))
+    try:
+        with providers.track(provider):
+            yield
+    finally:
+        release(t)
+
+
+async def call(provider: str, awaitable, lane: str = GENERATION, model=None, messages=(),
+               output_tokens: int = 0):
+    """Await `awaitable` (e.g. model.ainvoke(msgs)) in a slot. For callers whose timeout
+    (asyncio.wait_for) has to cover the queue wait too."""
+    try:
+        t = await acquire(provider, lane, model, estimate(messages, output_tokens))
+    except BaseException:
+        awaitable.close()  # never started
+        raise
+    try:
+        with providers.track(provider):
+            return await awaitable
+    finally:
+        release(t)
+
+
+@contextmanager
+def background():
+    """Schedule every call made inside the block (this thread or task) in the background lane."""
+    token = _lane_override.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _lane_override.reset(token)
+
+
+def status() -> dict:
+    """Running calls and rolling budgets per provider, queue depth and wait times per lane."""
+    with _lock:
+        now = time.monotonic()
+        providers_status = {}
+        for provider, limits in LIMITS.items():
+            window = [c for c in _windows[provider] if now - c[0] <= WINDOW_S]
+            providers_status[provider] = {
+                **limits,
+                "running": _running[provider],
+                "requests_last_min": len(window),
+                "tokens_last_min": sum(c[1] for c in window),
+            }
+        lanes = {
+            lane: {"queued": sum(1 for t in _queue if t.lane == lane),
+                   "running": sum(_running[("lane", p, lane)] for p in LIMITS)}
+            for lane in LANES
+        }
+    for lane, info in lanes.items():
+        for pct in (50, 90):
+            value = metrics.percentile(f"scheduler.wait.{lane}", pct)
+            info[f"wait_p{pct}_s"] = round(value, 3) if value is not None else None
+    return {"providers": providers_status, "lanes": lanes}
@@ -0,0 +1,306 @@
+"""
+Section-parallel generation for large pages and dashboards.
+
+"Full analytics dashboard with sidebar, KPI cards, chart and transactions
+table" used to be one sequential 150+ line stream, so output-token rate set
+the latency. For requests that agent.routing scores above
+SECTIONS_MIN_SCORE (default: the complex tier), generation runs in three
+steps:
+
+  1. plan: one fast-tier call splits the request and discovery plan into
+     2..SECTIONS_MAX independent sections plus a shared contract: the page
+     component's name, the state that crosses sections (e.g. the active nav
+     item) and a layout of HTML wrappers with one <Section /> tag each
+  2. sections: one generation per section, all concurrent. Each writes only
+     `function Name({ props })` against the contract, with its own sample
+     data and helpers prefixed with its name
+  3. assemble: the React hooks the sections destructure (declared once),
+     the sections, then the page component (contract state as useState
+     hooks, the layout with each section's props filled in) and
+     root.render(...)
+
+The result goes through QA like any generation. If planning, any section or
+assembly fails (missing function, duplicate top-level names, unbalanced
+braces), run() returns None and the caller generates the page in one shot.
+Wall-clock time is roughly plan + the slowest section.
+
+Metrics: sections.runs, sections.fallbacks.<reason> (counters),
+sections.count, sections.seconds and sections.slowest_s (samples).
+Set SECTION_PARALLEL=false to disable.
+
+Usage:
+    if sections.eligible(route, previous_code, is_variant):
+        result = await sections.run(user_request, discovery, library)  # None -> single shot
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+from agent import budget, metrics, routing
+
+logger = logging.getLogger(__name__)
+
+MIN_SCORE = float(os.environ.get("SECTIONS_MIN_SCORE", str(routing.STANDARD_MAX_SCORE)))
+MAX_SECTIONS = int(os.environ.get("SECTIONS_MAX", "5"))
+_PLAN_ROUTE = routing.Route("fast", 1500)
+
+_RE_PASCAL = re.compile(r"^[A-Z][A-Za-z0-9]*$")
+_RE_CAMEL = re.compile(r"^[a-z][A-Za-z0-9]*$")
+_RE_JSON = re.compile(r"\{.*\}", re.DOTALL)
+_RE_CODE_BLOCK = re.compile(r"```(?:jsx|javascript|tsx|js)?\s*\n(.*?)```", re.DOTALL)
+_RE_TAG = re.compile(r"<([A-Z][A-Za-z0-9]*)\b")
+_RE_TOP_LEVEL = re.compile(r"^(?:function|const|let|var|class)\s+([A-Za-z_$][\w$]*)", re.MULTILINE)
+_RE_TOP_LEVEL_DESTRUCTURE = re.compile(r"^(?:const|let|var)\s*[{\[]([^}\]]*)[}\]]\s*=", re.MULTILINE)
+_RE_REACT_DESTRUCTURE = re.compile(r"^const\s*\{([^}]*)\}\s*=\s*React\s*;?[ \t]*$\n?", re.MULTILINE)
+_RE_PAGE_ONLY = re.compile(r"^\s*(?:import\s.*|.*ReactDOM\.createRoot\(.*|root\.render\(.*)$\n?", re.MULTILINE)
+
+PLAN_PROMPT = """You split a large React page into independent sections. Different developers write the sections in parallel, then the page is assembled from them.
+
+Return ONLY a JSON object:
+{{
+  "component": "PascalCase name of the page component",
+  "state": [{{"name": "camelCase", "initial": "JS expression", "purpose": "what it holds"}}],
+  "sections": [{{"name": "PascalCase", "description": "what it shows and does, with the components and Tailwind classes from the plan", "components": ["catalog component names"], "state": ["names of shared state it reads or sets"]}}],
+  "layout": "JSX the page component returns: HTML wrappers with Tailwind classes and each section as a self-closing tag without props"
+}}
+
+Rules:
+- 2 to {max_sections} sections, each a visually separate region (sidebar, header, stat cards, chart, table, ...)
+- Shared state only for what crosses sections (the active nav item, a search query used by a header and a table); everything else stays inside its section
+- Section names are unique and differ from the page component; every section appears exactly once in the layout
+- Layout example: <div className="min-h-screen bg-gray-50 flex"><Sidebar /><main className="flex-1 p-8 space-y-6"><KpiCards /><TransactionsTable /></main></div>"""
+
+
+def enabled() -> bool:
+    return os.environ.get("SECTION_PARALLEL", "true").lower() != "false"
+
+
+def eligible(route, previous_code: str = "", is_variant: bool = False) -> bool:
+    """Large new pages only: modifications and variant requests stay single-shot."""
+    return enabled() and not previous_code and not is_variant and route.score > MIN_SCORE
+
+
+def _setter(name: str) -> str:
+    return "set" + name[0].upper() + name[1:]
+
+
+def _initial(state: dict) -> str:
+    """A state entry's initial value as a JS expression."""
+    value = state.get("initial")
+    return value if isinstance(value, str) and value.strip() else json.dumps(value)
+
+
+def _props(section: dict) -> list[str]:
+    return [p for name in section["state"] for p in (name, _setter(name))]
+
+
+# ────────────── Plan ──────────────
+
+def parse_contract(text: str) -> dict | None:
+    """The planner's JSON, validated and normalized; None if it can't be assembled."""
+    match = _RE_JSON.search(text or "")
+    try:
+        data = json.loads(match.group()) if match else None
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    component = str(data.get("component", ""))
+    layout = str(data.get("layout", "")).strip()
+    state = [s for s in data.get("state") or [] if isinstance(s, dict) and _RE_CAMEL.match(str(s.get("name", "")))]
+    names = {s["name"] for s in state}
+    sections = []
+    for raw in data.get("sections") or []:
+        if not isinstance(raw, dict) or not _RE_PASCAL.match(str(raw.get("name", ""))):
+            return None
+        sections.append({
+            "name": raw["name"],
+            "description": str(raw.get("description", "")),
+            "components": [str(c) for c in raw.get("components") or []],
+            "state": [n for n in raw.get("state") or [] if n in names],
+        })
+    section_names = [s["name"] for s in sections]
+    if (not _RE_PASCAL.match(component) or not 2 <= len(sections) <= MAX_SECTIONS
+            or len(set(section_names)) != len(section_names) or component in section_names):
+        return None
+    # Every section exactly once as a bare <Name />, and no other components in the layout
+    if sorted(_RE_TAG.findall(layout)) != sorted(section_names):
+        return None
+    if any(len(re.findall(rf"<{name}\s*/>", layout)) != 1 for name in section_names):
+        return None
+    return {"component": component, "state": state, "sections": sections, "layout": layout}
+
+
+async def plan(user_request: str, discovery: str) -> dict | None:
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    from agent.generator import complete
+
+    messages = [
+        SystemMessage(content=PLAN_PROMPT.format(max_sections=MAX_SECTIONS)),
+        HumanMessage(content=f"Page request: {user_request}\n\n## Component plan\n{discovery}"),
+    ]
+    return parse_contract(await complete(messages, _PLAN_ROUTE, site="sections_plan"))
+
+
+# ────────────── Sections ──────────────
+
+def _contract_summary(contract: dict) -> str:
+    state = "\n".join(f"- {s['name']} / {_setter(s['name'])} (initial {_initial(s)}): "
+                      f"{s.get('purpose', '')}" for s in contract["state"]) or "- none"
+    sections = "\n".join(f"- {s['name']}: {s['description'][:160]}" for s in contract["sections"])
+    return (f"Page component: {contract['component']}\n"
+            f"Shared state (owned by the page, passed down as props):\n{state}\n"
+            f"Sections:\n{sections}\n"
+            f"Layout: {contract['layout']}")
+
+
+def section_messages(contract: dict, section: dict, user_request: str, discovery: str, library: str) -> list:
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    from agent.generator import _build_generation_prompt
+
+    name = section["name"]
+    props = ", ".join(_props(section))
+    gen_prompt = _build_generation_prompt(library)
+    request = (
+        f"BUILD ONE SECTION of a larger page. The page: {user_request}\n\n"
+        f"## Page contract (all sections are written in parallel against it)\n{_contract_summary(contract)}\n\n"
+        f"## Your section: {name}\n{section['description']}\n"
+        f"Components: {', '.join(section['components']) or 'see the plan'}\n\n"
+        f"Write ONLY `function {name}({{ {props} }}) {{ ... }}` in a single ```jsx block.\n"
+        f"- Props are exactly: {props or 'none'}; use these names\n"
+        f"- Helper components and constants start with {name} (e.g. {name}Row, {name}Data)\n"
+        f"- Sample data lives inside this section\n"
+        f"- NO root.render, NO page wrapper, NO imports: the page assembles the sections "
+        f"(this overrides the root.render rule above)"
+    )
+    packed = budget.pack([
+        budget.Section("request", [request], required=True),
+        budget.Section("discovery", budget.markdown_units(discovery), priority=2, sep="\n\n",
+                       wrap=("\n## Components to Use (whole page):\n", "")),
+    ], budget.budget_for(routing.MODELS["standard"]["anthropic"]), site="sections", base=gen_prompt)
+    return [SystemMessage(content=gen_prompt), HumanMessage(content=packed["request"] + packed["discovery"])]
+
+
+def clean_section(text: str, name: str) -> str | None:
+    """The section's code without page-level lines, or None if it doesn't define `name`."""
+    match = _RE_CODE_BLOCK.search(text or "")
+    code = _RE_PAGE_ONLY.sub("", match.group(1) if match else text or "").strip()
+    return code if re.search(rf"^(?:function\s+{name}\s*\(|const\s+{name}\s*=)", code, re.MULTILINE) else None
+
+
+async def _generate_section(contract: dict, section: dict, user_request: str, discovery: str,
+                            library: str) -> tuple[str, float]:
+    from agent.generator import complete
+
+    t0 = time.perf_counter()
+    # The page's QA verdict is recorded against the page route, not each section's
+    route = routing.select(f"{section['name']}: {section['description']}", " ".join(section["components"]),
+                           library=library)
+    messages = section_messages(contract, section, user_request, discovery, library)
+    return await complete(messages, route, site="sections"), time.perf_counter() - t0
+
+
+# ────────────── Assembly ──────────────
+
+def _bound_names(pattern: str) -> list[str]:
+    """Local names a destructuring pattern declares: `{ a, b: c, d = 1 }` -> a, c, d."""
+    names = []
+    for part in pattern.split(","):
+        local = part.split("=")[0].split(":")[-1].strip().lstrip(".")
+        if local:
+            names.append(local)
+    return names
+
+
+def _declared(code: str) -> list[str]:
+    """Top-level names `code` declares, including destructured ones."""
+    return _RE_TOP_LEVEL.findall(code) + [name for m in _RE_TOP_LEVEL_DESTRUCTURE.finditer(code)
+                                          for name in _bound_names(m.group(1))]
+
+
+def _balanced(code: str) -> bool:
+    for open_, close in ("{}", "()", "[]"):
+        if code.count(open_) != code.count(close):
+            return False
+    return True
+
+
+def assemble(contract: dict, codes: dict[str, str]) -> str | None:
+    """Sections + page component + root.render, or None if the pieces don't fit together."""
+    # Each section may read hooks off React (`const { useState } = React;`); the page declares them once
+    react = [spec.strip() for code in codes.values() for m in _RE_REACT_DESTRUCTURE.finditer(code)
+             for spec in m.group(1).split(",") if spec.strip()]
+    react = list(dict.fromkeys(react))
+    codes = {name: _RE_REACT_DESTRUCTURE.sub("", code).strip() for name, code in codes.items()}
+    declared = _declared("\n".join(codes.values())) + _bound_names(", ".join(react))
+    if len(declared) != len(set(declared)) or contract["component"] in declared:
+        return None
+    if not all(_balanced(code) for code in codes.values()):
+        return None
+
+    layout = contract["layout"]
+    for section in contract["sections"]:
+        props = " ".join(f"{p}={{{p}}}" for p in _props(section))
+        layout = re.sub(rf"<{section['name']}\s*/>", f"<{section['name']}{' ' + props if props else ''} />", layout)
+    hooks = "\n".join(f"  const [{s['name']}, {_setter(s['name'])}] = React.useState({_initial(s)});"
+                      for s in contract["state"])
+    page = (f"function {contract['component']}() {{\n" + (hooks + "\n" if hooks else "")
+            + f"  return (\n    {layout}\n  );\n}}")
+    hoisted = [f"const {{ {', '.join(react)} }} = React;"] if react else []
+    body = "\n\n".join(hoisted + [codes[s["name"]] for s in contract["sections"]] + [page])
+    return f"{body}\n\nroot.render(React.createElement({contract['component']}));"
+
+
+# ────────────── Run ──────────────
+
+def _fallback(reason: str) -> None:
+    metrics.incr(f"sections.fallbacks.{reason}")
+    logger.info("[sections] falling back to single-shot generation: %s", reason)
+
+
+async def run(user_request: str, discovery: str, library: str = "untitledui") -> str | None:
+    """The page as a ```jsx block built from parallel sections, or None (generate it in one shot)."""
+    metrics.incr("sections.runs")
+    t0 = time.perf_counter()
+    try:
+        contract = await plan(user_request, discovery)
+    except Exception as e:
+        logger.warning("[sections] planning failed: %s", e)
+        contract = None
+    if contract is None:
+        _fallback("plan")
+        return None
+
+    names = [s["name"] for s in contract["sections"]]
+    logger.info("[sections] %s -> %s", contract["component"], ", ".join(names))
+    results = await asyncio.gather(
+        *(_generate_section(contract, s, user_request, discovery, library) for s in contract["sections"]),
+        return_exceptions=True)
+    codes = {}
+    for section, result in zip(contract["sections"], results):
+        code = None if isinstance(result, BaseException) else clean_section(result[0], section["name"])
+        if code is None:
+            _fallback("section")
+            logger.info("[sections] section %s unusable: %s", section["name"],
+                        result if isinstance(result, BaseException) else "no function definition")
+            return None
+        codes[section["name"]] = code
+
+    page = assemble(contract, codes)
+    if page is None:
+        _fallback("assembly")
+        return None
+    elapsed = time.perf_counter() - t0
+    slowest = max(seconds for _, seconds in results)
+    metrics.observe("sections.count", len(names))
+    metrics.observe("sections.seconds", elapsed)
+    metrics.observe("sections.slowest_s", slowest)
+    logger.info("[sections] %d sections assembled in %.1fs (slowest section %.1fs, %d lines)",
+                len(names), elapsed, slowest, page.count("\n") + 1)
+    return f"```jsx\n{page}\n```"
@@ -0,0 +1,282 @@
+"""
+Semantic near-duplicate cache for generated components.
+
+Paraphrases such as "login form with email and password" and "sign-in card
+with email/password fields" miss the exact cache (agent.cache). Here each
+fresh generate request is embedded (text-embedding-3-small, same as RAG) and
+compared, per library, with earlier requests whose component passed QA. At
+cosine similarity >= SEMANTIC_CACHE_THRESHOLD (default 0.92) the stored
+component is served immediately as a draft.
+
+With SEMANTIC_CACHE_REFINE=true the real request is also generated in the
+background (at most _REFINE_WORKERS at a time, one per request, up to
+_MAX_PENDING_REFINES queued). If it passes QA it goes into both caches, so
+the next identical request gets the tailored version.
+
+Each row records the design-system fingerprint it was generated against
+(agent.cache); lookups only consider rows built against the current one, and
+stale rows are purged when a library's index is loaded.
+
+Only new components are eligible: requests that modify a previous or pinned
+component depend on that code, not just the wording.
+
+Tuning data lives in agent.metrics:
+- semantic.hit_rate (ratio)
+- the semantic.similarity sample window, best match per lookup (p50/p90/p99)
+- semantic.similarity.<bucket> counters, a 0.05-wide histogram
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from agent import metrics, scheduler
+from agent.cache import _fingerprint, db_path, normalize
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES_PER_LIBRARY = 2000
+_EMBED_CACHE_SIZE = 256
+_REFINE_WORKERS = 2
+_MAX_PENDING_REFINES = 8
+
+# The chat UI appends the same output instructions to every request; left in,
+# they'd inflate the similarity of unrelated prompts
+_RE_BOILERPLATE = re.compile(r"\s*Output the complete updated React component.*$", re.DOTALL)
+
+_lock = threading.Lock()
+_conn: sqlite3.Connection | None = None
+# {library: {"fingerprint": str, "rows": [(request, code, qa)], "matrix": ndarray | None}}
+_indexes: dict[str, dict] = {}
+_embeddings: OrderedDict[str, object] = OrderedDict()  # normalized request -> vector
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-cache")
+_refine_executor = ThreadPoolExecutor(max_workers=_REFINE_WORKERS, thread_name_prefix="semantic-refine")
+_refining: set[tuple[str, str]] = set()  # (library, normalized request) queued or running
+
+metrics.register_ratio("semantic.hit_rate", "semantic.hits", "semantic.lookups")
+
+
+def enabled() -> bool:
+    return os.environ.get("SEMANTIC_CACHE", "true").lower() != "false"
+
+
+def threshold() -> float:
+    return float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+
+
+def refine_enabled() -> bool:
+    return os.environ.get("SEMANTIC_CACHE_REFINE", "true").lower() != "false"
+
+
+def eligible(request: str, previous_code: str = "") -> bool:
+    """New-component requests only (no base component, no pasted/pinned code)."""
+    return enabled() and bool(request.strip()) and not previous_code and "```" not in request
+
+
+# ────────────── Storage ──────────────
+
+def _get_conn() -> sqlite3.Connection:
+    """Shares the response cache's SQLite file (separate table)."""
+    global _conn
+    if _conn is None:
+        Path(db_path()).parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(db_path(), check_same_thread=False, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS semantic ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, library TEXT, request TEXT,"
+            " code TEXT, qa TEXT, embedding BLOB, fingerprint TEXT)"
+        )
+        columns = {row[1] for row in _conn.execute("PRAGMA table_info(semantic)")}
+        if "fingerprint" not in columns:  # tables created before rows were fingerprinted
+            _conn.execute("ALTER TABLE semantic ADD COLUMN fingerprint TEXT")
+        _conn.execute("CREATE INDEX IF NOT EXISTS semantic_library ON semantic(library)")
+    return _conn
+
+
+def _load_index(library: str, fp: str) -> dict:
+    """In-memory matrix of the embeddings stored for one library under design-system
+    fingerprint `fp` (loaded from disk once per fingerprint; older rows are purged). Caller holds _lock."""
+    import numpy as np
+
+    index = _indexes.get(library)
+    if index is not None and index["fingerprint"] == fp:
+        return index
+    rows, vectors = [], []
+    try:
+        conn = _get_conn()
+        conn.execute("DELETE FROM semantic WHERE library = ? AND (fingerprint IS NULL OR fingerprint != ?)",
+                     (library, fp))
+        for request, code, qa, blob in conn.execute(
+            "SELECT request, code, qa, embedding FROM semantic WHERE library = ? AND fingerprint = ?"
+            " ORDER BY id DESC LIMIT ?",
+            (library, fp, MAX_ENTRIES_PER_LIBRARY),
+        ):
+            rows.append((request, code, qa))
+            vectors.append(np.frombuffer(blob, dtype=np.float32))
+    except sqlite3.Error as e:
+        logger.warning("[semantic] load failed: %s", e)
+    index = {"fingerprint": fp, "rows": rows, "matrix": _normalize_rows(np.vstack(vectors)) if vectors else None}
+    _indexes[library] = index
+    return index
+
+
+def _normalize_rows(matrix):
+    import numpy as np
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-10)
+
+
+def _embed(request: str):
+    """Unit-length embedding for a request (memoized per normalized text)."""
+    import numpy as np
+    from agent.rag import _get_embeddings
+
+    text = normalize(_RE_BOILERPLATE.sub("", request))
+    with _lock:
+        vec = _embeddings.get(text)
+        if vec is not None:
+            _embeddings.move_to_end(text)
+            return vec
+    vec = _get_embeddings([text])[0]
+    vec = vec / (np.linalg.norm(vec) + 1e-10)
+    with _lock:
+        _embeddings[text] = vec
+        while len(_embeddings) > _EMBED_CACHE_SIZE:
+            _embeddings.popitem(last=False)
+    return vec
+
+
+# ────────────── Public API ──────────────
+
+def lookup(request: str, library: str = "untitledui") -> dict | None:
+    """Closest QA-passed component for a paraphrased request, or None.
+
+    Returns {"generated_code", "qa_result", "similarity", "matched_request"}.
+    """
+    try:
+        vec = _embed(request)
+    except Exception as e:
+        logger.warning("[semantic] embedding failed: %s", e)
+        return None
+
+    fp = _fingerprint(library)  # outside _lock: a changed fingerprint calls invalidate()
+    with _lock:
+        index = _load_index(library, fp)
+        if index["matrix"] is None:
+            return None
+        scores = index["matrix"] @ vec
+        best = int(scores.argmax())
+        similarity = float(scores[best])
+        row = index["rows"][best]
+
+    metrics.incr("semantic.lookups")
+    metrics.observe("semantic.similarity", similarity)
+    metrics.incr(f"semantic.similarity.{min(0.95, int(similarity * 20) / 20):.2f}")
+    if similarity < threshold():
+        return None
+
+    metrics.incr("semantic.hits")
+    logger.info("[semantic] hit %.3f: %r ~ %r", similarity, request[:60], row[0][:60])
+    return {"generated_code": row[1], "qa_result": row[2], "similarity": similarity, "matched_request": row[0]}
+
+
+def _store(request: str, library: str, code: str, qa_result: str) -> None:
+    import numpy as np
+
+    vec = np.asarray(_embed(request), dtype=np.float32)
+    fp = _fingerprint(library)
+    with _lock:
+        index = _load_index(library, fp)
+        try:
+            _get_conn().execute(
+                "INSERT INTO semantic (library, request, code, qa, embedding, fingerprint) VALUES (?, ?, ?, ?, ?, ?)",
+                (library, request, code, qa_result, vec.tobytes(), fp),
+            )
+        except sqlite3.Error as e:
+            logger.warning("[semantic] write failed: %s", e)
+            return
+        index["rows"].insert(0, (request, code, qa_result))
+        row = vec.reshape(1, -1)
+        index["matrix"] = row if index["matrix"] is None else np.vstack([row, index["matrix"]])
+        if len(index["rows"]) > MAX_ENTRIES_PER_LIBRARY:
+            index["rows"] = index["rows"][:MAX_ENTRIES_PER_LIBRARY]
+            index["matrix"] = index["matrix"][:MAX_ENTRIES_PER_LIBRARY]
+
+
+def remember(request: str, library: str, code: str, qa_result: str) -> None:
+    """Index a QA-passed component (embedding + write happen off the request path)."""
+    if not code or "PASS" not in qa_result.upper():
+        return
+
+    def job():
+        try:
+            _store(request, library, code, qa_result)
+        except Exception as e:
+            logger.warning("[semantic] store failed: %s", e)
+
+    _executor.submit(job)
+
+
+def refine_in_background(request: str, library: str) -> None:
+    """Run discovery + generation for the actual request after a draft was served.
+    A QA PASS updates both caches so the next identical request gets the
+    tailored component. Skipped while the same request is already being
+    refined, or when _MAX_PENDING_REFINES are queued."""
+    if not refine_enabled():
+        return
+    key = (library, normalize(request))
+    with _lock:
+        if key in _refining or len(_refining) >= _MAX_PENDING_REFINES:
+            metrics.incr("semantic.refines_skipped")
+            return
+        _refining.add(key)
+
+    def job():
+        import asyncio
+
+        from agent import cache
+        from agent.discovery import run_discovery
+        from agent.generator import run_generation
+        from agent.variants import qa_and_fix
+
+        async def generate() -> str:
+            plan = await run_discovery(request, library=library)
+            return await run_generation(user_request=request, discovery_output=plan, library=library)
+
+        try:
+            with scheduler.background():  # never competes with live requests for provider capacity
+                result = asyncio.run(generate())
+            match = re.search(r"```(?:jsx|javascript|tsx|js)?\s*\n(.*?)```", result, re.DOTALL)
+            checked = qa_and_fix(match.group(1).strip() if match else result, library)
+        except Exception as e:
+            logger.warning("[semantic] background refine failed: %s", e)
+            return
+        finally:
+            with _lock:
+                _refining.discard(key)
+        metrics.incr("semantic.refines")
+        if checked["verdict"] == "PASS":
+            metrics.incr("semantic.refines_passed")
+            cache.put("generation", request, library, {"generated_code": checked["code"], "qa_result": checked["report"]})
+            _store(request, library, checked["code"], checked["report"])
+
+    _refine_executor.submit(job)
+
+
+def invalidate(library: str | None = None) -> None:
+    """Drop stored components (all libraries, or one)."""
+    with _lock:
+        try:
+            if library is None:
+                _get_conn().execute("DELETE FROM semantic")
+                _indexes.clear()
+            else:
+                _get_conn().execute("DELETE FROM semantic WHERE library = ?", (library,))
+                _indexes.pop(library, None)
+        except sqlite3.Error as e:
+            logger.warning("[semantic] invalidate failed: %s", e)
@@ -8,12 +8,17 @@ SSE-compatible chunks for the chatbot UI.
 import asyncio
 import json
 import os
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from dotenv import load_dotenv
 from langchain_core.messages import AIMessage, HumanMessage
 
+from agent import metrics, singleflight
 from agent.orchestrator import create_orchestrator
+from agent.sessions import has_session, open_checkpointer, thread_config
+from agent.streaming import CodeStreamParser
 
 ROOT = Path(__file__).resolve().parent.parent
 
@@ -35,11 +40,33 @@ def _get_graph():
     return _graph
 
 
+@asynccontextmanager
+async def _open_graph(message: str, history: list | None, session_id: str | None):
+    """Yield (graph, messages, config) for one turn.
+
+    Without a session_id this is the stateless singleton graph fed with the
+    client's history. With one, the graph is compiled against the SQLite
+    checkpointer and only the new message is added — the client's history is
+    used once, to seed a session the server hasn't seen yet.
+    """
+    if not session_id:
+        yield _get_graph(), _prepare_history(history) + [HumanMessage(content=message)], None
+        return
+
+    async with open_checkpointer() as saver:
+        graph = create_orchestrator(checkpointer=saver)
+        messages = [] if await has_session(graph, session_id) else _prepare_history(history)
+        messages.append(HumanMessage(content=message))
+        yield graph, messages, thread_config(session_id)
+
+
 def _prepare_history(history: list | None) -> list:
-    """Convert raw history dicts to LangChain messages."""
+    """Convert raw history dicts to LangChain messages. The whole history is kept: the
+    orchestrator compacts it (agent.compaction), and a sliding window here would shift
+    its summary blocks every turn."""
     messages = []
     if history:
-        for h in history[-20:]:
+        for h in history:
             role = h.get("role", "user")
             content = h.get("content", "")
             if role == "user" and content:
@@ -49,36 +76,61 @@ def _prepare_history(history: list | None) -> list:
     return messages
 
 
-def _build_initial_state(messages: list, message: str, workflow: str, library: str = "untitledui") -> dict:
-    """Build the initial orchestrator state dict."""
+def _build_initial_state(messages: list, message: str, workflow: str, library: str = "untitledui",
+                         race: int = 0, deadline_s: float | None = None, prefetched: dict | None = None,
+                         intent: str = "") -> dict:
+    """Build the initial orchestrator state dict.
+
+    previous_code is left out on purpose: classify_node resolves it from
+    history, and with a session checkpointer the saved value carries over.
+    deadline stays 0 unless deadline_s is given; classify_node then applies
+    the workflow's default.
+    """
     return {
         "messages": messages,
         "workflow": workflow,
         "user_request": message,
+        "intent": intent or message,
         "discovery_output": "",
         "generated_code": "",
         "qa_result": "",
         "retry_count": 0,
         "library": library,
+        "autofix_done": False,
+        "variants": None,
+        "race": race,
+        "code_blocks": [],
+        "headings": [],
+        "deadline": time.time() + deadline_s if deadline_s else 0,
+        "timed_out": False,
+        "best_code": "",
+        "best_qa": "",
+        "best_score": -1,
+        "cache_hit": False,
+        "semantic_match": None,
+        "aborted": False,
+        "prefetched": prefetched or {},
+        "tier": "",
     }
 
 
-async def run_agent(message: str, history: list = None, workflow: str = "") -> str:
+async def run_agent(message: str, history: list = None, workflow: str = "", session_id: str | None = None,
+                    deadline_s: float | None = None) -> str:
     """Run the multi-agent orchestrator and return the final response.
 
     Args:
         message: User's message
         history: List of {"role": "user"|"assistant", "content": "..."} dicts
         workflow: Pre-classified workflow (generate/discover/review/chat) to skip classify LLM call
+        session_id: Server-side session to continue (history is then only used to seed a new session)
+        deadline_s: Time budget for the whole run (default: the workflow's DEADLINES entry)
 
     Returns:
         The final AI response as a string
     """
-    graph = _get_graph()
-    messages = _prepare_history(history)
-    messages.append(HumanMessage(content=message))
-
-    result = await graph.ainvoke(_build_initial_state(messages, message, workflow))
+    async with _open_graph(message, history, session_id) as (graph, messages, config):
+        result = await graph.ainvoke(_build_initial_state(messages, message, workflow, deadline_s=deadline_s),
+                                     config=config)
 
     final_messages = result.get("messages", [])
     for msg in reversed(final_messages):
@@ -88,7 +140,9 @@ async def run_agent(message: str, history: list = None, workflow: str = "") -> s
     return "No response generated."
 
 
-async def run_agent_stream(message: str, history: list = None, workflow: str = "", library: str = "untitledui"):
+async def run_agent_stream(message: str, history: list = None, workflow: str = "", library: str = "untitledui",
+                           race: int = 0, session_id: str | None = None, deadline_s: float | None = None,
+                           prefetched: dict | None = None, intent: str = ""):
     """Run the multi-agent orchestrator and yield SSE chunks.
 
     Streams LLM tokens in real-time during generation and respond nodes.
@@ -98,84 +152,147 @@ async def run_agent_stream(message: str, history: list = None, workflow: str = "
         history: Conversation history
         workflow: Pre-classified workflow to skip classify LLM call
         library: Design system library (untitledui, metafore, both)
+        race: Opt-in race mode — run this many generations concurrently, first QA PASS wins
+        session_id: Server-side session to continue; the exchange is checkpointed under it
+        deadline_s: Time budget for the whole run (default: the workflow's DEADLINES entry);
+            when it runs out, the best QA'd code so far is returned
+        prefetched: Stage results computed from the user's draft (agent.prefetch.handoff)
+        intent: The user's own words, without instructions the client appends (default: message)
 
     Yields:
-        dict with {"type": "status"|"chunk"|"done"|"error", ...}
+        dict with {"type": "status"|"thinking"|"code_delta"|"code_complete"|"variant"|"chunk"|"done"|"error", ...}
+        "code_delta"/"code_complete" stream the generated component while it is being
+        written (see agent.streaming); every LLM call (retry, hedge backup) has its own attempt number.
+        "variant" events carry each finished variant (index, title, code, verdict, score)
+        as soon as its own QA completes. "done" carries session_id when the turn was saved.
+
+    Identical concurrent requests share one run (agent.singleflight); a late
+    subscriber first receives the events emitted so far.
     """
-    import time
-    graph = _get_graph()
-    messages = _prepare_history(history)
-    messages.append(HumanMessage(content=message))
+    # The latest assistant turn stands in for the previous code: same conversation state,
+    # without converting and regex-scanning the whole history before the graph does
+    last_reply = next((h.get("content", "") for h in reversed(history or []) if h.get("role") == "assistant"), "")
+    key = singleflight.make_key(message, library, workflow, race, last_reply, session_id)
+
+    def run():
+        return _run_turn(message, history, workflow, library, race, session_id, deadline_s, prefetched, intent)
+
+    async for event in singleflight.stream(key, run):
+        yield event
 
-    initial_state = _build_initial_state(messages, message, workflow, library=library)
+
+async def _run_turn(message: str, history: list | None, workflow: str, library: str, race: int,
+                    session_id: str | None, deadline_s: float | None, prefetched: dict | None = None,
+                    intent: str = ""):
+    """One pipeline run as SSE dicts, ending with "done" or "error"."""
+    try:
+        async with _open_graph(message, history, session_id) as (graph, messages, config):
+            initial_state = _build_initial_state(messages, message, workflow, library=library, race=race,
+                                                 deadline_s=deadline_s, prefetched=prefetched, intent=intent)
+            async for event in _stream_graph(graph, initial_state, config):
+                yield event
+        yield {"type": "done", "session_id": session_id} if session_id else {"type": "done"}
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
+
+
+async def _stream_graph(graph, initial_state: dict, config: dict | None):
+    """Run one turn and translate LangGraph events into SSE dicts (everything but "done")."""
 
     status_labels = {
         "classify": "Analyzing your request...",
         "discovery": "Searching component library...",
         "generation": "Generating React code...",
         "qa": "Reviewing code quality...",
+        "autofix": "Auto-fixing QA issues...",
+        "variant_generation": "Generating variants in parallel...",
+        "variant_merge": "Assembling variants...",
+        "race_generation": "Racing parallel generations...",
         "retry_generation": "Fixing issues, regenerating...",
         "respond": "Preparing response...",
     }
 
-    try:
-        t0 = time.time()
-        final_content = ""
-        streamed_respond = False
-        current_node = None
-        thinking_nodes = {"discovery", "generation", "retry_generation"}
-
-        async for event in graph.astream_events(initial_state, version="v2"):
-            kind = event.get("event", "")
-            name = event.get("name", "")
-
-            # Track current node + send status updates
-            if kind == "on_chain_start" and name in status_labels:
-                current_node = name
-                elapsed = time.time() - t0
-                print(f"[pipeline] {name} started at {elapsed:.1f}s")
-                yield {"type": "status", "text": status_labels[name]}
-
-            # Stream LLM tokens: "thinking" for discovery/generation, "chunk" ONLY for respond/chat
-            # Tokens arriving when current_node is None (between nodes) are treated as thinking
-            if kind == "on_chat_model_stream":
-                chunk_data = event.get("data", {})
-                chunk_obj = chunk_data.get("chunk")
-                if chunk_obj and hasattr(chunk_obj, "content") and chunk_obj.content:
-                    token = chunk_obj.content
-                    if current_node and current_node not in thinking_nodes:
-                        final_content += token
-                        streamed_respond = True
-                        yield {"type": "chunk", "text": token}
-                    else:
-                        yield {"type": "thinking", "text": token}
-
-            # Capture formatted respond node output
-            if kind == "on_chain_end" and name == "respond":
-                elapsed = time.time() - t0
-                print(f"[pipeline] respond finished at {elapsed:.1f}s")
-                if not streamed_respond:
-                    output = event.get("data", {}).get("output", {})
-                    new_messages = output.get("messages", [])
-                    for msg in new_messages:
-                        if isinstance(msg, AIMessage) and msg.content:
-                            final_content = msg.content
-
-            if kind == "on_chain_end" and name in status_labels:
-                elapsed = time.time() - t0
-                print(f"[pipeline] {name} finished at {elapsed:.1f}s")
-                if name == current_node:
-                    current_node = None
-
-        # Send final content as chunks if not already streamed
-        if final_content and not streamed_respond:
-            chunk_size = 200
-            for i in range(0, len(final_content), chunk_size):
-                yield {"type": "chunk", "text": final_content[i:i + chunk_size]}
-
-        elapsed = time.time() - t0
-        print(f"[pipeline] TOTAL: {elapsed:.1f}s")
-        yield {"type": "done"}
-
-    except Exception as e:
-        yield {"type": "error", "error": str(e)}
+    t0 = time.time()
+    final_content = ""
+    streamed_respond = False
+    current_node = None
+    thinking_nodes = {"discovery", "generation", "retry_generation", "variant_generation", "race_generation"}
+    # Generation nodes whose ```jsx block is forwarded live (variants/race keep their own events).
+    # One parser per LLM run: a hedged call streams Claude and GPT-4o side by side
+    code_nodes = {"generation", "retry_generation"}
+    code_parsers: dict[str, CodeStreamParser] = {}
+    first_code_at = None
+
+    async for event in graph.astream_events(initial_state, config=config, version="v2"):
+        kind = event.get("event", "")
+        name = event.get("name", "")
+
+        # Track current node + send status updates
+        if kind == "on_chain_start" and name in status_labels:
+            current_node = name
+            elapsed = time.time() - t0
+            print(f"[pipeline] {name} started at {elapsed:.1f}s")
+            yield {"type": "status", "text": status_labels[name]}
+
+        # Stream LLM tokens: "thinking" for discovery/generation, "chunk" ONLY for respond/chat
+        # Tokens arriving when current_node is None (between nodes) are treated as thinking
+        if kind == "on_chat_model_stream":
+            chunk_data = event.get("data", {})
+            chunk_obj = chunk_data.get("chunk")
+            if chunk_obj and hasattr(chunk_obj, "content") and chunk_obj.content:
+                token = chunk_obj.content
+                if current_node and current_node not in thinking_nodes:
+                    final_content += token
+                    streamed_respond = True
+                    yield {"type": "chunk", "text": token}
+                else:
+                    yield {"type": "thinking", "text": token}
+                    if current_node in code_nodes:
+                        run_id = event.get("run_id", "")
+                        if run_id not in code_parsers:
+                            code_parsers[run_id] = CodeStreamParser(attempt=len(code_parsers))
+                        for code_event in code_parsers[run_id].feed(token):
+                            if first_code_at is None:
+                                first_code_at = time.time() - t0
+                                metrics.observe("stream.first_code_seconds", first_code_at)
+                            yield code_event
+
+        # Capture formatted respond node output
+        if kind == "on_chain_end" and name == "respond":
+            elapsed = time.time() - t0
+            print(f"[pipeline] respond finished at {elapsed:.1f}s")
+            if not streamed_respond:
+                output = event.get("data", {}).get("output", {})
+                new_messages = output.get("messages", [])
+                for msg in new_messages:
+                    if isinstance(msg, AIMessage) and msg.content:
+                        final_content = msg.content
+
+        # Stream each variant as soon as its own generate/QA loop finishes
+        if kind == "on_chain_end" and name == "variant_generation":
+            output = event.get("data", {}).get("output", {}) or {}
+            for v in output.get("variants", []):
+                yield {
+                    "type": "variant",
+                    "index": v["index"],
+                    "title": f"Variant {v['index'] + 1}: {v['style']}",
+                    "code": v["code"],
+                    "verdict": v["verdict"],
+                    "score": v["score"],
+                }
+
+        if kind == "on_chain_end" and name in status_labels:
+            elapsed = time.time() - t0
+            print(f"[pipeline] {name} finished at {elapsed:.1f}s")
+            if name == current_node:
+                current_node = None
+
+    # Send final content as chunks if not already streamed
+    if final_content and not streamed_respond:
+        chunk_size = 200
+        for i in range(0, len(final_content), chunk_size):
+            yield {"type": "chunk", "text": final_content[i:i + chunk_size]}
+
+    elapsed = time.time() - t0
+    metrics.observe("pipeline.seconds", elapsed)
+    print(f"[pipeline] TOTAL: {elapsed:.1f}s")
@@ -0,0 +1,66 @@
+"""
+Server-side conversation sessions.
+
+The orchestrator is compiled with a LangGraph checkpointer backed by a local
+SQLite file (WAL mode), keyed by the client's session_id (LangGraph
+thread_id). Clients send only the new message each turn instead of
+re-posting up to 20 history messages, and a conversation survives a server
+restart.
+
+The database path defaults to .sessions/sessions.sqlite in the repo root and
+can be overridden with SESSION_DB_PATH.
+"""
+
+import logging
+import os
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def db_path() -> str:
+    """SQLite file used for session checkpoints."""
+    return os.environ.get("SESSION_DB_PATH", "").strip() or str(ROOT / ".sessions" / "sessions.sqlite")
+
+
+def thread_config(session_id: str) -> dict:
+    """LangGraph run config addressing one session."""
+    return {"configurable": {"thread_id": session_id}}
+
+
+@asynccontextmanager
+async def open_checkpointer(path: str | None = None):
+    """Yield an AsyncSqliteSaver on a WAL-mode connection.
+
+    Opened per request: the HTTP servers run each request on its own event
+    loop and aiosqlite connections are bound to the loop that opened them.
+    WAL lets concurrent requests read while another session is written.
+    """
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    path = path or db_path()
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = await aiosqlite.connect(path)
+    try:
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        saver = AsyncSqliteSaver(conn)
+        await saver.setup()
+        yield saver
+    finally:
+        await conn.close()
+
+
+async def has_session(graph, session_id: str) -> bool:
+    """True if the session already has checkpointed messages."""
+    try:
+        snapshot = await graph.aget_state(thread_config(session_id))
+    except Exception as e:
+        logger.warning("[sessions] state lookup failed for %s: %s", session_id, e)
+        return False
+    return bool(snapshot and snapshot.values.get("messages"))
@@ -0,0 +1,155 @@
+"""
+Single-flight coalescing of identical in-flight pipeline runs.
+
+A double-submit, or several dashboard tabs sending the same prompt, used to
+start one full pipeline run (and its LLM calls) per request. Requests are
+now keyed by
+
+    sha256(normalized message | library | workflow | race | latest-reply hash | session)
+
+and a request whose key is already running attaches to that run instead of
+starting its own. Every subscriber first gets the events already emitted,
+then the live ones, so all SSE streams end up identical.
+
+The run itself lives on its own thread and event loop, not on the handler of
+the request that started it. A subscriber that disconnects therefore doesn't
+stop the others. When the last subscriber leaves before the run finishes, the
+run is cancelled. Once a run completes its key is released; repeats after
+that are served by agent.cache.
+
+The session id is part of the key because only the run's own session gets
+the checkpointed turn. Metrics: singleflight.coalesce_rate (ratio),
+singleflight.runs / singleflight.cancelled (counters).
+Set SINGLEFLIGHT=false to disable.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import threading
+
+from agent import metrics
+from agent.cache import code_hash, normalize
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+_lock = threading.Lock()
+_flights: dict[str, "_Flight"] = {}
+_ids = itertools.count()
+
+metrics.register_ratio("singleflight.coalesce_rate", "singleflight.coalesced", "singleflight.requests")
+
+
+def enabled() -> bool:
+    return os.environ.get("SINGLEFLIGHT", "true").lower() != "false"
+
+
+class _Flight:
+    """One running pipeline: its event log and the subscribers' queues. State guarded by _lock."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.events: list[dict] = []
+        self.subscribers: dict[int, tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = {}
+        self.done = False
+        self.cancelled = False
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.task: asyncio.Task | None = None
+
+
+def make_key(message: str, library: str = "untitledui", workflow: str = "", race: int = 0,
+             last_reply: str = "", session_id: str | None = None) -> str:
+    """`last_reply` is the latest assistant turn (it holds the component being modified)."""
+    raw = "|".join((normalize(message), library, workflow, str(race), code_hash(last_reply), session_id or ""))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _send(flight: _Flight, item) -> None:
+    """Deliver an event (or _END) to every subscriber's loop."""
+    for sub_id, (loop, queue) in list(flight.subscribers.items()):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:  # subscriber's loop already closed
+            flight.subscribers.pop(sub_id, None)
+
+
+def _produce(flight: _Flight, producer) -> None:
+    """Thread target: run the pipeline and publish its events."""
+
+    async def main():
+        with _lock:
+            if flight.cancelled:
+                return
+            flight.loop, flight.task = asyncio.get_running_loop(), asyncio.current_task()
+        async for event in producer():
+            with _lock:
+                flight.events.append(event)
+                _send(flight, event)
+
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        metrics.incr("singleflight.cancelled")
+        logger.info("[singleflight] run %s cancelled: no subscribers left", flight.key[:12])
+    except Exception as e:
+        logger.error("[singleflight] run %s failed: %s", flight.key[:12], e)
+        with _lock:
+            _send(flight, {"type": "error", "error": str(e)})
+    finally:
+        with _lock:
+            flight.done = True
+            if _flights.get(flight.key) is flight:
+                del _flights[flight.key]
+            _send(flight, _END)
+
+
+async def stream(key: str, producer):
+    """Events of the run for `key`: joins the in-flight run, or starts `producer`
+    (a zero-argument async generator function) if there is none."""
+    if not enabled():
+        async for event in producer():
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    sub_id = next(_ids)
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight(key)
+        backlog = list(flight.events)
+        flight.subscribers[sub_id] = (loop, queue)
+    metrics.incr("singleflight.requests")
+    if leader:
+        metrics.incr("singleflight.runs")
+        threading.Thread(target=_produce, args=(flight, producer), name="singleflight", daemon=True).start()
+    else:
+        metrics.incr("singleflight.coalesced")
+        logger.info("[singleflight] attached to in-flight run %s (%d events so far)", key[:12], len(backlog))
+
+    try:
+        for event in backlog:
+            yield event
+        while True:
+            event = await queue.get()
+            if event is _END:
+                return
+            yield event
+    finally:
+        with _lock:
+            flight.subscribers.pop(sub_id, None)
+            if not flight.subscribers and not flight.done and not flight.cancelled:
+                flight.cancelled = True
+                if _flights.get(key) is flight:
+                    del _flights[key]  # a new request for this key starts fresh
+                if flight.loop and flight.task:
+                    try:
+                        flight.loop.call_soon_threadsafe(flight.task.cancel)
+                    except RuntimeError:  # finished in the meantime
+                        pass
@@ -0,0 +1,85 @@
+"""
+Incremental code-fence parser for streamed generation output.
+
+The generation node writes its component inside a ```jsx fence, token by
+token. CodeStreamParser recognises the fence as it arrives, even when the
+backticks are split across tokens, and turns the stream into SSE events:
+
+  {"type": "code_delta", "block": i, "attempt": n, "text": "..."}
+      code inside the fence, as soon as it is known not to be part of a fence
+  {"type": "code_complete", "block": i, "attempt": n, "code": "...", "hash": "..."}
+      once the fence closes; hash is agent.cache.code_hash(code)
+
+The UI can render and preview the component while QA is still running.
+Fences for other languages (```css, ```bash) are skipped.
+"""
+
+import re
+
+from agent.cache import code_hash
+
+CODE_LANGUAGES = {"", "jsx", "javascript", "tsx", "js"}
+
+# Opening fence with its info string, complete once the newline has arrived
+_RE_OPEN = re.compile(r"```([\w+-]*)[ \t]*\n")
+
+
+class CodeStreamParser:
+    """Feed tokens in order; each feed() returns the events they complete."""
+
+    def __init__(self, attempt: int = 0):
+        self.attempt = attempt
+        self.block = 0
+        self._buffer = ""
+        self._code: list[str] = []
+        self._in_fence = False
+        self._is_code = False
+
+    def feed(self, token: str) -> list[dict]:
+        self._buffer += token
+        events = []
+        while True:
+            if not self._in_fence:
+                match = _RE_OPEN.search(self._buffer)
+                if not match:
+                    # Prose between blocks is never emitted; keep only a possible partial fence
+                    tail = self._buffer.rfind("`")
+                    self._buffer = self._buffer[max(tail - 2, 0):] if tail >= 0 else ""
+                    return events
+                self._in_fence = True
+                self._is_code = match.group(1).lower() in CODE_LANGUAGES
+                self._code = []
+                self._buffer = self._buffer[match.end():]
+                continue
+
+            close = self._buffer.find("```")
+            if close < 0:
+                # Hold back trailing backticks until we know whether they close the fence
+                held = len(self._buffer) - len(self._buffer.rstrip("`"))
+                ready = self._buffer[:len(self._buffer) - held]
+                self._buffer = self._buffer[len(ready):]
+                if ready and self._is_code:
+                    self._code.append(ready)
+                    events.append(self._delta(ready))
+                return events
+
+            ready = self._buffer[:close]
+            self._buffer = self._buffer[close + 3:]
+            self._in_fence = False
+            if self._is_code:
+                if ready:
+                    self._code.append(ready)
+                    events.append(self._delta(ready))
+                code = "".join(self._code).strip()
+                if code:
+                    events.append({"type": "code_complete", "block": self.block, "attempt": self.attempt,
+                                   "code": code, "hash": code_hash(code)})
+                    self.block += 1
+
+    @property
+    def streaming(self) -> bool:
+        """True while inside an open code fence."""
+        return self._in_fence and self._is_code
+
+    def _delta(self, text: str) -> dict:
+        return {"type": "code_delta", "block": self.block, "attempt": self.attempt, "text": text}
@@ -0,0 +1,124 @@
+"""
+Incremental QA on the generation token stream.
+
+verify_quality / check_accessibility only see a component once it has been
+fully written, so output that is doomed from its first lines (a class
+component, a lowercase component name) still costs the whole ~15s
+generation before the retry starts. StreamingQA follows the ```jsx block
+as it streams (via agent.streaming.CodeStreamParser) and re-checks the
+rules that are *monotonic*, meaning that once they fire on a prefix they
+are certain to fire on the finished code:
+
+  - class components ("class " + "extends", same test as verify_quality)
+  - first function component not PascalCase (the first match can't change)
+  - import statements
+
+A rule only aborts the stream when it is an error that agent.autofix can't
+repair. Imports, for example, are stripped deterministically after QA, so
+they are counted but let through. An abort raises EarlyAbort. The
+orchestrator turns it into a QA FAIL and goes straight to the retry.
+
+Savings are estimated against a running average of completed generations:
+streaming_qa.tokens_saved (counter) and streaming_qa.seconds_saved (samples).
+"""
+
+import logging
+import re
+import time
+
+from agent import metrics
+from agent.autofix import is_fixable
+from agent.reviewer import format_report
+from agent.streaming import CodeStreamParser
+
+logger = logging.getLogger(__name__)
+
+# Same patterns as agent.tools.verify_quality
+_RE_FUNC_COMPONENT = re.compile(r"function\s+([a-zA-Z_]\w*)\s*\(")
+_RE_IMPORT = re.compile(r"^import\s+", re.MULTILINE)
+
+# Running average output size, seeded with a typical ~80-line component
+_avg_tokens = 1500.0
+_EMA_ALPHA = 0.2
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+class EarlyAbort(Exception):
+    """Raised from the generation stream when the output is certain to fail QA."""
+
+    def __init__(self, issues: list[dict], partial: str):
+        super().__init__("; ".join(i["message"] for i in issues))
+        self.issues = issues
+        self.partial = partial
+
+    @property
+    def report(self) -> str:
+        """QA-style FAIL report, used as the retry feedback."""
+        return format_report("FAIL", 0, self.issues) + "\n(Generation stopped early — fix these before anything else.)"
+
+
+class StreamingQA:
+    """Feed generation tokens in order; feed() raises EarlyAbort on a certain hard failure."""
+
+    def __init__(self):
+        self._parser = CodeStreamParser()
+        self._code = ""
+        self._text: list[str] = []
+        self._started = time.perf_counter()
+        self._seen: set[str] = set()
+        self._naming: list[dict] | None = None  # decided by the first function component
+
+    def feed(self, token: str) -> None:
+        self._text.append(token)
+        if self._parser.block > 0:
+            return  # only the first block is QA'd (as qa_node does)
+        deltas = [e["text"] for e in self._parser.feed(token) if e["type"] == "code_delta" and e["block"] == 0]
+        if not deltas:
+            return
+        self._code += "".join(deltas)
+        hard = [i for i in self._check(self._code) if i["severity"] == "error" and not is_fixable(i)]
+        if hard:
+            self._abort(hard)
+
+    def finish(self) -> None:
+        """Record the size of a generation that ran to completion."""
+        global _avg_tokens
+        _avg_tokens += _EMA_ALPHA * (estimate_tokens("".join(self._text)) - _avg_tokens)
+
+    def _check(self, code: str) -> list[dict]:
+        issues = []
+        if "class " in code and "extends" in code:
+            issues.append({"rule": "quality", "severity": "error",
+                           "message": "Class components not allowed — use function components"})
+        if self._naming is None:
+            match = _RE_FUNC_COMPONENT.search(code)
+            if match:
+                name = match.group(1)
+                self._naming = [] if name[0].isupper() else [
+                    {"rule": "naming", "severity": "error", "message": f"Component '{name}' must be PascalCase"}]
+        issues.extend(self._naming or [])
+        if _RE_IMPORT.search(code):
+            issues.append({"rule": "quality", "severity": "error",
+                           "message": "Import statements not allowed — React/ReactDOM are global"})
+        for issue in issues:
+            if issue["message"] not in self._seen:
+                self._seen.add(issue["message"])
+                metrics.incr(f"streaming_qa.detected.{issue['rule']}")
+        return issues
+
+    def _abort(self, issues: list[dict]) -> None:
+        text = "".join(self._text)
+        elapsed = time.perf_counter() - self._started
+        seen = estimate_tokens(text)
+        saved_tokens = max(0.0, _avg_tokens - seen)
+        rate = seen / elapsed if elapsed > 0 else 0.0
+        saved_seconds = saved_tokens / rate if rate else 0.0
+        metrics.incr("streaming_qa.aborts")
+        metrics.incr("streaming_qa.tokens_saved", saved_tokens)
+        metrics.observe("streaming_qa.seconds_saved", saved_seconds)
+        logger.info("[streaming_qa] abort after %d tokens (%.1fs), ~%d tokens / %.1fs saved: %s",
+                    seen, elapsed, saved_tokens, saved_seconds, issues[0]["message"])
+        raise EarlyAbort(issues, text)
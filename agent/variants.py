@@ -0,0 +1,85 @@
+"""
+Variant fan-out helpers.
+
+Variants used to come from ONE LLM call that wrote 2-3 full components
+back to back, so latency was the sum of all variants and only the first
+block was QA'd. Each variant is now an independent request:
+
+  - Orchestrator: map/reduce branch (Send -> variant_generation -> variant_merge)
+  - HTTP servers: fan_out() over a thread pool in /api/generate-variants
+
+Each variant is QA'd, auto-fixed and retried on its own and reported as
+soon as it finishes, so wall-clock time is that of the slowest variant.
+"""
+
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_STYLES = ["minimal and clean", "bold and colorful", "playful and rounded"]
+
+_RE_COUNT = re.compile(r"(\d+)\s*(?:different\s+)?(?:style\s+)?(?:variants?|versions?|styles?)", re.IGNORECASE)
+_RE_KEYWORD = re.compile(r"Variant\s*\d+\s*:?\s*(?:with\s+)?(?:an?\s+)?([^.,;\n]+)", re.IGNORECASE)
+
+
+def plan_variants(message: str, count: int | None = None, keywords: list[str] | None = None) -> list[str]:
+    """Decide how many variants to build (2-3) and the style of each.
+
+    Styles come from explicit keywords, then "Variant N: style" phrases in
+    the message, then DEFAULT_STYLES.
+    """
+    if count is None:
+        m = _RE_COUNT.search(message)
+        count = int(m.group(1)) if m else 2
+    count = max(2, min(3, int(count)))
+
+    styles = [k.strip() for k in (keywords or []) if k and k.strip()][:count]
+    if not styles:
+        styles = [k.strip() for k in _RE_KEYWORD.findall(message)][:count]
+    while len(styles) < count:
+        styles.append(DEFAULT_STYLES[len(styles)] if len(styles) < len(DEFAULT_STYLES) else f"Variant {len(styles) + 1}")
+    return styles
+
+
+def name_suffix(style: str, index: int) -> str:
+    """PascalCase suffix for a variant's component name ("bold and colorful" -> "Bold")."""
+    words = [w for w in re.findall(r"[A-Za-z]+", style) if w.lower() not in {"and", "with", "a", "an", "the", "variant"}]
+    return words[0].capitalize() if words else f"V{index + 1}"
+
+
+def qa_and_fix(code: str, library: str = "untitledui") -> dict:
+    """QA one variant, auto-fixing mechanical issues first.
+
+    Returns {"code", "verdict", "score", "report"}.
+    """
+    from agent.autofix import autofix, record
+    from agent.reviewer import evaluate
+
+    result = evaluate(code)
+    if result["verdict"] == "FAIL":
+        fixed, applied = autofix(code, result["issues"], library)
+        if applied:
+            result = evaluate(fixed)
+            code = fixed
+        record(result["verdict"] == "PASS", applied)
+    return {"code": code, "verdict": result["verdict"], "score": result["score"], "report": result["report"]}
+
+
+def fan_out(worker, items: list, on_result=None, max_workers: int = 3) -> list:
+    """Run worker(index, item) concurrently; call on_result(result) as each finishes.
+
+    Returns results in input order. A worker exception becomes
+    {"index": i, "error": str(e)} so one failed variant doesn't sink the rest.
+    """
+    results: list = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        futures = {pool.submit(worker, i, item): i for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"index": i, "error": str(e)}
+            results[i] = result
+            if on_result:
+                on_result(result)
+    return results
@@ -153,9 +153,12 @@
   configureMarked();
 
   // ── Streaming API (supports status + thinking events from multi-agent system) ──
-  async function streamChat(message, history, onChunk, onDone, onError, signal, onStatus, onThinking, intent, library) {
+  async function streamChat(message, history, onChunk, onDone, onError, signal, onStatus, onThinking, intent, library, sessionId, onCode, onVariant) {
     try {
-      const payload = { message, history };
+      // With a server-side session, history is only sent to seed it (null once the server has it)
+      const payload = { message };
+      if (history) payload.history = history;
+      if (sessionId) payload.session_id = sessionId;
       if (intent) payload.intent = intent;
       if (library) payload.library = library;
       const response = await fetch('/api/chat/stream', {
@@ -180,7 +183,9 @@
               if (parsed.type === 'chunk' && parsed.text) onChunk(parsed.text);
               else if (parsed.type === 'thinking' && parsed.text && onThinking) onThinking(parsed.text);
               else if (parsed.type === 'status' && parsed.text && onStatus) onStatus(parsed.text);
-              else if (parsed.type === 'done') { onDone(); return; }
+              else if ((parsed.type === 'code_delta' || parsed.type === 'code_complete') && onCode) onCode(parsed);
+              else if (parsed.type === 'variant' && parsed.code && onVariant) onVariant(parsed);
+              else if (parsed.type === 'done') { onDone(parsed); return; }
               else if (parsed.type === 'error') { onError(parsed.error || 'Unknown error'); return; }
             } catch {}
           }
@@ -658,7 +663,7 @@
   }
 
   // ── Single Message ──
-  function Message({ role, content, code, codes, variantLabels, bubbleText, thinkingContent, isStreaming, isThinking, onCopyCode, pinnedLabels, library }) {
+  function Message({ role, content, code, codes, variantLabels, bubbleText, thinkingContent, isStreaming, isThinking, onCopyCode, pinnedLabels, library, draftCode, streamVariants }) {
     const isUser = role === 'user';
     const hasMultiple = !isStreaming && codes && codes.length > 1;
     const hasSingle = !isStreaming && !hasMultiple && code;
@@ -676,7 +681,12 @@
               thinkingContent && e(ThinkingBar, { content: thinkingContent, isActive: isThinking || false }),
               e(MarkdownContent, { content: bubbleText || content, isStreaming }),
               hasMultiple && e(MultiPreview, { codes, labels: variantLabels || [], onCopyCode, library }),
-              hasSingle && e(InlinePreview, { code, onCopyCode, library }))
+              hasSingle && e(InlinePreview, { code, onCopyCode, library }),
+              // Generated component previewed before QA finishes (replaced by the final message)
+              isStreaming && draftCode && e(InlinePreview, { code: draftCode, onCopyCode, library }),
+              // Variants previewed one by one as each finishes its own generate/QA loop
+              isStreaming && streamVariants && streamVariants.length > 0 && e(MultiPreview, {
+                codes: streamVariants.map(v => v.code), labels: streamVariants.map(v => v.title), onCopyCode, library }))
       )
     );
   }
@@ -693,9 +703,16 @@
   }
 
   // ── Input Area ──
-  function InputArea({ onSend, isStreaming, onStop, pinnedFiles, onUnpin }) {
+  function InputArea({ onSend, isStreaming, onStop, pinnedFiles, onUnpin, onDraft }) {
     const [input, setInput] = useState('');
     const taRef = useRef(null);
+    // Debounced draft -> /api/prefetch, so classification/RAG/discovery start before Enter
+    useEffect(() => {
+      const draft = input.trim();
+      if (!onDraft || isStreaming || draft.length < 8) return;
+      const t = setTimeout(() => onDraft(draft), 400);
+      return () => clearTimeout(t);
+    }, [input, isStreaming, onDraft]);
     const adjustH = useCallback(() => {
       const ta = taRef.current;
       if (ta) { ta.style.height = 'auto'; ta.style.height = Math.min(ta.scrollHeight, 180) + 'px'; }
@@ -1006,6 +1023,10 @@
     const [agentStatusText, setAgentStatusText] = useState('');
     const [pipelineVisible, setPipelineVisible] = useState(false);
     const [thinkingContent, setThinkingContent] = useState('');
+    // Component streamed from the generation node ({ attempt, text, complete }) — previewed while QA runs
+    const [draftCode, setDraftCode] = useState(null);
+    // Finished variants streamed by the variant fan-out ({ index, title, code, verdict, score }), in index order
+    const [streamVariants, setStreamVariants] = useState([]);
     const [selectedLibrary, setSelectedLibrary] = useState('untitledui');
     const [theme, setTheme] = useState(() => {
       try { return localStorage.getItem('ds-agent-theme') || 'dark'; } catch { return 'dark'; }
@@ -1110,7 +1131,7 @@
       if (!streamingConvRef.current || streamingConvRef.current !== id) {
         setIsStreaming(false); setStreamingContent(''); setShowTyping(false);
         setPipelineVisible(false); setAgentStep(null); setAgentStatusText('');
-        setThinkingContent('');
+        setThinkingContent(''); setDraftCode(null);
       }
     }, [selectedLibrary]);
 
@@ -1120,7 +1141,7 @@
       if (!isThisStreaming) {
         setIsStreaming(false); setStreamingContent(''); setShowTyping(false);
         setPipelineVisible(false); setAgentStep(null); setAgentStatusText('');
-        setThinkingContent('');
+        setThinkingContent(''); setDraftCode(null);
       }
       const conv = conversationsRef.current.find(c => c.id === id);
       if (conv && conv.library) setSelectedLibrary(conv.library);
@@ -1177,15 +1198,6 @@
       return { bubbleText, code, codes, variantLabels };
     }, [addCodeFile]);
 
-    // Truncate long assistant messages for history to save tokens
-    function trimHistoryContent(content, maxLen) {
-      if (!content || content.length <= maxLen) return content;
-      const codeBlockRe = /```[\s\S]*?```/g;
-      let trimmed = content.replace(codeBlockRe, '\n[code block omitted]\n');
-      if (trimmed.length > maxLen) trimmed = trimmed.slice(0, maxLen) + '...';
-      return trimmed;
-    }
-
     const CODE_RULE = ' Output the complete updated React component in a single jsx code block. Must end with root.render(React.createElement(ComponentName)). Keep it compact, under 80 lines. Minimal explanation.';
 
     // Send message — pinned context + code rules injected into backend payload only
@@ -1217,25 +1229,18 @@
       const latestConvs = conversationsRef.current;
       const currentConv = latestConvs.find(c => c.id === convId);
       const allMsgs = currentConv ? currentConv.messages : [];
-      // Include the user message we just added
-      // IMPORTANT: Keep the LAST assistant message's full content (with code blocks)
-      // so the pipeline's _get_previous_code() can find the original component.
-      // Only trim OLDER assistant messages to save tokens.
-      const rawHistory = [...allMsgs, { role: 'user', content: visibleText }].slice(-20);
-      let lastAssistantIdx = -1;
-      for (let i = rawHistory.length - 1; i >= 0; i--) {
-        if (rawHistory[i].role === 'assistant') { lastAssistantIdx = i; break; }
-      }
-      const history = rawHistory.map((m, i) => ({
-        role: m.role,
-        content: m.role === 'assistant' && i !== lastAssistantIdx
-          ? trimHistoryContent(m.content, 500)
-          : m.content,
-      }));
+      // The conversation id doubles as the server session id; once the server has
+      // confirmed the session it keeps the history, so only the new message is sent
+      const serverHasSession = !!(currentConv && currentConv.serverSession);
+      // The whole conversation, unchanged: the server compacts it (latest code verbatim, older
+      // turns summarized in blocks aligned to the first message), so a client-side window or
+      // trimming would only shift those blocks and re-trigger summaries every turn
+      const history = [...allMsgs, { role: 'user', content: visibleText }]
+        .map(m => ({ role: m.role, content: m.content }));
 
       setShowTyping(true); setStreamingContent(''); setIsStreaming(true);
       setAgentStep(null); setAgentStatusText(''); setPipelineVisible(true);
-      setThinkingContent('');
+      setThinkingContent(''); setDraftCode(null); setStreamVariants([]);
       streamingConvRef.current = convId;
       const controller = new AbortController();
       abortRef.current = controller;
@@ -1243,17 +1248,20 @@
       let fullThinking = '';
       let firstChunk = true;
 
-      await streamChat(backendText, history,
+      await streamChat(backendText, serverHasSession ? null : history,
         (chunk) => {
           if (firstChunk) { setShowTyping(false); firstChunk = false; }
           fullContent += chunk;
           setStreamingContent(fullContent);
         },
-        () => {
+        (doneEvent) => {
           streamingConvRef.current = null;
           setIsStreaming(false); setShowTyping(false); setStreamingContent('');
           setPipelineVisible(false); setAgentStep(null); setAgentStatusText('');
-          setThinkingContent('');
+          setThinkingContent(''); setDraftCode(null); setStreamVariants([]);
+          if (doneEvent && doneEvent.session_id === convId) {
+            updateConversation(convId, () => ({ serverSession: true }));
+          }
           if (fullContent) {
             const { bubbleText, code, codes, variantLabels } = processAssistantMessage(fullContent, visibleText);
             updateConversation(convId, (c) => ({
@@ -1269,7 +1277,7 @@
           streamingConvRef.current = null;
           setIsStreaming(false); setShowTyping(false); setStreamingContent('');
           setPipelineVisible(false); setAgentStep(null); setAgentStatusText('');
-          setThinkingContent('');
+          setThinkingContent(''); setDraftCode(null); setStreamVariants([]);
           updateConversation(convId, (c) => ({
             messages: [...c.messages, { role: 'assistant', content: `Error: ${error}`, bubbleText: `Sorry, an error occurred: ${error}`, code: null }],
           }));
@@ -1286,10 +1294,34 @@
           setThinkingContent(fullThinking);
         },
         text,
-        selectedLibrary
+        selectedLibrary,
+        convId,
+        (codeEvent) => {
+          // Only the first block of the latest attempt is the component; a retry or hedge restarts the draft
+          if (codeEvent.block !== 0) return;
+          setDraftCode(prev => {
+            if (prev && codeEvent.attempt < prev.attempt) return prev;
+            if (codeEvent.type === 'code_complete') return { attempt: codeEvent.attempt, text: codeEvent.code, complete: true };
+            const base = prev && prev.attempt === codeEvent.attempt ? prev.text : '';
+            return { attempt: codeEvent.attempt, text: base + codeEvent.text, complete: false };
+          });
+        },
+        (variant) => {
+          setShowTyping(false);
+          setStreamVariants(prev => [...prev.filter(v => v.index !== variant.index), variant]
+            .sort((a, b) => a.index - b.index));
+        }
       );
     }, [activeId, conversations, updateConversation, addToast, processAssistantMessage, codeFiles, selectedLibrary]);
 
+    const prefetchDraft = useCallback((text) => {
+      const conv = conversationsRef.current.find(c => c.id === activeId);
+      const hasCode = codeFiles.some(f => f.pinned) || !!(conv && conv.messages.some(m => m.role === 'assistant' && (m.code || (m.codes && m.codes.length))));
+      const payload = { text, library: selectedLibrary, has_previous_code: hasCode };
+      if (activeId) payload.session_id = activeId;
+      fetch('/api/prefetch', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(payload) }).catch(() => {});
+    }, [activeId, codeFiles, selectedLibrary]);
+
     const stopStreaming = useCallback(() => { if (abortRef.current) { abortRef.current.abort(); abortRef.current = null; } }, []);
 
     // Streaming message processing (live)
@@ -1342,10 +1374,14 @@
                   pinnedLabels: m.pinnedLabels,
                   library: m.library || selectedLibrary,
                   onCopyCode: copyCode })),
-                isStreaming && !showTyping && (streamingContent || thinkingContent) && e(Message, { key: 'streaming',
+                isStreaming && !showTyping && (streamingContent || thinkingContent || streamVariants.length > 0) && e(Message, { key: 'streaming',
                   role: 'assistant', content: streamingContent || '',
-                  bubbleText: streamingContent ? streamingBubble : (thinkingContent ? '' : ''),
+                  bubbleText: streamingContent ? streamingBubble
+                    : draftCode ? '```jsx\n' + draftCode.text + (draftCode.complete ? '\n```' : '')
+                    : streamVariants.length ? `${streamVariants.length} variant${streamVariants.length > 1 ? 's' : ''} ready, assembling...` : '',
                   code: null, isStreaming: true, isThinking: !!thinkingContent && !streamingContent,
+                  draftCode: !streamingContent && draftCode && draftCode.complete ? draftCode.text : null,
+                  streamVariants: streamingContent ? null : streamVariants,
                   thinkingContent: thinkingContent || null,
                   library: selectedLibrary,
                   onCopyCode: copyCode }),
@@ -1355,7 +1391,7 @@
         ),
 
         // Input
-        e(InputArea, { onSend: sendMessage, isStreaming, onStop: stopStreaming,
+        e(InputArea, { onSend: sendMessage, isStreaming, onStop: stopStreaming, onDraft: prefetchDraft,
           pinnedFiles: codeFiles.filter(f => f.pinned), onUnpin: togglePinFile })
       ),
 
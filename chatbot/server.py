@@ -14,6 +14,8 @@ from pathlib import Path
 DIR = Path(__file__).resolve().parent
 ROOT = DIR.parent
 PORT = 3851
+# Most concurrent generations one request can race (agent/orchestrator.py RACE_CANDIDATES)
+RACE_MAX = 4
 
 # ──────────────────────── Environment ────────────────────────
 
@@ -50,6 +52,14 @@ def _load_env():
 
 _load_env()
 
+
+def _ensure_root_on_path():
+    """Make the project root importable so the agent package can be loaded lazily."""
+    import sys
+    root = str(ROOT)
+    if root not in sys.path:
+        sys.path.insert(0, root)
+
 # ──────────────────────── LLM Clients ────────────────────────
 
 def _get_anthropic_client():
@@ -62,7 +72,7 @@ def _get_anthropic_client():
 
 
 def _get_openai_client():
-    """Get an OpenAI client instance (used for RAG embeddings only)."""
+    """Get an OpenAI client instance."""
     import openai
     api_key = os.environ.get("OPENAI_API_KEY", "").strip()
     if not api_key:
@@ -70,6 +80,67 @@ def _get_openai_client():
     return openai.OpenAI(api_key=api_key)
 
 
+def _model_for(provider, fast=False):
+    """Model per provider: Claude Sonnet <-> GPT-4o, or Claude Haiku <-> GPT-4o-mini when fast."""
+    from agent.providers import ANTHROPIC_FAST_MODEL
+    if provider == "anthropic":
+        return ANTHROPIC_FAST_MODEL if fast else "claude-sonnet-4-20250514"
+    return "gpt-4o-mini" if fast else "gpt-4o"
+
+
+def _anthropic_request(messages):
+    """OpenAI-style messages -> Anthropic kwargs (system text + user/assistant turns starting with user),
+    with prompt-cache breakpoints on the system prompt and the history (agent.prompt_cache)."""
+    from agent import prompt_cache
+    system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+    turns = [m for m in messages if m["role"] in ("user", "assistant")]
+    while turns and turns[0]["role"] != "user":
+        turns.pop(0)
+    return prompt_cache.anthropic_request(system, turns)
+
+
+def _complete(messages, primary="anthropic", max_tokens=4096, fast=False, lane="generation", route=None):
+    """One completion from `primary`, or from the other provider while primary's circuit is open
+    (agent.providers), in an agent.scheduler slot of `lane`. An agent.routing.Route overrides
+    the model and max_tokens. `messages` are OpenAI-style dicts; system entries are allowed."""
+    _ensure_root_on_path()
+    from agent import prompt_cache, providers, scheduler
+    provider = providers.pick(primary, "openai" if primary == "anthropic" else "anthropic")
+    model = route.model(provider) if route else _model_for(provider, fast)
+    max_tokens = route.max_tokens if route else max_tokens
+    with scheduler.slot_sync(provider, lane, model, messages=messages, output_tokens=min(max_tokens, 2000)):
+        if provider == "anthropic":
+            response = _get_anthropic_client().messages.create(
+                model=model, max_tokens=max_tokens, **_anthropic_request(messages))
+            prompt_cache.record(response.usage, provider, "chatbot")
+            return response.content[0].text or ""
+        response = _get_openai_client().chat.completions.create(
+            model=model, max_tokens=max_tokens, messages=messages)
+        return response.choices[0].message.content or ""
+
+
+def _stream_completion(messages, primary="anthropic", max_tokens=4096, fast=False, lane="generation", route=None):
+    """Streaming _complete: yields text deltas."""
+    _ensure_root_on_path()
+    from agent import prompt_cache, providers, scheduler
+    provider = providers.pick(primary, "openai" if primary == "anthropic" else "anthropic")
+    model = route.model(provider) if route else _model_for(provider, fast)
+    max_tokens = route.max_tokens if route else max_tokens
+    with scheduler.slot_sync(provider, lane, model, messages=messages, output_tokens=min(max_tokens, 2000)):
+        if provider == "anthropic":
+            with _get_anthropic_client().messages.stream(
+                    model=model, max_tokens=max_tokens, **_anthropic_request(messages)) as stream:
+                yield from stream.text_stream
+                prompt_cache.record(stream.get_final_message().usage, provider, "chatbot")
+        else:
+            stream = _get_openai_client().chat.completions.create(
+                model=model, max_tokens=max_tokens, messages=messages, stream=True)
+            for chunk in stream:
+                delta = chunk.choices[0].delta if chunk.choices else None
+                if delta and delta.content:
+                    yield delta.content
+
+
 def _prepare_anthropic_messages(messages):
     """Prepare messages for Anthropic API (must alternate user/assistant).
     Extracts system messages into a separate string, merges consecutive same-role messages."""
@@ -93,6 +164,26 @@ def _prepare_anthropic_messages(messages):
         chat_messages = [{"role": "user", "content": "Hello"}]
     return "\n\n".join(system_parts), chat_messages
 
+
+def _compact_history(history):
+    """Client history as role/content dicts, compacted (latest code verbatim,
+    older turns summarized) so prompt size doesn't grow with the session. Pass the
+    whole history: summary blocks are aligned to its first message, so slicing a
+    sliding window first would shift them (and miss the summary cache) every turn."""
+    _ensure_root_on_path()
+    from agent.compaction import compact_history
+    return compact_history(history or [])
+
+
+def _last_code(history):
+    """Body of the newest code block the assistant sent, or ""."""
+    for h in reversed(history or []):
+        if h.get("role") == "assistant":
+            m = re.search(r"```(?:jsx|javascript|tsx|js)?\s*\n(.*?)```", h.get("content", ""), re.DOTALL)
+            if m:
+                return m.group(1).strip()
+    return ""
+
 # ──────────────────────── Project Context ────────────────────────
 
 def _load_project_context():
@@ -153,16 +244,27 @@ def _load_design_system(library="untitledui"):
     return out
 
 def _build_system_prompt():
-    project_ctx = _load_project_context()
-    coding_guidelines = _load_coding_guidelines()
+    """Chat system prompt, fitted to Sonnet's prompt budget (agent.budget): the catalog and
+    tokens are capped, then PROJECT_CONTEXT.md sections are dropped first, guidelines last."""
+    _ensure_root_on_path()
+    from agent import budget
     ds = _load_design_system()
-    tokens_str = json.dumps(ds.get("tokens", {}), indent=2)[:2000]
-    comps = ds.get("catalog", {}).get("components", [])[:25]
-    comps_str = json.dumps(comps, indent=2)[:3000]
+    packed = budget.pack([
+        budget.Section("project_context", budget.markdown_units(_load_project_context()), priority=3),
+        budget.json_section("tokens", ds.get("tokens", {}), priority=2, max_tokens=600),
+        budget.json_section("catalog", ds.get("catalog", {}).get("components", []), priority=2, max_tokens=900),
+        budget.Section("guidelines", budget.markdown_units(_load_coding_guidelines()), priority=1, sep="\n\n"),
+    ], budget.budget_for(_model_for("anthropic")), site="system_prompt", base=_SYSTEM_PROMPT_TEMPLATE)
+    guidelines = packed["guidelines"]
+    return _SYSTEM_PROMPT_TEMPLATE.format(
+        project_ctx=packed["project_context"],
+        tokens_str=packed["tokens"],
+        comps_str=packed["catalog"],
+        guidelines_section=f"\n\n## Coding Guidelines\n{guidelines}\n" if guidelines else "",
+    )
 
-    guidelines_section = f"\n\n## Coding Guidelines\n{coding_guidelines}\n" if coding_guidelines else ""
 
-    return f"""You are an expert AI assistant for the "Milestone 1 — Design System Agent" project.
+_SYSTEM_PROMPT_TEMPLATE = """You are an expert AI assistant for the "Milestone 1 — Design System Agent" project.
 
 ## Full Project Context
 {project_ctx}
@@ -225,58 +327,34 @@ def _is_variant_request(message):
 
 
 def _fast_classify(message):
-    """Quick GPT-4o-mini classification: full intent classification in one call.
+    """Classify intent locally (rules + hashed n-gram model, microseconds); only
+    low-confidence messages escalate to GPT-4o-mini.
     Returns 'generate', 'discover', 'review', or 'chat'.
     Variant requests are routed as 'generate' through the full pipeline."""
     # Fast regex check for variant requests — route through pipeline as generate
     if _is_variant_request(message):
         return "generate"
 
-    import openai
-    api_key = os.environ.get("OPENAI_API_KEY", "").strip()
-    if not api_key:
-        return "generate"
+    _ensure_root_on_path()
+    from agent import cache, intent, providers
+
+    label, confidence, source = intent.classify(message)
+    if not intent.needs_llm(confidence):
+        print(f"[chatbot] Local intent: {label} ({source}, {confidence:.2f})")
+        return label
+
+    cached = cache.get("classify", message, "")
+    if cached:
+        return cached["workflow"]
+    if not providers.available("openai"):
+        return label  # no key, or circuit open: the local guess beats waiting for a timeout
     try:
-        client = openai.OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            max_tokens=10,
-            temperature=0,
-            messages=[
-                {"role": "system", "content": (
-                    "Classify the user message into exactly one word:\n"
-                    "- \"generate\" if the user wants to CREATE, BUILD, GENERATE, MAKE, DESIGN, "
-                    "or MODIFY a UI component, page, dashboard, form, table, card, or any visual element. "
-                    "Also \"generate\" for: redesign, add dark mode, make responsive, simplify, add animation.\n"
-                    "- \"discover\" if the user wants to EXPLORE, LIST, or BROWSE available components or design tokens.\n"
-                    "- \"review\" if the user wants to REVIEW, CHECK, or AUDIT existing code.\n"
-                    "- \"chat\" if it's a general question, greeting, explanation request, "
-                    "or anything NOT about building/modifying UI.\n\n"
-                    "Examples:\n"
-                    "\"Create a login form\" -> generate\n"
-                    "\"Build me a dashboard\" -> generate\n"
-                    "\"Make it more minimal\" -> generate\n"
-                    "\"What components are available?\" -> discover\n"
-                    "\"Review this code\" -> review\n"
-                    "\"Hello\" -> chat\n"
-                    "\"How does the pipeline work?\" -> chat\n"
-                    "\"Thanks!\" -> chat\n"
-                    "Respond with ONLY one word."
-                )},
-                {"role": "user", "content": message},
-            ],
-        )
-        result = (response.choices[0].message.content or "").strip().lower().strip('"').strip("'")
-        if "generate" in result:
-            return "generate"
-        if "discover" in result:
-            return "discover"
-        if "review" in result:
-            return "review"
-        return "chat"
+        workflow = intent.llm_classify(message)
+        cache.put("classify", message, "", {"workflow": workflow})
+        return workflow
     except Exception as e:
-        print(f"[chatbot] Classification error: {e}")
-        return "generate"
+        print(f"[chatbot] Classification error: {e} — using local guess ({label})")
+        return label
 
 
 # ──────────────────────── Preview Template ────────────────────────
@@ -380,15 +458,12 @@ PREVIEW_HTML_TPL = """<!DOCTYPE html>
 def generate_code(prompt):
     """Call Claude Sonnet to generate React/JSX code using design system."""
     _load_env()
+    _ensure_root_on_path()
+    from agent import budget
     ds = _load_design_system()
-    tokens_str = json.dumps(ds.get("tokens", {}), indent=2)[:2000]
     catalog = ds.get("catalog", {})
     comps = catalog.get("components", catalog) if isinstance(catalog, dict) else catalog
-    comps_str = json.dumps(comps[:15], indent=2)[:3000]
-    system = f"""You are a React UI generator using the Untitled UI design system. Output only a single React function component.
-Use Tailwind CSS with Untitled UI patterns. Design tokens: {tokens_str}
-Available patterns: {comps_str}
-Rules:
+    rules = """Rules:
 - Output ONLY valid JavaScript/JSX. No markdown, no explanation.
 - Single function component with PascalCase name.
 - Use Tailwind classes for styling (Untitled UI patterns).
@@ -399,15 +474,19 @@ Rules:
 - Buttons: bg-blue-600 hover:bg-blue-700 text-white font-semibold text-sm px-4 py-2.5 rounded-lg shadow-sm
 - Cards: bg-white border border-gray-200 rounded-xl shadow-sm
 - Inputs: border border-gray-300 rounded-lg px-3.5 py-2.5 text-sm shadow-sm focus:ring-2 focus:ring-blue-500"""
+    packed = budget.pack([
+        budget.Section("request", [prompt], required=True),
+        budget.json_section("tokens", ds.get("tokens", {}), priority=1, max_tokens=600),
+        budget.json_section("catalog", comps, priority=2, max_tokens=900),
+    ], budget.budget_for(_model_for("anthropic")), site="generate_ui", base=rules)
+    system = f"""You are a React UI generator using the Untitled UI design system. Output only a single React function component.
+Use Tailwind CSS with Untitled UI patterns. Design tokens: {packed["tokens"]}
+Available patterns: {packed["catalog"]}
+{rules}"""
     try:
-        client = _get_anthropic_client()
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4096,
-            system=system,
-            messages=[{"role": "user", "content": prompt}],
-        )
-        text = response.content[0].text or ""
+        from agent import routing
+        text = _complete([{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+                         route=routing.route(prompt))
         code = text.strip()
         if code.startswith("```"):
             lines = code.split("\n")
@@ -419,69 +498,70 @@ Rules:
         return {"error": str(e)}
 
 
-def generate_variants(prompt, count, keywords):
-    """Generate 2 or 3 React UI variants using Claude Sonnet."""
-    count = max(2, min(3, int(count)))
-    _load_env()
-    keywords = list(keywords)[:count] if keywords else []
-    while len(keywords) < count:
-        keywords.append(f"Variant {len(keywords) + 1}")
-    ds = _load_design_system()
-    comps = ds.get("catalog", {}).get("components", [])[:15]
-    style_desc = " ".join(f"Variant {i+1} ({keywords[i]}): emphasize that style." for i in range(count))
-    user_content = f"""Generate exactly {count} different React UI variants for this request. Each variant should match the same prompt but differ in style/approach.
+def _strip_code_fences(text):
+    """Return the first fenced code block's body, or the text itself if unfenced."""
+    m = re.search(r"```(?:jsx|javascript|tsx|js)?\s*\n(.*?)```", text, re.DOTALL)
+    return (m.group(1) if m else text).strip()
 
-Prompt: {prompt}
 
-Style descriptions: {style_desc}
+def generate_variants(prompt, count, keywords, library="untitledui", on_variant=None):
+    """Generate 2 or 3 React UI variants as concurrent Claude calls (one per variant).
 
-Output format — use exactly this structure:
-## Variant 1: {keywords[0]}
-```jsx
-// React component code here
-```
+    Each variant is QA'd, auto-fixed and retried once on its own; on_variant(v)
+    is called as soon as each one finishes, so latency is the slowest variant
+    rather than the sum of all of them."""
+    _ensure_root_on_path()
+    from agent import budget, routing
+    from agent.variants import fan_out, name_suffix, plan_variants, qa_and_fix
 
-## Variant 2: {keywords[1]}
-```jsx
-// React component code here
-```
-"""
-    if count >= 3:
-        user_content += f"""
-## Variant 3: {keywords[2]}
-```jsx
-// React component code here
-```
-"""
-    user_content += """
-Output ONLY the variants. Each code block must be a single runnable React function component; then root.render(React.createElement(ThatComponent));"""
-    system = f"""You are a React UI generator using the Untitled UI design system. Output {count} variants. Use Tailwind CSS.
-Design tokens: {json.dumps(ds.get("tokens", {}), indent=2)[:1500]}
-Available patterns: {json.dumps(comps, indent=2)[:2000]}
-Rules: valid JS/JSX only, no markdown outside the required format. Single function component per variant.
+    count = max(2, min(3, int(count)))
+    _load_env()
+    styles = plan_variants(prompt, count=count, keywords=keywords)
+    ds = _load_design_system(library)
+    rules = """Rules: valid JS/JSX only, no text outside the code block. Single function component.
 Use root.render(React.createElement(Component)); No imports; React/ReactDOM are global.
 Buttons: bg-blue-600 hover:bg-blue-700 text-white rounded-lg shadow-sm. Cards: bg-white border border-gray-200 rounded-xl shadow-sm."""
-    try:
-        client = _get_anthropic_client()
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=8192,
-            system=system,
-            messages=[{"role": "user", "content": user_content}],
+    packed = budget.pack([
+        budget.Section("request", [prompt], required=True),
+        budget.json_section("tokens", ds.get("tokens", {}), priority=1, max_tokens=450),
+        budget.json_section("catalog", ds.get("catalog", {}).get("components", []), priority=2, max_tokens=600),
+    ], budget.budget_for(_model_for("anthropic")), site="variants", base=rules)
+    system = f"""You are a React UI generator using the Untitled UI design system. Output ONE variant as a single ```jsx code block. Use Tailwind CSS.
+Design tokens: {packed["tokens"]}
+Available patterns: {packed["catalog"]}
+{rules}"""
+    if not (os.environ.get("ANTHROPIC_API_KEY", "").strip() or os.environ.get("OPENAI_API_KEY", "").strip()):
+        return {"error": "ANTHROPIC_API_KEY not set. Add it to .env file."}
+
+    def build_variant(index, style):
+        suffix = name_suffix(style, index)
+        user_content = (
+            f"Build ONE React UI variant for this request.\n\nPrompt: {prompt}\n\n"
+            f"Style: {style} — emphasize that style.\n"
+            f"The component name must end with '{suffix}'. The code must be a single runnable React function "
+            f"component followed by root.render(React.createElement(ThatComponent));"
         )
-        text = (response.content[0].text or "").strip()
-        variants = []
-        pattern = re.compile(r"##\s*Variant\s*\d+\s*:?\s*([^\n]*)\s*```(?:jsx|javascript)?\s*\n(.*?)```", re.DOTALL | re.IGNORECASE)
-        for m in pattern.finditer(text):
-            label = (m.group(1) or "").strip() or keywords[len(variants)] if len(variants) < len(keywords) else f"Variant {len(variants)+1}"
-            code = m.group(2).strip()
-            if code:
-                variants.append({"code": code, "keywords": label})
-            if len(variants) >= count:
+        best, feedback = None, ""
+        for attempt in range(2):
+            content = user_content + (f"\n\nQA FEEDBACK (fix these issues):\n{feedback}" if feedback else "")
+            route = routing.route(prompt, library=library, attempt=attempt)
+            text = _complete([{"role": "system", "content": system}, {"role": "user", "content": content}],
+                             route=route)
+            checked = qa_and_fix(_strip_code_fences(text), library)
+            routing.record_qa(route.tier, checked["verdict"] == "PASS")
+            if best is None or checked["verdict"] == "PASS" or checked["score"] > best["score"]:
+                best = checked
+            if checked["verdict"] == "PASS":
                 break
-        return {"variants": variants[:count]}
-    except Exception as e:
-        return {"error": str(e)}
+            feedback = checked["report"]
+        return {"index": index, "code": best["code"], "keywords": style,
+                "verdict": best["verdict"], "score": best["score"]}
+
+    results = fan_out(build_variant, styles, on_result=on_variant)
+    variants = [r for r in results if r and r.get("code")]
+    if not variants:
+        return {"error": next((r["error"] for r in results if r and r.get("error")), "No variants generated")}
+    return {"variants": variants}
 
 
 # ──────────────────────── MIME Types ────────────────────────
@@ -518,6 +598,13 @@ class Handler(BaseHTTPRequestHandler):
             self.send_json({"ok": True, "has_api_key": bool(api_key)})
             return
 
+        if path == "/api/metrics":
+            _ensure_root_on_path()
+            from agent import metrics, prefetch, providers, routing, scheduler
+            self.send_json({**metrics.snapshot(), "providers": providers.status(), "scheduler": scheduler.status(),
+                            "prefetch": prefetch.status(), "routing": routing.status()})
+            return
+
         if path == "/api/catalog":
             try:
                 qs = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
@@ -551,6 +638,9 @@ class Handler(BaseHTTPRequestHandler):
         if path == "/api/chat/stream":
             self.handle_stream(body)
             return
+        if path == "/api/prefetch":
+            self.handle_prefetch(body)
+            return
         if path == "/api/chat":
             self.handle_chat(body)
             return
@@ -579,8 +669,21 @@ class Handler(BaseHTTPRequestHandler):
 
         message = data.get("message", "").strip()
         history = data.get("history", [])
+        # Server-side session: the client sends only the new message (history just seeds a new session)
+        session_id = str(data.get("session_id") or "").strip()[:128] or None
         intent = data.get("intent", "").strip() or message
         library = data.get("library", "untitledui").strip() or "untitledui"
+        # Opt-in race mode (best-of-N generations) for latency-critical callers
+        try:
+            race = int(data.get("race") or os.environ.get("RACE_MODE_N", "0") or 0)
+        except (TypeError, ValueError):
+            race = 0
+        race = 0 if race <= 1 else min(race, RACE_MAX)  # each candidate is a full Sonnet generation
+        # Optional per-request time budget in seconds (default: per-workflow DEADLINE_*_S)
+        try:
+            deadline_s = float(data["deadline_s"]) if data.get("deadline_s") else None
+        except (TypeError, ValueError):
+            deadline_s = None
 
         if not message:
             self.send_sse_error("Message is required")
@@ -591,40 +694,74 @@ class Handler(BaseHTTPRequestHandler):
             self.send_sse_error("OPENAI_API_KEY not set. Add it to .env file.")
             return
 
+        # Stages already run on the draft while the user was typing (agent.prefetch)
+        _ensure_root_on_path()
+        from agent import prefetch
+        hit = prefetch.take(self._prefetch_keys(session_id), intent, library)
+
         # Smart routing: classify on clean intent, pass full message to pipeline
         if os.environ.get("USE_LANGGRAPH", "").lower() == "true":
-            workflow = _fast_classify(intent)
+            workflow = hit.get("classify") if hit else None
+            if workflow:
+                prefetch.used("classify", hit.seconds["classify"])
+            else:
+                workflow = _fast_classify(intent)
             print(f"[chatbot] Classified as: {workflow} (intent: {intent[:80]}, library: {library})")
-            if workflow == "chat":
-                self._handle_direct_chat(message, history, api_key)
+            if workflow == "chat" and not session_id:
+                self._handle_direct_chat(message, history, api_key, prefetched=hit)
             else:
-                self._handle_langgraph_stream(message, history, workflow=workflow, library=library)
+                # Session turns (chat included) go through the graph so they're checkpointed
+                self._handle_langgraph_stream(message, history, workflow=workflow, library=library, race=race,
+                                              session_id=session_id, deadline_s=deadline_s, prefetched=hit,
+                                              intent=intent)
             return
 
         # Fallback: direct Claude streaming (USE_LANGGRAPH=false)
-        self._handle_direct_chat(message, history, api_key, use_full_prompt=True)
+        self._handle_direct_chat(message, history, api_key, use_full_prompt=True, prefetched=hit)
+
+    def _prefetch_keys(self, session_id):
+        """Prefetch slots for this client: its session, else its address (a new conversation's
+        id only exists once its first message is sent)."""
+        address = f"client:{self.client_address[0]}"
+        return (session_id, address) if session_id else (address,)
 
-    def _handle_direct_chat(self, message, history, api_key, use_full_prompt=False):
+    def handle_prefetch(self, body):
+        """Speculatively classify / retrieve / discover the draft the user is typing (agent.prefetch).
+        Body: {text, library, session_id?, has_previous_code?}."""
+        _load_env()
+        try:
+            data = json.loads(body) if body else {}
+        except json.JSONDecodeError:
+            self.send_json({"error": "Invalid JSON"}, 400)
+            return
+        session_id = str(data.get("session_id") or "").strip()[:128] or None
+        library = data.get("library", "untitledui").strip() or "untitledui"
+        _ensure_root_on_path()
+        from agent import prefetch
+        status = prefetch.start(self._prefetch_keys(session_id)[0], data.get("text", ""), library,
+                                classify=_fast_classify, has_previous_code=bool(data.get("has_previous_code")))
+        self.send_json({"status": status})
+
+    def _handle_direct_chat(self, message, history, api_key, use_full_prompt=False, prefetched=None):
         """Fast direct GPT-4o-mini response for general chat — no pipeline overhead."""
-        import openai
         sys_prompt = SYSTEM_PROMPT if use_full_prompt else CHAT_SYSTEM_PROMPT
-        model_name = "gpt-4o" if use_full_prompt else "gpt-4o-mini"
 
         messages = [{"role": "system", "content": sys_prompt}]
-        for h in history[-20:]:
-            role = h.get("role", "user")
-            content = h.get("content", "")
-            if role in ("user", "assistant") and content:
-                messages.append({"role": role, "content": content})
+        messages.extend(_compact_history(history))
 
-        # RAG: inject relevant design system context
+        # RAG: inject relevant design system context (retrieved for the draft already, if prefetched)
         try:
             import sys as _sys
             _root = str(ROOT)
             if _root not in _sys.path:
                 _sys.path.insert(0, _root)
+            from agent import prefetch
             from agent.rag import query as rag_query
-            rag_context = rag_query(message, k=3)
+            rag_context = prefetched.get("rag") if prefetched else None
+            if rag_context is None:
+                rag_context = rag_query(message, k=3)
+            else:
+                prefetch.used("rag", prefetched.seconds["rag"])
             if rag_context:
                 messages.insert(1, {
                     "role": "system",
@@ -635,6 +772,13 @@ class Handler(BaseHTTPRequestHandler):
 
         messages.append({"role": "user", "content": message})
 
+        # Direct mode answers everything here: a greeting shouldn't pay for GPT-4o at 1500 tokens
+        route = None
+        if use_full_prompt:
+            _ensure_root_on_path()
+            from agent import routing
+            route = routing.route_chat(message, previous_code=_last_code(history))
+
         self.send_response(200)
         self.send_header("Content-Type", "text/event-stream")
         self.send_header("Cache-Control", "no-cache")
@@ -643,20 +787,12 @@ class Handler(BaseHTTPRequestHandler):
         self.end_headers()
 
         try:
-            oai_key = os.environ.get("OPENAI_API_KEY", "").strip() or api_key
-            client = openai.OpenAI(api_key=oai_key)
-            stream = client.chat.completions.create(
-                model=model_name,
-                max_tokens=1500,
-                messages=messages,
-                stream=True,
-            )
-            for chunk in stream:
-                delta = chunk.choices[0].delta if chunk.choices else None
-                if delta and delta.content:
-                    sse = json.dumps({"type": "chunk", "text": delta.content})
-                    self.wfile.write(f"data: {sse}\n\n".encode("utf-8"))
-                    self.wfile.flush()
+            # GPT-4o(-mini), or Claude while OpenAI's circuit is open
+            for text in _stream_completion(messages, primary="openai", max_tokens=1500, fast=not use_full_prompt,
+                                           lane="interactive", route=route):
+                sse = json.dumps({"type": "chunk", "text": text})
+                self.wfile.write(f"data: {sse}\n\n".encode("utf-8"))
+                self.wfile.flush()
 
             self.wfile.write(b'data: {"type":"done"}\n\n')
             self.wfile.flush()
@@ -716,41 +852,44 @@ class Handler(BaseHTTPRequestHandler):
             self.wfile.flush()
 
             # Build variant prompt
+            _ensure_root_on_path()
+            from agent import budget, routing
             ds = _load_design_system()
-            comps = ds.get("catalog", {}).get("components", [])[:12]
             style_desc = " ".join(f"Variant {i+1} ({keywords[i]}): emphasize that style." for i in range(count))
 
             user_content = f"Generate exactly {count} different React UI variants.\n\n"
             if last_request:
                 user_content += f"Original request: {last_request}\n\n"
             user_content += f"User says: {message}\n\nStyle descriptions: {style_desc}\n\n"
-            if last_code:
-                user_content += f"Base component to create variants from:\n```jsx\n{last_code[:2000]}\n```\n\n"
-            user_content += "Output format — use exactly this structure:\n"
+            output_format = "Output format — use exactly this structure:\n"
             for i in range(count):
-                user_content += f"\n## Variant {i+1}: {keywords[i]}\n```jsx\n// Complete React component here\n```\n"
-            user_content += "\nEach code block must be a complete runnable React function component ending with root.render(React.createElement(ComponentName));"
+                output_format += f"\n## Variant {i+1}: {keywords[i]}\n```jsx\n// Complete React component here\n```\n"
+            output_format += "\nEach code block must be a complete runnable React function component ending with root.render(React.createElement(ComponentName));"
 
-            system = f"""You are a React UI generator using the Untitled UI design system. Output {count} variants. Use Tailwind CSS.
-Available patterns: {json.dumps(comps, indent=2)[:2000]}
-Rules: valid JSX only, no markdown outside the required format. Single function component per variant.
+            rules = """Rules: valid JSX only, no markdown outside the required format. Single function component per variant.
 Use root.render(React.createElement(Component)); No imports; React/ReactDOM are global.
 Use DIFFERENT PascalCase component names for each variant (e.g. DashboardMinimal, DashboardBold).
 Buttons: bg-blue-600 hover:bg-blue-700 text-white rounded-lg shadow-sm. Cards: bg-white border border-gray-200 rounded-xl shadow-sm.
 Keep each variant under 60 lines. Include realistic sample data."""
-
-            # Stream from Claude
-            client = _get_anthropic_client()
-            with client.messages.stream(
-                model="claude-sonnet-4-20250514",
-                max_tokens=8192,
-                system=system,
-                messages=[{"role": "user", "content": user_content}],
-            ) as stream:
-                for text in stream.text_stream:
-                    sse = json.dumps({"type": "chunk", "text": text})
-                    self.wfile.write(f"data: {sse}\n\n".encode("utf-8"))
-                    self.wfile.flush()
+            # The base component is kept whole or dropped; the catalog gives way first
+            packed = budget.pack([
+                budget.Section("request", [user_content + output_format], required=True),
+                budget.Section("base_code", [f"Base component to create variants from:\n```jsx\n{last_code}\n```\n\n"]
+                               if last_code else [], priority=1),
+                budget.json_section("catalog", ds.get("catalog", {}).get("components", []), priority=2, max_tokens=600),
+            ], budget.budget_for(_model_for("anthropic")), site="variant_stream", base=rules)
+            user_content += packed["base_code"] + output_format
+            system = f"""You are a React UI generator using the Untitled UI design system. Output {count} variants. Use Tailwind CSS.
+Available patterns: {packed["catalog"]}
+{rules}"""
+
+            # Stream from Claude (GPT-4o while Anthropic's circuit is open)
+            messages = [{"role": "system", "content": system}, {"role": "user", "content": user_content}]
+            route = routing.route(message, previous_code=last_code, variants=count)
+            for text in _stream_completion(messages, route=route):
+                sse = json.dumps({"type": "chunk", "text": text})
+                self.wfile.write(f"data: {sse}\n\n".encode("utf-8"))
+                self.wfile.flush()
 
             self.wfile.write(b'data: {"type":"done"}\n\n')
             self.wfile.flush()
@@ -763,9 +902,11 @@ Keep each variant under 60 lines. Include realistic sample data."""
             except Exception:
                 pass
 
-    def _handle_langgraph_stream(self, message, history, workflow="", library="untitledui"):
+    def _handle_langgraph_stream(self, message, history, workflow="", library="untitledui", race=0, session_id=None,
+                                 deadline_s=None, prefetched=None, intent=""):
         """Route the request through the LangGraph multi-agent system.
-        Passes pre-classified workflow to skip the classify LLM call in the pipeline."""
+        Passes pre-classified workflow to skip the classify LLM call in the pipeline,
+        and the prefetched RAG / discovery results so those stages are skipped too."""
         import asyncio
         import sys
 
@@ -773,6 +914,7 @@ Keep each variant under 60 lines. Include realistic sample data."""
         if root not in sys.path:
             sys.path.insert(0, root)
 
+        from agent import prefetch
         from agent.server import run_agent_stream
 
         self.send_response(200)
@@ -782,9 +924,15 @@ Keep each variant under 60 lines. Include realistic sample data."""
         self.send_header("Access-Control-Allow-Origin", "*")
         self.end_headers()
 
+        # After the headers: a prefetched discovery that is nearly done is waited for briefly
+        handoff = prefetch.handoff(prefetched, workflow)
+
         async def _stream():
+            events = run_agent_stream(message, history, workflow=workflow, library=library, race=race,
+                                      session_id=session_id, deadline_s=deadline_s, prefetched=handoff,
+                                      intent=intent)
             try:
-                async for event in run_agent_stream(message, history, workflow=workflow, library=library):
+                async for event in events:
                     chunk = json.dumps(event)
                     self.wfile.write(f"data: {chunk}\n\n".encode("utf-8"))
                     self.wfile.flush()
@@ -795,6 +943,8 @@ Keep each variant under 60 lines. Include realistic sample data."""
                     self.wfile.flush()
                 except Exception:
                     pass
+            finally:
+                await events.aclose()  # a disconnected client leaves its shared run (agent.singleflight)
 
         try:
             loop = asyncio.new_event_loop()
@@ -837,21 +987,11 @@ Keep each variant under 60 lines. Include realistic sample data."""
             return
 
         messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-        for h in history[-30:]:
-            role = h.get("role", "user")
-            content = h.get("content", "")
-            if role in ("user", "assistant") and content:
-                messages.append({"role": role, "content": content})
+        messages.extend(_compact_history(history))
         messages.append({"role": "user", "content": message})
 
         try:
-            client = _get_openai_client()
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                max_tokens=4096,
-                messages=messages,
-            )
-            text = response.choices[0].message.content or ""
+            text = _complete(messages, primary="openai", lane="interactive")
             self.send_json({"content": text})
         except Exception as e:
             self.send_json({"error": str(e)}, 500)
@@ -915,11 +1055,46 @@ Keep each variant under 60 lines. Include realistic sample data."""
                 keywords = [str(k).strip() for k in keywords[:count]]
             else:
                 keywords = []
-            result = generate_variants(prompt, count, keywords)
+            library = (data.get("library") or "untitledui").strip()
+            if data.get("stream"):
+                self._stream_variants(prompt, count, keywords, library)
+                return
+            result = generate_variants(prompt, count, keywords, library=library)
             self.send_json(result)
         except Exception as e:
             self.send_json({"error": str(e)}, 500)
 
+    def _stream_variants(self, prompt, count, keywords, library):
+        """SSE variant of /api/generate-variants: one "variant" event per finished variant."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "keep-alive")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        def on_variant(v):
+            if v.get("code"):
+                sse = json.dumps({"type": "variant", **v})
+                self.wfile.write(f"data: {sse}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        try:
+            result = generate_variants(prompt, count, keywords, library=library, on_variant=on_variant)
+            if result.get("error"):
+                error_msg = json.dumps({"type": "error", "error": result["error"]})
+                self.wfile.write(f"data: {error_msg}\n\n".encode("utf-8"))
+            else:
+                self.wfile.write(b'data: {"type":"done"}\n\n')
+            self.wfile.flush()
+        except Exception as e:
+            error_msg = json.dumps({"type": "error", "error": str(e)})
+            try:
+                self.wfile.write(f"data: {error_msg}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            except Exception:
+                pass
+
     # ── Helpers ──
 
     def serve_file(self, file_path, content_type):
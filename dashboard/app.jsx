@@ -181,17 +181,42 @@
         const r = await fetch('/api/generate-variants', {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ prompt: p, count, keywords: kw.length ? kw : null })
+          body: JSON.stringify({ prompt: p, count, keywords: kw.length ? kw : null, stream: true })
         });
-        const text = await r.text();
-        let d;
-        try { d = JSON.parse(text); } catch (_) {
-          toast(text.trimStart().startsWith('<') ? 'Server returned a page instead of JSON. Open http://127.0.0.1:3850.' : 'Invalid response', true);
+        if (!(r.headers.get('Content-Type') || '').includes('text/event-stream')) {
+          const text = await r.text();
+          let d;
+          try { d = JSON.parse(text); } catch (_) {
+            toast(text.trimStart().startsWith('<') ? 'Server returned a page instead of JSON. Open http://127.0.0.1:3850.' : 'Invalid response', true);
+            setVariantsLoading(false);
+            return;
+          }
+          if (d.error) { toast(d.error, true); setVariants([]); }
+          else { setVariants(d.variants || []); toast('Generated ' + (d.variants && d.variants.length) + ' variant(s)'); }
           setVariantsLoading(false);
           return;
         }
-        if (d.error) { toast(d.error, true); setVariants([]); }
-        else { setVariants(d.variants || []); toast('Generated ' + (d.variants && d.variants.length) + ' variant(s)'); }
+        // Variants are generated concurrently and arrive as each one finishes
+        const reader = r.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let received = [];
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          const events = buffer.split('\n\n');
+          buffer = events.pop();
+          for (const ev of events) {
+            if (!ev.startsWith('data: ')) continue;
+            const d = JSON.parse(ev.slice(6));
+            if (d.type === 'variant') {
+              received = received.concat([d]).sort((a, b) => a.index - b.index);
+              setVariants(received);
+            } else if (d.type === 'error') toast(d.error, true);
+            else if (d.type === 'done') toast('Generated ' + received.length + ' variant(s)');
+          }
+        }
       } catch (err) { toast(err.message || 'Failed', true); }
       setVariantsLoading(false);
     };
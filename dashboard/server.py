@@ -3,6 +3,7 @@ import json
 import os
 import re
 import subprocess
+import sys
 import urllib.parse
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from pathlib import Path
@@ -91,6 +92,54 @@ def load_design_system():
     return out
 
 
+def _claude_request(system: str, messages: list) -> dict:
+    """messages.create kwargs with prompt-cache breakpoints on the system prompt and history (agent/prompt_cache.py)."""
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    from agent import prompt_cache
+    return prompt_cache.anthropic_request(system, messages)
+
+
+def _claude_slot(lane: str, system: str, messages: list):
+    """agent/scheduler.py slot (concurrency, RPM/TPM budget, priority lane, circuit breaker)
+    for one Sonnet call; `lane` is "interactive" or "generation"."""
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    from agent import scheduler
+    return scheduler.slot_sync("anthropic", lane, "claude-sonnet-4-20250514",
+                               messages=[{"role": "system", "content": system}, *messages], output_tokens=4096)
+
+
+def _budget():
+    """agent/budget.py, importing from the project root."""
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    from agent import budget
+    return budget
+
+
+def _pack_prompt(site: str, base: str, sections: list):
+    """Fit prompt sections to Sonnet's token budget (agent/budget.py); `base` is the fixed instructions."""
+    budget = _budget()
+    return budget.pack(sections, budget.budget_for("claude-sonnet-4-20250514"), site=site, base=base)
+
+
+def _design_sections(ds: dict, comps: list, prompt: str) -> list:
+    """Request + tokens + catalog sections for the generate prompts. Both are sent whole;
+    only a prompt over the budget is shrunk, and the catalog gives way first."""
+    budget = _budget()
+    return [
+        budget.Section("request", [prompt], required=True),
+        budget.json_section("tokens", ds.get("tokens", {}), priority=1),
+        budget.json_section("catalog", comps or [], priority=2),
+    ]
+
+
+def _record_cache_usage(msg, site: str) -> None:
+    from agent import prompt_cache
+    prompt_cache.record(getattr(msg, "usage", None), "anthropic", site)
+
+
 def chat_with_claude(message: str, history: list) -> dict:
     """Send message to Claude; history is list of {role, content}. Returns { content } or { error }."""
     _load_env_key()
@@ -104,19 +153,26 @@ def chat_with_claude(message: str, history: list) -> dict:
     ds = load_design_system()
     catalog = ds.get("catalog", {})
     comps = catalog.get("components", []) if isinstance(catalog, dict) else []
-    system = "You are a helpful coding assistant. The user is building UI with a design system. When they ask for UI/code, use the component catalog they have: " + json.dumps(comps[:20], indent=2) + ". Prefer React + Tailwind. Be concise."
-    messages = []
-    for h in history[-20:]:
-        messages.append({"role": h.get("role", "user"), "content": h.get("content", "")})
+    turns = [{"role": h.get("role", "user"), "content": h.get("content", "")} for h in history[-20:]]
+    intro = "You are a helpful coding assistant. The user is building UI with a design system. When they ask for UI/code, use the component catalog they have: "
+    budget = _budget()
+    packed = _pack_prompt("dashboard_chat", intro + ". Prefer React + Tailwind. Be concise.", [
+        budget.Section("message", [message], required=True),
+        budget.Section("history", [t["content"] for t in turns], priority=1, keep="tail"),
+        budget.json_section("catalog", comps[:20], priority=2),
+    ])
+    system = intro + packed["catalog"] + ". Prefer React + Tailwind. Be concise."
+    messages = [turns[i] for i in packed.kept("history")]
     messages.append({"role": "user", "content": message})
     try:
         client = anthropic.Anthropic(api_key=api_key)
-        msg = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4096,
-            system=system,
-            messages=messages,
-        )
+        with _claude_slot("interactive", system, messages):
+            msg = client.messages.create(
+                model="claude-sonnet-4-20250514",
+                max_tokens=4096,
+                **_claude_request(system, messages),
+            )
+        _record_cache_usage(msg, "dashboard.chat")
         text = msg.content[0].text if msg.content else ""
         return {"content": text}
     except Exception as e:
@@ -177,16 +233,9 @@ def generate_code(prompt: str) -> dict:
     if not api_key:
         return {"error": "ANTHROPIC_API_KEY not set. Set it in your environment to generate from this page."}
     ds = load_design_system()
-    tokens_str = json.dumps(ds.get("tokens", {}), indent=2)
     catalog = ds.get("catalog", {})
     comps = catalog.get("components", catalog) if isinstance(catalog, dict) else catalog
-    comps_str = json.dumps(comps, indent=2)
-    system = f"""You are a React UI generator. Output only a single React function component that satisfies the user's request.
-Use Tailwind CSS classes (via CDN). Use these design tokens for colors/spacing:
-{tokens_str}
-Available component patterns (use equivalent Tailwind + HTML):
-{comps_str}
-Rules:
+    rules = """Rules:
 - Output ONLY valid JavaScript/JSX. No markdown, no explanation.
 - Use the exact import paths from the catalog (e.g. from '@/components/base/buttons/button') when using those components. For dashboard preview you can also use inline Tailwind-only markup if imports would fail in a standalone snippet.
 - Single function component. Use React.createElement or JSX.
@@ -194,14 +243,23 @@ Rules:
 - Map primary color to blue-500/600, neutral to gray/slate.
 - The code will be injected where const root = ReactDOM.createRoot(document.getElementById('root')); already exists. So define a single function component (e.g. function App() { ... }) then call: root.render(React.createElement(App));
 - Do not use imports; assume React and ReactDOM are global."""
+    packed = _pack_prompt("dashboard_generate", rules, _design_sections(ds, comps, prompt))
+    system = f"""You are a React UI generator. Output only a single React function component that satisfies the user's request.
+Use Tailwind CSS classes (via CDN). Use these design tokens for colors/spacing:
+{packed["tokens"]}
+Available component patterns (use equivalent Tailwind + HTML):
+{packed["catalog"]}
+{rules}"""
     try:
         client = anthropic.Anthropic(api_key=api_key)
-        msg = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4096,
-            system=system,
-            messages=[{"role": "user", "content": prompt}],
-        )
+        request = [{"role": "user", "content": prompt}]
+        with _claude_slot("generation", system, request):
+            msg = client.messages.create(
+                model="claude-sonnet-4-20250514",
+                max_tokens=4096,
+                **_claude_request(system, request),
+            )
+        _record_cache_usage(msg, "dashboard.generate")
         text = msg.content[0].text if msg.content else ""
         code = text.strip()
         if code.startswith("```"):
@@ -216,8 +274,23 @@ Rules:
         return {"error": str(e)}
 
 
-def generate_variants(prompt: str, count: int, keywords: list) -> dict:
-    """Generate 2 or 3 React UI variants with optional description keywords. Returns { variants: [ { code, keywords } ] } or { error }."""
+def _qa_variant(code: str) -> dict:
+    """QA + auto-fix one variant via the agent package; skipped if its dependencies aren't installed."""
+    try:
+        from agent.variants import qa_and_fix
+        return qa_and_fix(code)
+    except ImportError:
+        return {"code": code, "verdict": None, "score": None, "report": ""}
+
+
+def generate_variants(prompt: str, count: int, keywords: list, on_variant=None) -> dict:
+    """Generate 2 or 3 React UI variants with optional description keywords, one concurrent Claude call per variant.
+    Each variant is QA'd (and retried once) on its own; on_variant(v) fires as each finishes.
+    Returns { variants: [ { code, keywords, verdict, score } ] } or { error }."""
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    from agent.variants import fan_out, name_suffix, plan_variants
+
     count = max(2, min(3, int(count)))
     _load_env_key()
     try:
@@ -227,75 +300,52 @@ def generate_variants(prompt: str, count: int, keywords: list) -> dict:
     api_key = os.environ.get("ANTHROPIC_API_KEY", "").strip()
     if not api_key:
         return {"error": "ANTHROPIC_API_KEY not set. Set it in .env for generate variants."}
-    keywords = list(keywords)[:count] if keywords else []
-    while len(keywords) < count:
-        keywords.append(f"Variant {len(keywords) + 1}")
+    styles = plan_variants(prompt, count=count, keywords=[k for k in (keywords or []) if not k.startswith("Variant ")])
     ds = load_design_system()
-    tokens_str = json.dumps(ds.get("tokens", {}), indent=2)
     catalog = ds.get("catalog", {})
     comps = catalog.get("components", catalog) if isinstance(catalog, dict) else catalog
-    comps_str = json.dumps(comps, indent=2)
-    style_desc = " ".join(f"Variant {i+1} ({keywords[i]}): emphasize that style." for i in range(count))
-    user_content = f"""Generate exactly {count} different React UI variants for this request. Each variant should match the same prompt but differ in style/approach as described.
+    rules = "Rules: valid JS/JSX only, no text outside the code block. Single function component. Use root.render(React.createElement(Component)); No imports; React/ReactDOM are global."
+    packed = _pack_prompt("dashboard_variants", rules, _design_sections(ds, comps[:15], prompt))
+    system = f"""You are a React UI generator. Output ONE variant as a single ```jsx code block. Use Tailwind CSS. Design tokens:
+{packed["tokens"]}
+Available patterns: {packed["catalog"]}
+{rules}"""
+    client = anthropic.Anthropic(api_key=api_key)
 
-Prompt: {prompt}
-
-Style descriptions (use these to differentiate): {style_desc}
+    def build_variant(index: int, style: str) -> dict:
+        user_content = f"""Build ONE React UI variant for this request.
 
-Output format — use exactly this structure with ## headers and ```jsx code blocks:
-## Variant 1: {keywords[0]}
-```jsx
-// React component code here
-```
+Prompt: {prompt}
 
-## Variant 2: {keywords[1]}
-```jsx
-// React component code here
-"""
-    if count >= 3:
-        user_content += f"""
-## Variant 3: {keywords[2]}
-```jsx
-// React component code here
-```
-"""
-    user_content += """
-Output ONLY the variants as above. No other text. Each code block must be a single runnable React function component; then root.render(React.createElement(ThatComponent));"""
-    system = f"""You are a React UI generator. Output {count} variants only. Use Tailwind CSS. Design tokens:
-{json.dumps(ds.get("tokens", {}), indent=2)}
-Available patterns: {json.dumps(comps[:15], indent=2)}
-Rules: valid JS/JSX only, no markdown outside the required ## and ``` format. Single function component per variant. Use root.render(React.createElement(Component)); No imports; React/ReactDOM are global."""
-    try:
-        client = anthropic.Anthropic(api_key=api_key)
-        msg = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=8192,
-            system=system,
-            messages=[{"role": "user", "content": user_content}],
-        )
-        text = (msg.content[0].text if msg.content else "").strip()
-        variants = []
-        pattern = re.compile(r"##\s*Variant\s*\d+\s*:?\s*([^\n]*)\s*```(?:jsx|javascript)?\s*\n(.*?)```", re.DOTALL | re.IGNORECASE)
-        for m in pattern.finditer(text):
-            label = (m.group(1) or "").strip() or keywords[len(variants)] if len(variants) < len(keywords) else f"Variant {len(variants)+1}"
-            code = m.group(2).strip()
-            if code:
-                variants.append({"code": code, "keywords": label})
-            if len(variants) >= count:
+Style (use this to differentiate): {style}
+The component name must end with '{name_suffix(style, index)}'. Output ONLY the code block: a single runnable React function component; then root.render(React.createElement(ThatComponent));"""
+        best, feedback = None, ""
+        for _ in range(2):
+            content = user_content + (f"\n\nQA FEEDBACK (fix these issues):\n{feedback}" if feedback else "")
+            request = [{"role": "user", "content": content}]
+            with _claude_slot("generation", system, request):
+                msg = client.messages.create(
+                    model="claude-sonnet-4-20250514",
+                    max_tokens=4096,
+                    **_claude_request(system, request),
+                )
+            _record_cache_usage(msg, "dashboard.variants")
+            text = (msg.content[0].text if msg.content else "").strip()
+            code_m = re.search(r"```(?:jsx|javascript)?\s*\n(.*?)```", text, re.DOTALL | re.IGNORECASE)
+            checked = _qa_variant(code_m.group(1).strip() if code_m else text)
+            if best is None or checked["verdict"] != "FAIL" or checked["score"] > best["score"]:
+                best = checked
+            if checked["verdict"] != "FAIL":
                 break
-        if len(variants) < count:
-            parts = re.split(r"##\s*Variant\s*\d+", text, flags=re.IGNORECASE)
-            for i, part in enumerate(parts[1 : count + 1]):
-                if i < len(variants):
-                    continue
-                code_m = re.search(r"```(?:jsx|javascript)?\s*\n(.*?)```", part, re.DOTALL | re.IGNORECASE)
-                if code_m:
-                    code = code_m.group(1).strip()
-                    if code:
-                        variants.append({"code": code, "keywords": keywords[i] if i < len(keywords) else f"Variant {i+1}"})
-        return {"variants": variants[:count]}
-    except Exception as e:
-        return {"error": str(e)}
+            feedback = checked["report"]
+        return {"index": index, "code": best["code"], "keywords": style,
+                "verdict": best["verdict"], "score": best["score"]}
+
+    results = fan_out(build_variant, styles, on_result=on_variant)
+    variants = [r for r in results if r and r.get("code")]
+    if not variants:
+        return {"error": next((r["error"] for r in results if r and r.get("error")), "No variants generated")}
+    return {"variants": variants}
 
 
 class Handler(BaseHTTPRequestHandler):
@@ -366,6 +416,9 @@ class Handler(BaseHTTPRequestHandler):
                     keywords = [str(k).strip() for k in keywords[:count]]
                 else:
                     keywords = []
+                if data.get("stream"):
+                    self.stream_variants(prompt, count, keywords)
+                    return
                 result = generate_variants(prompt, count, keywords)
                 self.send_json(result)
             except Exception as e:
@@ -422,6 +475,28 @@ class Handler(BaseHTTPRequestHandler):
             return
         self.send_error(404)
 
+    def stream_variants(self, prompt: str, count: int, keywords: list):
+        """SSE stream of variants: one "variant" event as each finishes, then "done" (or "error")."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        def send(event: dict):
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            result = generate_variants(prompt, count, keywords,
+                                       on_variant=lambda v: v.get("code") and send({"type": "variant", **v}))
+            send({"type": "error", "error": result["error"]} if result.get("error") else {"type": "done"})
+        except Exception as e:
+            try:
+                send({"type": "error", "error": str(e)})
+            except Exception:
+                pass
+
     def send_json(self, obj, status=200):
         self.send_response(status)
         self.send_header("Content-Type", "application/json; charset=utf-8")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Build the precomputed discovery plans for the UI archetypes (agent/archetypes.py).
+
+Runs discovery once per archetype in design_system/archetypes.json for each
+library, validates the plans against the library's catalog and stores them
+in design_system/.archetype_cache/<library>.json. Libraries whose stored
+plans are still current (same catalog and archetype list) are skipped unless
+--force is given. Needs OPENAI_API_KEY (or ANTHROPIC_API_KEY as fallback).
+
+Usage:
+  python scripts/build_archetype_plans.py
+  python scripts/build_archetype_plans.py --library metafore --force
+  python scripts/build_archetype_plans.py --match "create a login form"
+"""
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from agent import archetypes  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build precomputed discovery plans for UI archetypes")
+    parser.add_argument("--library", choices=sorted(archetypes.LIBRARIES), action="append",
+                        help="library to build (repeatable; default: all)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the stored plans are current")
+    parser.add_argument("--match", metavar="REQUEST", help="only show which archetype REQUEST matches")
+    args = parser.parse_args()
+
+    if args.match:
+        archetype = archetypes.match(args.match)
+        print(archetype["id"] if archetype else "no archetype")
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    from dotenv import load_dotenv
+    load_dotenv(ROOT / ".env")
+    if not (os.environ.get("OPENAI_API_KEY") or os.environ.get("ANTHROPIC_API_KEY")):
+        print("OPENAI_API_KEY not set — cannot run discovery")
+        sys.exit(1)
+
+    failed = False
+    for library in args.library or sorted(archetypes.LIBRARIES):
+        summary = archetypes.build(library, force=args.force)
+        if summary["status"] == "current":
+            print(f"{library}: plans are current (use --force to rebuild)")
+            continue
+        failed |= summary["status"] == "failed"
+        print(f"{library}: {summary['status']}, {summary.get('plans', 0)} plans")
+        for archetype_id, reason in summary.get("rejected", {}).items():
+            print(f"  rejected {archetype_id}: {reason}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Evaluate the local intent classifier on the labelled eval set.
+
+Reports accuracy of the local classifier (rules + model), the escalation
+rate at the configured threshold, accuracy of the combined local+LLM policy,
+and per-call latency. With --llm it also runs the GPT-4o-mini classifier on
+every example for comparison (needs OPENAI_API_KEY).
+
+Usage:
+  python scripts/eval_intent_classifier.py
+  python scripts/eval_intent_classifier.py --llm
+  python scripts/eval_intent_classifier.py --threshold 0.8 --show-errors
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from agent.intent import CONFIDENCE_THRESHOLD, DATA_DIR, LABELS, classify, llm_classify  # noqa: E402
+
+
+def load(path):
+    rows = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if line.strip():
+            row = json.loads(line)
+            rows.append((row["text"], row["label"]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the local intent classifier")
+    parser.add_argument("--eval", default=str(DATA_DIR / "eval.jsonl"))
+    parser.add_argument("--threshold", type=float, default=CONFIDENCE_THRESHOLD)
+    parser.add_argument("--llm", action="store_true", help="also classify every example with GPT-4o-mini")
+    parser.add_argument("--show-errors", action="store_true")
+    args = parser.parse_args()
+
+    if args.llm:
+        try:
+            from dotenv import load_dotenv
+            load_dotenv(ROOT / ".env")
+        except ImportError:
+            pass
+        if not os.environ.get("OPENAI_API_KEY"):
+            print("OPENAI_API_KEY not set — cannot run --llm")
+            sys.exit(1)
+
+    rows = load(args.eval)
+    local_hits = combined_hits = llm_hits = escalated = 0
+    sources = Counter()
+    per_label = {lbl: [0, 0] for lbl in LABELS}
+    errors = []
+    local_seconds = llm_seconds = 0.0
+
+    for text, label in rows:
+        t0 = time.perf_counter()
+        pred, conf, source = classify(text)
+        local_seconds += time.perf_counter() - t0
+        sources[source] += 1
+        local_hits += pred == label
+        per_label[label][0] += pred == label
+        per_label[label][1] += 1
+        if pred != label:
+            errors.append((text, label, pred, conf, source))
+
+        llm_pred = None
+        if args.llm:
+            t0 = time.perf_counter()
+            llm_pred = llm_classify(text)
+            llm_seconds += time.perf_counter() - t0
+            llm_hits += llm_pred == label
+
+        final = pred
+        if conf < args.threshold:
+            escalated += 1
+            final = llm_pred if llm_pred is not None else pred
+        combined_hits += final == label
+
+    n = len(rows)
+    print(f"examples: {n}  (rules: {sources['rule']}, model: {sources['model']})")
+    print(f"local accuracy:     {local_hits / n:.3f}")
+    for lbl, (hit, total) in per_label.items():
+        print(f"  {lbl:<9} {hit}/{total}")
+    print(f"escalated (<{args.threshold:.2f}): {escalated} ({escalated / n:.1%})")
+    if args.llm:
+        print(f"LLM accuracy:       {llm_hits / n:.3f}  (mean {llm_seconds / n * 1000:.0f} ms/call)")
+        print(f"local+LLM accuracy: {combined_hits / n:.3f}")
+    else:
+        print("local+LLM accuracy: n/a (run with --llm)")
+    print(f"local latency:      {local_seconds / n * 1e6:.0f} µs/call")
+
+    if args.show_errors and errors:
+        print("\nMisclassified:")
+        for text, label, pred, conf, source in errors:
+            print(f"  [{label} -> {pred} {conf:.2f} {source}] {text[:80]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Train the local intent classifier (agent/intent.py) and write its weights.
+
+Multinomial logistic regression over the hashed features from
+agent.intent.features(), trained with plain SGD. No numpy/sklearn needed,
+and the whole run takes a few seconds.
+
+Usage:
+  python scripts/train_intent_classifier.py
+  python scripts/train_intent_classifier.py --epochs 40 --lr 0.3 --l2 1e-3
+"""
+import argparse
+import json
+import math
+import random
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from agent.intent import DATA_DIR, LABELS, MODEL_PATH, bucket, features, predict_proba  # noqa: E402
+
+
+def load(path):
+    """Read {"text", "label"} rows from a JSONL file."""
+    rows = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if line.strip():
+            row = json.loads(line)
+            rows.append((row["text"], row["label"]))
+    return rows
+
+
+def train(rows, epochs, lr, l2, seed):
+    """SGD on softmax cross-entropy. Returns {label: {bucket: weight}}."""
+    rng = random.Random(seed)
+    weights = {lbl: {} for lbl in LABELS}
+    data = [([bucket(f) for f in features(text)], label) for text, label in rows]
+
+    for epoch in range(epochs):
+        rng.shuffle(data)
+        step = lr / (1 + 0.1 * epoch)
+        loss = 0.0
+        for buckets, label in data:
+            scores = {lbl: sum(weights[lbl].get(b, 0.0) for b in buckets) for lbl in LABELS}
+            top = max(scores.values())
+            exp = {lbl: math.exp(s - top) for lbl, s in scores.items()}
+            total = sum(exp.values())
+            loss -= math.log(max(exp[label] / total, 1e-12))
+            for lbl in LABELS:
+                grad = exp[lbl] / total - (1.0 if lbl == label else 0.0)
+                w = weights[lbl]
+                for b in buckets:
+                    w[b] = w.get(b, 0.0) * (1 - step * l2) - step * grad
+        print(f"epoch {epoch + 1:>3}  loss {loss / len(data):.4f}")
+    return weights
+
+
+def accuracy(rows, model):
+    """Fraction of rows whose argmax prediction matches the label."""
+    hits = 0
+    for text, label in rows:
+        probs = predict_proba(text, model)
+        hits += max(probs, key=probs.get) == label
+    return hits / len(rows) if rows else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the local intent classifier")
+    parser.add_argument("--train", default=str(DATA_DIR / "train.jsonl"))
+    parser.add_argument("--eval", default=str(DATA_DIR / "eval.jsonl"))
+    parser.add_argument("--output", default=str(MODEL_PATH))
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--lr", type=float, default=0.3)
+    parser.add_argument("--l2", type=float, default=3e-3)
+    parser.add_argument("--seed", type=int, default=13)
+    args = parser.parse_args()
+
+    rows = load(args.train)
+    print(f"Training on {len(rows)} examples")
+    weights = train(rows, args.epochs, args.lr, args.l2, args.seed)
+
+    # Drop near-zero weights to keep the shipped file small
+    pruned = {lbl: {str(b): round(v, 4) for b, v in w.items() if abs(v) >= 1e-3} for lbl, w in weights.items()}
+    model = {"labels": list(LABELS), "weights": {lbl: {int(b): v for b, v in w.items()} for lbl, w in pruned.items()}}
+
+    print(f"train accuracy: {accuracy(rows, model):.3f}")
+    if Path(args.eval).exists():
+        print(f"eval accuracy (model only, no rules): {accuracy(load(args.eval), model):.3f}")
+
+    Path(args.output).write_text(json.dumps({"labels": list(LABELS), "weights": pruned}, separators=(",", ":")),
+                                 encoding="utf-8")
+    print(f"Saved {sum(len(w) for w in pruned.values())} weights -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()